@@ -4,7 +4,9 @@
 # SPDX-FileCopyrightText: 2014, 2017 Linutronix GmbH
 
 import dataclasses
+import logging
 import os
+import time
 
 MARKED_INSTALL = 0
 MARKED_UPGRADE = 1
@@ -69,6 +71,7 @@ def getdeps(pkg):
 
 def getalldeps(c, pkgname):
     retval = []
+    seen = set()
     togo = [pkgname]
 
     while togo:
@@ -76,16 +79,37 @@ def getalldeps(c, pkgname):
         pkg = c[pp]
 
         for p in getdeps(pkg.candidate):
-            if p in retval:
+            if p in seen:
                 continue
             if p not in c:
                 continue
             retval.append(p)
+            seen.add(p)
             togo.append(p)
 
     return retval
 
 
+def getdepclosure(c, pkgnames):
+    """
+    Returns the set of 'pkgnames' together with all their direct and
+    indirect dependencies, computed in a single traversal.
+    """
+    closure = set(pkgnames)
+    togo = list(closure)
+
+    while togo:
+        pkg = c[togo.pop()]
+
+        for p in getdeps(pkg.candidate):
+            if p in closure or p not in c:
+                continue
+            closure.add(p)
+            togo.append(p)
+
+    return closure
+
+
 def pkgstate(pkg):
     if pkg.marked_install:
         return MARKED_INSTALL
@@ -121,63 +145,244 @@ def pkgsource(pkg):
     return source
 
 
-def fetch_source(name, version, destdir, progress=None):
-    import apt
-    import apt_pkg
+def is_present(fname, size, hashes):
+    """
+    Returns whether the file 'fname' exists with the expected 'size' and
+    apt_pkg.HashStringList 'hashes'.
+    """
+    try:
+        if os.path.getsize(fname) != size:
+            return False
+    except OSError:
+        return False
+    return hashes.verify_file(fname)
 
-    allow_untrusted = apt_pkg.config.find_b('APT::Get::AllowUnauthenticated', False)
-
-    rec = apt_pkg.SourceRecords()
-    acq = apt_pkg.Acquire(progress or apt.progress.text.AcquireProgress())
-
-    # poorman's iterator
-    while True:
-        next_p = rec.lookup(name)
-        # End of the list?
-        if not next_p:
-            raise ValueError(
-                f'No source found for {name}_{version}')
-        if version == rec.version:
-            break
-
-    # We don't allow untrusted package and the package is not
-    # marks as trusted
-    if not (allow_untrusted or rec.index.is_trusted):
-        raise apt.package.FetchError(
-            f"Can't fetch source {name}_{version}; "
-            f'Source {rec.index.describe} is not trusted')
-
-    # Copy from src to dst all files of the source package
-    dsc = None
-    files = []
-    for _file in rec.files:
-        src = os.path.basename(_file.path)
-        dst = os.path.join(destdir, src)
-
-        if 'dsc' == _file.type:
-            dsc = dst
-
-        if not (allow_untrusted or _file.hashes.usable):
-            raise apt.package.FetchError(
-                f"Can't fetch file {dst}. No trusted hash found.")
-
-        # acq is accumlating the AcquireFile, the files list only
-        # exists to prevent Python from GC the object .. I guess.
-        # Anyway, if we don't keep the list, We will get an empty
-        # directory
-        files.append(apt_pkg.AcquireFile(acq, rec.index.archive_uri(_file.path),
-                                         _file.hashes, _file.size, src, destfile=dst))
-    acq.run()
-
-    if dsc is None:
-        raise ValueError(f'No source found for {name}_{version}')
-
-    for item in acq.items:
-        if item.STAT_DONE != item.status:
-            raise apt.package.FetchError(
-                f"Can't fetch item {item.destfile}: {item.error_text}")
-
-    return os.path.abspath(dsc)
+
+def archive_filename(pkgver):
+    """
+    Returns the name, under which apt stores the package of the
+    apt.package.Version 'pkgver' in its archives.
+    """
+    version = pkgver.version.replace(':', '%3a')
+    ext = os.path.splitext(pkgver.filename)[1]
+    return f'{pkgver.package.shortname}_{version}_{pkgver.architecture}{ext}'
+
+
+def sha256_of(hashes):
+    """
+    Returns the SHA256 value of the apt_pkg.HashStringList 'hashes', or
+    None.
+    """
+    h = hashes.find('SHA256')
+    if h is None or h.hashtype != 'SHA256':
+        return None
+    return h.hashvalue
+
+
+class DownloadPlan:
+    """
+    Collects binary and source packages to download, and fetches all of
+    them with a single apt_pkg.Acquire run.  apt downloads from several
+    hosts in parallel, and pipelines the requests to each host.
+
+    Files, that already exist in the destination directory with the
+    expected size and hashes, are not downloaded again.  If a package
+    'pool' (see elbepack.pkgpool) is given, files are linked from there,
+    and the downloaded files are added to it.
+
+    Each package is added under a 'key'.  run() returns the path of the
+    .deb or .dsc file of each key, or the exception raised for it.
+    """
+
+    def __init__(self, pool=None):
+        import apt_pkg
+
+        self._pool = pool
+        self._allow_untrusted = apt_pkg.config.find_b('APT::Get::AllowUnauthenticated', False)
+        self._records = None
+
+        # key -> path of the .deb or .dsc, or exception
+        self._results = {}
+        # destination file -> (uri, hashes, size, description, keys)
+        self._files = {}
+
+        self.present = 0
+        self.pooled = 0
+        self.fetched = 0
+        self.fetched_bytes = 0
+        self.elapsed = 0.0
+
+    def _pool_get(self, hashes, dst):
+        try:
+            return self._pool is not None and self._pool.get(sha256_of(hashes), dst)
+        except OSError as e:
+            logging.warning('Can not link %s from the package pool: %s', dst, e)
+            return False
+
+    def _pool_put(self, fname, hashes):
+        try:
+            if self._pool is not None:
+                self._pool.put(fname, sha256_of(hashes))
+        except OSError as e:
+            logging.warning('Can not add %s to the package pool: %s', fname, e)
+
+    def _queue(self, key, uri, hashes, size, dst):
+        if dst in self._files:
+            self._files[dst][4].append(key)
+        elif is_present(dst, size, hashes):
+            self.present += 1
+            self._pool_put(dst, hashes)
+        elif self._pool_get(hashes, dst):
+            self.pooled += 1
+        else:
+            self._files[dst] = (uri, hashes, size, os.path.basename(dst), [key])
+
+    def fail(self, key, error):
+        self._results[key] = error
+
+    def add_binary(self, key, pkgver, destdir):
+        """
+        Adds the binary package of the apt.package.Version 'pkgver'.
+        """
+        import apt
+
+        try:
+            dst = os.path.join(destdir, os.path.basename(pkgver.filename))
+
+            pfile, _ = pkgver._cand.file_list[0]
+            index = pkgver.package._pcache._list.find_index(pfile)
+            if not (self._allow_untrusted or (index and index.is_trusted)):
+                raise apt.package.FetchError(
+                    f"Can't fetch {pkgver.package.name}_{pkgver.version}; "
+                    'Source is not trusted')
+
+            if not pkgver.uri:
+                raise ValueError(f'No URI for {pkgver.package.name}_{pkgver.version}')
+
+            hashes = pkgver._records.hashes
+            if not (self._allow_untrusted or hashes.usable):
+                raise apt.package.FetchError(
+                    f"Can't fetch file {dst}. No trusted hash found.")
+        except (ValueError, apt.package.FetchError) as e:
+            self.fail(key, e)
+            return
+
+        self._results[key] = os.path.abspath(dst)
+        self._queue(key, pkgver.uri, hashes, pkgver.size, dst)
+
+    def add_source(self, key, name, version, destdir):
+        """
+        Adds all files of the source package 'name' in 'version'.
+        """
+        import apt
+        import apt_pkg
+
+        if self._records is None:
+            self._records = apt_pkg.SourceRecords()
+
+        rec = self._records
+        rec.restart()
+
+        try:
+            # poorman's iterator
+            while True:
+                next_p = rec.lookup(name)
+                # End of the list?
+                if not next_p:
+                    raise ValueError(
+                        f'No source found for {name}_{version}')
+                if version == rec.version:
+                    break
+
+            # We don't allow untrusted package and the package is not
+            # marks as trusted
+            if not (self._allow_untrusted or rec.index.is_trusted):
+                raise apt.package.FetchError(
+                    f"Can't fetch source {name}_{version}; "
+                    f'Source {rec.index.describe} is not trusted')
+
+            dsc = None
+            files = []
+            for _file in rec.files:
+                dst = os.path.join(destdir, os.path.basename(_file.path))
+
+                if 'dsc' == _file.type:
+                    dsc = dst
+
+                if not (self._allow_untrusted or _file.hashes.usable):
+                    raise apt.package.FetchError(
+                        f"Can't fetch file {dst}. No trusted hash found.")
+
+                files.append((rec.index.archive_uri(_file.path), _file.hashes, _file.size, dst))
+
+            if dsc is None:
+                raise ValueError(f'No source found for {name}_{version}')
+        except (ValueError, apt.package.FetchError) as e:
+            self.fail(key, e)
+            return
+
+        self._results[key] = os.path.abspath(dsc)
+        for uri, hashes, size, dst in files:
+            self._queue(key, uri, hashes, size, dst)
+
+    def run(self, progress=None):
+        import apt
+        import apt_pkg
+
+        if self._files:
+            acq = apt_pkg.Acquire(progress or apt.progress.text.AcquireProgress())
+
+            # acq is accumlating the AcquireFile, the items list only
+            # exists to prevent Python from GC the objects
+            items = []
+            for dst, (uri, hashes, size, descr, keys) in self._files.items():
+                items.append((apt_pkg.AcquireFile(acq, uri, hashes, size, descr, destfile=dst),
+                              hashes, size, keys))
+
+            start = time.monotonic()
+            acq.run()
+            self.elapsed = time.monotonic() - start
+
+            for item, hashes, size, keys in items:
+                if item.status != item.STAT_DONE:
+                    error = apt.package.FetchError(
+                        f"Can't fetch item {item.destfile}: {item.error_text}")
+                    for key in keys:
+                        self.fail(key, error)
+                    continue
+
+                self.fetched += 1
+                self.fetched_bytes += size
+                self._pool_put(item.destfile, hashes)
+
+            self._files = {}
+
+            if self._pool is not None:
+                removed, freed = self._pool.evict()
+                if removed:
+                    logging.info('Evicted %d files, %.1f MiB from the package pool',
+                                 removed, freed / 2**20)
+
+        return self._results
+
+    def summary(self):
+        """
+        Describes the amount and throughput of the downloads of run().
+        """
+        mib = self.fetched_bytes / 2**20
+        return (f'Downloaded {self.fetched} files, {mib:.1f} MiB in {self.elapsed:.1f} s '
+                f'({mib / max(self.elapsed, 1e-3):.1f} MiB/s), '
+                f'{self.present} files already present, '
+                f'{self.pooled} files linked from the package pool')
+
+
+def fetch_source(name, version, destdir, progress=None):
+    plan = DownloadPlan()
+    plan.add_source(name, name, version, destdir)
+    result = plan.run(progress)[name]
+    if isinstance(result, Exception):
+        raise result
+    return result
 
 
 def parse_built_using(value):
@@ -4,8 +4,8 @@
 
 import logging
 import os
-from queue import Queue
-from threading import Thread
+from collections import deque
+from threading import Condition, Thread
 
 from elbepack.elbeproject import AptCacheCommitError, AptCacheUpdateError
 from elbepack.log import elbe_logging, read_maxlevel, reset_level
@@ -143,12 +143,15 @@ class BuildChrootTarJob(AsyncWorkerJob):
 
 
 class BuildJob(AsyncWorkerJob):
-    def __init__(self, project, build_bin, build_src, skip_pbuilder, base_image_path):
+    def __init__(self, project, build_bin, build_src, skip_pbuilder, base_image_path,
+                 build_cache=None, jobs=1):
         super().__init__(project)
         self.build_bin = build_bin
         self.build_src = build_src
         self.skip_pbuilder = skip_pbuilder
         self.base_image_path = base_image_path
+        self.build_cache = build_cache
+        self.jobs = jobs
 
     def enqueue(self, queue, db):
         db.set_busy(self.project.builddir,
@@ -166,7 +169,9 @@ class BuildJob(AsyncWorkerJob):
                                build_bin=self.build_bin,
                                build_sources=self.build_src,
                                skip_pbuild=self.skip_pbuilder,
-                               base_image_path=self.base_image_path)
+                               base_image_path=self.base_image_path,
+                               build_cache=self.build_cache,
+                               jobs=self.jobs)
         except (DebootstrapException, AptCacheCommitError, AptCacheUpdateError) as e:
             if isinstance(e, DebootstrapException):
                 err = 'Debootstrap failed to install the base rootfilesystem.'
@@ -280,17 +285,76 @@ class UpdatePbuilderJob(AsyncWorkerJob):
             db.reset_busy(self.project.builddir, success)
 
 
-class AsyncWorker(Thread):
-    def __init__(self, db):
-        super().__init__(name='AsyncWorker')
+class _JobQueue:
+    """
+    Queue of pending jobs, which hands out the oldest job of a project,
+    that has no other job running.  As a project can only have one job
+    enqueued while it is busy, this schedules the projects round-robin.
+    """
+
+    def __init__(self):
+        self.cond = Condition()
+        self.jobs = deque()
+        self.running = set()
+        self.stopped = False
+
+    def put(self, job):
+        with self.cond:
+            self.jobs.append(job)
+            self.cond.notify_all()
+
+    def get(self):
+        """
+        Returns the next job, or None when the queue is stopped and
+        all jobs have been handed out.
+        """
+        with self.cond:
+            while True:
+                for job in self.jobs:
+                    if job.project.builddir not in self.running:
+                        self.jobs.remove(job)
+                        self.running.add(job.project.builddir)
+                        return job
+
+                if self.stopped and not self.jobs:
+                    return None
+
+                self.cond.wait()
+
+    def task_done(self, job):
+        with self.cond:
+            self.running.discard(job.project.builddir)
+            self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+
+class AsyncWorker:
+    """
+    Pool of 'jobs' worker threads.  Jobs of different projects run
+    concurrently, jobs of the same project one after another.
+    """
+
+    def __init__(self, db, jobs=1):
         self.db = db
-        self.queue = Queue()
-        self.start()
+        self.queue = _JobQueue()
+
+        # The build code uses absolute paths, so the current directory
+        # of the process does not matter to the workers.
+        os.chdir('/')
+
+        self.threads = [Thread(target=self.run, name=f'AsyncWorker-{i}')
+                        for i in range(max(jobs, 1))]
+        for t in self.threads:
+            t.start()
 
     def stop(self):
-        self.queue.put(None)
-        self.queue.join()
-        self.join()
+        self.queue.stop()
+        for t in self.threads:
+            t.join()
 
     def enqueue(self, job):
         job.enqueue(self.queue, self.db)
@@ -299,10 +363,10 @@ class AsyncWorker(Thread):
         while True:
             job = self.queue.get()
             if job is None:
-                self.queue.task_done()
                 break
 
-            os.chdir('/')
-            with elbe_logging(projects=job.project.builddir):
-                job.execute(self.db)
-            self.queue.task_done()
+            try:
+                with elbe_logging(projects=job.project.builddir):
+                    job.execute(self.db)
+            finally:
+                self.queue.task_done(job)
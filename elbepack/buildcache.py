@@ -0,0 +1,204 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import contextlib
+import errno
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import urllib.parse
+import urllib.request
+
+from elbepack.hashes import sha256sum
+from elbepack.shellhelper import do
+from elbepack.version import elbe_version
+
+
+_sources_list_re = re.compile(r'^(?:deb|deb-src)\s+(?:\[[^\]]*\]\s+)?(\S+)\s+(\S+)')
+
+
+def _release_opener(url, proxy_env):
+    """
+    Returns an opener, which uses the proxies of 'proxy_env' (as returned
+    by elbepack.rfs.proxy_env()) instead of the ones of the environment.
+    """
+    host = urllib.parse.urlsplit(url).hostname
+    proxies = {}
+    if host not in proxy_env.get('no_proxy', '').split(','):
+        for scheme in ('http', 'https'):
+            if proxy_env.get(f'{scheme}_proxy'):
+                proxies[scheme] = proxy_env[f'{scheme}_proxy']
+
+    return urllib.request.build_opener(urllib.request.ProxyHandler(proxies))
+
+
+def upstream_release_digest(sources_list, proxy_env=None):
+    """
+    Returns a digest over the InRelease (or Release) files of all
+    repositories referenced by 'sources_list'.
+    None is returned, if one of them can not be retrieved.
+    """
+    m = hashlib.sha256()
+
+    for line in sources_list.splitlines():
+        match = _sources_list_re.match(line.strip())
+        if match is None:
+            continue
+
+        url, suite = match.groups()
+        if suite.endswith('/'):
+            # flat repository
+            base = f"{url.rstrip('/')}/{suite}"
+        else:
+            base = f"{url.rstrip('/')}/dists/{suite}/"
+
+        if proxy_env is None:
+            urlopen = urllib.request.urlopen
+        else:
+            urlopen = _release_opener(base, proxy_env).open
+
+        for release in ('InRelease', 'Release'):
+            try:
+                with urlopen(base + release, timeout=60) as f:
+                    m.update(f.read())
+                break
+            except (OSError, ValueError):
+                continue
+        else:
+            logging.info('Unable to retrieve release file from %s', base)
+            return None
+
+    return m.hexdigest()
+
+
+def files_digest(root, patterns):
+    """
+    Returns a digest over the names and contents of all files below
+    'root' matching one of the glob 'patterns'.
+    """
+    m = hashlib.sha256()
+    for pattern in patterns:
+        for fname in sorted(glob.glob(os.path.join(root, pattern))):
+            if os.path.isfile(fname):
+                m.update(os.path.relpath(fname, root).encode())
+                m.update(sha256sum(fname).encode())
+    return m.hexdigest()
+
+
+class BuildCache:
+    """
+    Content addressed store for the results of build stages.
+
+    Every entry lives in <path>/<stage>/<key>/, where the key is a
+    sha256 over the elbe version, the name of the stage and all inputs
+    of the stage.  An entry holds copies of the files and directories,
+    that the stage produced.
+    """
+
+    def __init__(self, path, max_entries=4):
+        self.path = path
+        self.max_entries = max_entries
+
+    def key(self, stage, *inputs):
+        m = hashlib.sha256()
+        for i in (elbe_version, stage, *inputs):
+            if not isinstance(i, bytes):
+                i = str(i).encode()
+            m.update(len(i).to_bytes(8, 'big'))
+            m.update(i)
+        return m.hexdigest()
+
+    def _entry(self, stage, key):
+        return os.path.join(self.path, stage, key)
+
+    @contextlib.contextmanager
+    def _locked(self, stage, shared=False):
+        """
+        Locks the entries of 'stage' against concurrent builds.  Restoring
+        only needs a shared lock, storing and pruning an exclusive one.
+        """
+        stagedir = os.path.join(self.path, stage)
+        os.makedirs(stagedir, exist_ok=True)
+
+        fd = os.open(stagedir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield stagedir
+        finally:
+            os.close(fd)
+
+    def restore(self, stage, key, destdir):
+        """
+        Copy the content of a cache entry into 'destdir'.
+        Returns the list of restored names, or None on a cache miss.
+        """
+        entry = self._entry(stage, key)
+
+        with self._locked(stage, shared=True):
+            if not os.path.isdir(entry):
+                logging.info('Build cache miss for %s', stage)
+                return None
+
+            names = sorted(os.listdir(entry))
+            for name in names:
+                do(['cp', '-a', '--reflink=auto', os.path.join(entry, name), destdir])
+
+            # Remember the usage for pruning
+            os.utime(entry)
+
+        logging.info('Restored %s from build cache', stage)
+        return names
+
+    def store(self, stage, key, paths):
+        """
+        Store copies of 'paths' as the result of 'stage'.  If another build
+        has stored the same entry meanwhile, that entry is kept.
+        """
+        stagedir = os.path.join(self.path, stage)
+        os.makedirs(stagedir, exist_ok=True)
+
+        entry = self._entry(stage, key)
+        if os.path.isdir(entry):
+            return
+
+        # The copies are made without holding the lock
+        tmpdir = tempfile.mkdtemp(dir=stagedir, prefix='.tmp-')
+        try:
+            for path in paths:
+                do(['cp', '-a', '--reflink=auto', path, tmpdir])
+
+            with self._locked(stage):
+                try:
+                    os.rename(tmpdir, entry)
+                except OSError as e:
+                    if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                        raise
+                    shutil.rmtree(tmpdir, ignore_errors=True)
+                    return
+
+                logging.info('Stored %s in build cache', stage)
+                self._prune(stagedir)
+        except BaseException:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+
+    def _prune(self, stagedir):
+        entries = [os.path.join(stagedir, e) for e in os.listdir(stagedir)
+                   if not e.startswith('.')]
+        entries.sort(key=os.path.getmtime, reverse=True)
+
+        for entry in entries[self.max_entries:]:
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def prune(self, stage):
+        """
+        Only keep the 'max_entries' most recently used entries of 'stage'.
+        """
+        with self._locked(stage) as stagedir:
+            self._prune(stagedir)
@@ -5,13 +5,13 @@
 import logging
 import os
 import pathlib
-import subprocess
 from shutil import copyfile
 
 from apt.package import FetchError
 
 from elbepack.aptpkgutils import XMLPackage
 from elbepack.archivedir import archive_tmpfile
+from elbepack.filecopy import copy_tree
 from elbepack.isooptions import get_iso_options
 from elbepack.repomanager import CdromBinRepo, CdromInitRepo, CdromSrcRepo
 from elbepack.rpcaptcache import get_rpcaptcache
@@ -19,21 +19,41 @@ from elbepack.shellhelper import do
 
 CDROM_SIZE = 640 * 1000 * 1000
 
+initvm_bin_repo = '/var/cache/elbe/initvm-bin-repo'
 
-def add_source_pkg(repo, component, cache, pkg, version, forbid):
-    if pkg in forbid:
-        logging.info('Ignoring source package %s', pkg)
-        return
-    pkg_id = f'{pkg}-{version}'
-    try:
-        dsc = cache.download_source(pkg,
-                                    version,
-                                    '/var/cache/elbe/sources')
-        repo.includedsc(dsc, components=component, force=True)
-    except ValueError as e:
-        logging.exception("No sources for package '%s': %s", pkg_id, str(e))
-    except FetchError as e:
-        logging.exception("Source for package '%s' could not be downloaded: %s", pkg_id, str(e))
+
+def _download_error(pkg_id, error, what='Package'):
+    if isinstance(error, FetchError):
+        logging.error("%s '%s' could not be downloaded: %s", what, pkg_id, error)
+    elif isinstance(error, TypeError):
+        logging.error("%s '%s' missing name or version", what, pkg_id)
+    else:
+        logging.error("No %s '%s': %s", what.lower(), pkg_id, error)
+
+
+def fetch_source_pkgs(cache, pkgs, forbid):
+    """
+    Downloads the source packages 'pkgs', a list of (name, version),
+    except the ones in 'forbid', all at once.  Returns the .dsc files.
+    """
+    wanted = []
+    for pkg, version in dict.fromkeys(pkgs):
+        if pkg in forbid:
+            logging.info('Ignoring source package %s', pkg)
+        else:
+            wanted.append((pkg, version))
+
+    results, summary = cache.download_sources(wanted, '/var/cache/elbe/sources')
+    logging.info('Sources: %s', summary)
+
+    dscs = []
+    for pkg, version in wanted:
+        dsc = results[(pkg, version)]
+        if isinstance(dsc, Exception):
+            _download_error(f'{pkg}-{version}', dsc, what='Source')
+        else:
+            dscs.append(dsc)
+    return dscs
 
 
 def mk_source_cdrom(components, codename,
@@ -68,18 +88,18 @@ def mk_source_cdrom(components, codename,
                             os.path.join(target, f'srcrepo-{component}'),
                             cdrom_size, mirror)
         repos[component] = repo
-        for pkg, version in pkg_lst:
-            add_source_pkg(repo, component,
-                           cache, pkg, version,
-                           forbidden_src_packages)
+
+        # All sources are downloaded first, so the repository can plan
+        # their distribution over the volumes
+        srcpkgs = list(pkg_lst)
 
         if component == 'main' and xml is not None:
             for p in xml.node('debootstrappkgs'):
                 pkg = XMLPackage(p)
-                srcpkgs = cache.get_corresponding_source_packages([pkg])
-                for srcpkg, srcpkg_ver in srcpkgs:
-                    add_source_pkg(repo, component, cache, srcpkg, srcpkg_ver,
-                                   forbidden_src_packages)
+                srcpkgs.extend(cache.get_corresponding_source_packages([pkg]))
+
+        dscs = fetch_source_pkgs(cache, srcpkgs, forbidden_src_packages)
+        repo.includedscs(dscs, components=component, force=True)
 
     # elbe fetch_initvm_pkgs has downloaded all sources to
     # /var/cache/elbe/sources
@@ -143,58 +163,56 @@ def mk_binary_cdrom(rfs, arch, codename, init_codename, xml, target):
     # initvm repo has been built upon initvm creation
     # just copy it. the repo __init__() afterwards will
     # not touch the repo config, nor generate a new key.
-    try:
-        do(f'cp -av /var/cache/elbe/initvm-bin-repo "{repo_path}"')
-    except subprocess.CalledProcessError:
+    # The packages are never modified, so they are shared by hardlinks.
+    if os.path.isdir(initvm_bin_repo):
+        copy_tree(initvm_bin_repo, str(repo_path),
+                  link=lambda path: f'{os.sep}pool{os.sep}' in path)
+    else:
         # When /var/cache/elbe/initvm-bin-repo has not been created
         # (because the initvm install was an old version or somthing,
         #  log an error, and continue with an empty directory.
-        logging.exception('/var/cache/elbe/initvm-bin-repo does not exist\n'
-                          'The generated CDROM will not contain initvm pkgs\n'
-                          'This happened because the initvm was probably\n'
-                          'generated with --skip-build-bin')
+        logging.error('/var/cache/elbe/initvm-bin-repo does not exist\n'
+                      'The generated CDROM will not contain initvm pkgs\n'
+                      'This happened because the initvm was probably\n'
+                      'generated with --skip-build-bin')
 
-        do(f'mkdir -p "{repo_path}"')
+        repo_path.mkdir(parents=True, exist_ok=True)
 
     repo = CdromInitRepo(init_codename, repo_path, mirror)
 
     target_repo = CdromBinRepo(arch, codename, None,
                                target_repo_path, mirror)
 
-    if xml is not None:
-        cache = get_rpcaptcache(rfs, arch)
-        for p in xml.node('debootstrappkgs'):
-            pkg = XMLPackage(p)
-            pkg_id = f'{pkg.name}-{pkg.installed_version}'
-            try:
-                deb = cache.download_binary(pkg.name,
-                                            '/var/cache/elbe/binaries/main',
-                                            pkg.installed_version)
-                target_repo.includedeb(deb, 'main', prio=pkg.installed_prio)
-            except ValueError:
-                logging.exception("No package '%s'", pkg_id)
-            except FetchError:
-                logging.exception("Package '%s' could not be downloaded", pkg_id)
-            except TypeError:
-                logging.exception("Package '%s' missing name or version", pkg_id)
-
     cache = get_rpcaptcache(rfs, arch)
+
+    debootstrap_pkgs = []
+    if xml is not None:
+        debootstrap_pkgs = [XMLPackage(p) for p in xml.node('debootstrappkgs')]
     pkglist = cache.get_installed_pkgs()
-    for pkg in pkglist:
-        pkg_id = f'{pkg.name}-{pkg.installed_version}'
-        try:
-            deb = cache.download_binary(pkg.name,
-                                        '/var/cache/elbe/binaries/added',
-                                        pkg.installed_version)
+
+    # All packages are downloaded at once
+    wanted = [(pkg.name, pkg.installed_version, '/var/cache/elbe/binaries/main')
+              for pkg in debootstrap_pkgs]
+    wanted += [(pkg.name, pkg.installed_version, '/var/cache/elbe/binaries/added')
+               for pkg in pkglist]
+    debs, summary = cache.download_binaries(wanted)
+    logging.info('Binaries: %s', summary)
+
+    # The packages are included in batches at the end of the block
+    with target_repo.bulk():
+        for pkg, key in zip(debootstrap_pkgs, wanted):
+            deb = debs[key]
+            if isinstance(deb, Exception):
+                _download_error(f'{pkg.name}-{pkg.installed_version}', deb)
+                continue
+            target_repo.includedeb(deb, 'main', prio=pkg.installed_prio)
+
+        for pkg, key in zip(pkglist, wanted[len(debootstrap_pkgs):]):
+            deb = debs[key]
+            if isinstance(deb, Exception):
+                _download_error(f'{pkg.name}-{pkg.installed_version}', deb)
+                continue
             target_repo.includedeb(deb, 'added', pkg.name, prio=pkg.installed_prio, force=True)
-        except KeyError as ke:
-            logging.exception(str(ke))
-        except ValueError:
-            logging.exception("No package '%s'", pkg_id)
-        except FetchError:
-            logging.exception("Package '%s' could not be downloaded", pkg_id)
-        except TypeError:
-            logging.exception("Package '%s' missing name or version", pkg_id)
 
     target_repo.finalize()
 
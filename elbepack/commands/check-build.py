@@ -3,21 +3,37 @@
 # SPDX-FileCopyrightText: 2020 Linutronix GmbH
 
 import argparse
+import gzip
 import logging
+import lzma
 import os
 import pathlib
+import posixpath
+import re
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import apt_pkg
+
+from debian.deb822 import Dsc, Packages, Sources
+from debian.debfile import DebFile
 
 import pexpect
 
 from elbepack import qemu_firmware
 from elbepack.aptpkgutils import parse_built_using
+from elbepack.filecopy import copy_file
 from elbepack.filesystem import TmpdirFilesystem
-from elbepack.log import elbe_logging
+from elbepack.iso9660 import ISO9660
+from elbepack.log import elbe_logging, logging_thread_alias
 from elbepack.main import run_elbe_subcommand
 from elbepack.packers import find_packed_image
 from elbepack.shellhelper import env_add
@@ -32,6 +48,10 @@ def run_command(argv):
     aparser.add_argument('cmd', choices=['all', *_checks.keys()],
                          help='Check to run')
     aparser.add_argument('build_dir', help='Build directory')
+    aparser.add_argument('--jobs', type=int, default=1,
+                         help='Number of images to boot concurrently')
+    aparser.add_argument('--timeout', type=int, default=120,
+                         help='Timeout in seconds for each expected output of a booted image')
 
     args = aparser.parse_args(argv)
 
@@ -52,7 +72,7 @@ def run_command(argv):
         for test in tests:
 
             logging.info('Starting test %s (%s)', test.__name__, test.__doc__)
-            ret = test(directory)()
+            ret = test(directory, jobs=args.jobs, timeout=args.timeout)()
 
             total_cnt += 1
             if ret:
@@ -72,8 +92,10 @@ class CheckException(Exception):
 
 class CheckBase:
 
-    def __init__(self, directory):
+    def __init__(self, directory, jobs=1, timeout=120):
         self.directory = directory
+        self.jobs = jobs
+        self.timeout = timeout
         self.ret = 0
 
     def __call__(self):
@@ -113,101 +135,145 @@ class CheckSchema(CheckBase):
         run_elbe_subcommand(['validate', self.directory / 'source.xml'])
 
 
+def _open_index(iso, path):
+    f = iso.open(path)
+    if path.endswith('.gz'):
+        return gzip.GzipFile(fileobj=f)
+    if path.endswith('.xz'):
+        return lzma.LZMAFile(f)
+    return f
+
+
+def _find_indices(iso, name):
+    """
+    Returns the paths of the indices 'name' (Packages or Sources) below
+    dists/ of 'iso'.  Only one of the compressed variants of an index is
+    returned.
+    """
+    indices = {}
+    for path in iso.files:
+        if not path.startswith('dists/'):
+            continue
+
+        directory, base = posixpath.split(path)
+        for rank, ext in enumerate(('', '.gz', '.xz')):
+            if base == name + ext:
+                if directory not in indices or indices[directory][0] > rank:
+                    indices[directory] = (rank, path)
+
+    return sorted(path for _, path in indices.values())
+
+
+def _packages_index(iso):
+    """Returns the stanzas of the Packages indices of 'iso', by file name"""
+    index = {}
+    for path in _find_indices(iso, 'Packages'):
+        with _open_index(iso, path) as f:
+            for stanza in Packages.iter_paragraphs(f, use_apt_pkg=False):
+                index[stanza['Filename']] = stanza
+    return index
+
+
+def _sources_index(iso):
+    """Returns the stanzas of the Sources indices of 'iso', by .dsc file name"""
+    index = {}
+    for path in _find_indices(iso, 'Sources'):
+        with _open_index(iso, path) as f:
+            for stanza in Sources.iter_paragraphs(f, use_apt_pkg=False):
+                # The Sources index names the source package 'Package'
+                fields = {'Source': stanza['Package'], 'Version': stanza['Version']}
+                for file in stanza.get('Files', []):
+                    if file['name'].endswith('.dsc'):
+                        index[f"{stanza['Directory']}/{file['name']}"] = fields
+    return index
+
+
 @_register_check('cdrom')
 class CheckCdroms(CheckBase):
 
     """Check for cdroms integrity"""
 
-    def extract_cdrom(self, tgt, cdrom):
+    def read_cdrom(self, cdrom, ext, read_index, read_file):
+        """
+        Returns the control fields of all files ending with 'ext' in the
+        image 'cdrom'.  They are taken from the repository index, as read by
+        'read_index', and only read by 'read_file' from files, which are
+        not listed there.
+        """
         try:
-            subprocess.run(['7z', 'x', '-o' + tgt, cdrom], check=True)
-        except subprocess.CalledProcessError as E:
-            self.fail(f'Failed to extract cdrom {cdrom}:\n{E}')
+            with ISO9660(cdrom) as iso:
+                index = read_index(iso)
+                infos = []
+                for path in sorted(iso.files):
+                    if not path.endswith(ext):
+                        continue
 
-    def dpkg_get_infos(self, path, fmt):
-        """Get dpkg infos for .deb and .dsc file formats"""
-        try:
-            if path.endswith('.deb'):
-                cmd = ['dpkg', '-f', path, *fmt]
-            elif path.endswith('.dsc'):
-                cmd = ['grep', '-E', '^(' + '|'.join(fmt) + '):', path]
-            return subprocess.run(cmd, capture_output=True).stdout.decode('utf-8')
-        except subprocess.CalledProcessError as E:
-            self.fail(
-                f"Failed to get debian infos ({'|'.join(fmt)}) "
-                f'for {path}:\n{E}')
+                    fields = index.get(path)
+                    if fields is None:
+                        with iso.open(path) as f:
+                            fields = read_file(f)
+                    infos.append(fields)
+                return infos
+        except (OSError, ValueError, KeyError) as E:
+            self.fail(f'Failed to read cdrom {cdrom}:\n{E}')
+
+    def read_bin_cdrom(self, cdrom):
+        return self.read_cdrom(cdrom, '.deb', _packages_index,
+                               lambda f: DebFile(fileobj=f).debcontrol())
+
+    def read_src_cdrom(self, cdrom):
+        return self.read_cdrom(cdrom, '.dsc', _sources_index, Dsc)
 
     @staticmethod
     def cmp_version(v1, v2):
-        return subprocess.run([
-            'dpkg', '--compare-versions', v1, 'eq', v2,
-        ]).returncode
+        return apt_pkg.version_compare(v1, v2)
 
-    def do_src(self, sources, src_total):
+    def do_src(self, sources, src_total, cdroms):
         """Check for sources in src-cdrom*"""
 
-        iso_it = self.directory.glob('src-cdrom*')
         src_cnt = 0
 
-        # For every src-cdrom*, extract it to a temporary directory
-        # and find all *.dsc files
-        for cdrom in iso_it:
-            with TmpdirFilesystem() as tmp:
-                self.extract_cdrom(tmp.path, cdrom)
-                for _, realpath in tmp.walk_files():
-                    if not realpath.endswith('.dsc'):
-                        continue
-
-                    infos = self.dpkg_get_infos(realpath,
-                                                ['Source', 'Version'])
-                    src_name = None
-                    src_version = None
+        # For every src-cdrom*, go through the control fields of all
+        # *.dsc files
+        for infos in cdroms:
+            for info in infos:
+                src_name = info.get('Source')
+                src_version = info.get('Version')
 
-                    for info in infos.split('\n'):
+                if src_name in sources:
 
-                        if info.startswith('Source:'):
-                            src_name = info.split('Source:')[1].strip(' ')
+                    match = False
 
-                        # Same as for the binary version.  The
-                        # PGP's signature contains a version field
-                        elif info.startswith('Version:'):
-                            if not src_version:
-                                src_version = info.split('Version:')[1].strip(' ')
+                    for version in sources[src_name]:
 
-                    if src_name in sources:
+                        # Found a matching version; prune it
+                        if self.cmp_version(version, src_version) == 0:
 
-                        match = False
+                            logging.info('Validating source %s_%s',
+                                         src_name, version)
 
-                        for version in sources[src_name]:
-
-                            # Found a matching version; prune it
-                            if self.cmp_version(version, src_version) == 0:
-
-                                logging.info('Validating source %s_%s',
-                                             src_name, version)
-
-                                sources[src_name].remove(version)
-                                src_cnt += 1
-                                match = True
-
-                                break
-
-                        # NOTE! - Because the way the source table is
-                        # generated, it's not possible to have multiple time
-                        # the same version of a source (you have different
-                        # versions only).  However, this is totally possible
-                        # for cdrom because of multiple components.  Thus,
-                        # whenever the source table can handle per component
-                        # sources, this case should emit an error instead of
-                        # a warning
-                        if not match:
-                            logging.warning("Can't find matching version for source %s_%s.\n"
-                                            'It might have already been validated',
-                                            src_name, src_version)
-                    else:
-                        logging.error('Extra source %s_%s found',
-                                      src_name, src_version)
-                        self.ret = 1
+                            sources[src_name].remove(version)
+                            src_cnt += 1
+                            match = True
+
+                            break
+
+                    # NOTE! - Because the way the source table is
+                    # generated, it's not possible to have multiple time
+                    # the same version of a source (you have different
+                    # versions only).  However, this is totally possible
+                    # for cdrom because of multiple components.  Thus,
+                    # whenever the source table can handle per component
+                    # sources, this case should emit an error instead of
+                    # a warning
+                    if not match:
+                        logging.warning("Can't find matching version for source %s_%s.\n"
+                                        'It might have already been validated',
+                                        src_name, src_version)
+                else:
+                    logging.error('Extra source %s_%s found',
+                                  src_name, src_version)
+                    self.ret = 1
 
         # List missing sources
         for src_name in sources:
@@ -221,7 +287,7 @@ class CheckCdroms(CheckBase):
         if src_cnt != src_total:
             self.ret = 1
 
-    def do_bin(self):
+    def do_bin(self, cdroms):
         """Check for binaries in bin-cdrom*.
 
         Return a tuple of the form ({ "source-name" : [versions ..] }, src_cnt).
@@ -269,104 +335,73 @@ class CheckCdroms(CheckBase):
 
             bin_total += 1
 
-        # For every bin-cdrom, create a temporary directory where to
-        # extract it and find all *.deb files
-        #
-        for cdrom in self.directory.glob('bin-cdrom*'):
-            with TmpdirFilesystem() as tmp:
-                self.extract_cdrom(tmp.path, cdrom)
-                for _, realpath in tmp.walk_files():
-                    if not realpath.endswith('.deb'):
-                        continue
-
-                    # Extract informations from .deb
-                    infos = self.dpkg_get_infos(realpath, ['Package',
-                                                           'Source',
-                                                           'Version',
-                                                           'Built-Using'])
-                    src_name = None
-                    src_version = None
-                    bin_name = None
-                    bin_version = None
-
-                    for line in infos.split('\n'):
-
-                        # Package: <PACKAGE>
-                        if line.startswith('Package:'):
-                            bin_name = line.split('Package:')[1].strip(' \t')
-
-                        # Version: <VERSION>
-                        #
-                        # Skip PGP's version.  The package version is
-                        # supposed to be before the PGP signature.  However,
-                        # the PGP signature will put a 'Version' field.
-                        # Thus, let's check if we already have found a
-                        # binary version and don't overwrite it
-                        elif line.startswith('Version:'):
-                            if not bin_version:
-                                bin_version = line.split('Version:')[1].strip(' ')
-
-                        # Source: <SOURCE> [(VERSION)]
-                        #
-                        # This field is optional.  If it is not present, the
-                        # source package default to the bin package
-                        elif line.startswith('Source:'):
-                            src_infos = line.split('Source:')[1].strip(' ').split(' ')
-                            src_name = src_infos[0]
-                            if len(src_infos) > 1:
-                                src_version = src_infos[1].strip('()')
-
-                        # Built-Using: <SRC (=VERSION)>...
-                        #
-                        # Sources list in the built-using field are
-                        # seperated by a comma
-                        elif line.startswith('Built-Using:'):
-
-                            built_using = line.split('Built-Using:')[1].strip(' ')
-
-                            for name, version in parse_built_using(built_using):
-                                # TODO - This is not component aware!
-                                if name in sources:
-                                    if version not in sources[name]:
-                                        sources[name].add(version)
-                                        src_cnt += 1
-                                else:
-                                    src_cnt += 1
-                                    sources[name] = {version}
-
-                    # No source was found
-                    if src_name is None:
-                        src_name = bin_name
-                        src_version = bin_version
-
-                    # No source version was found
-                    elif src_version is None:
-                        src_version = bin_version
-
-                    # TODO - This is not component aware!
-                    #
-                    # Let's build a dictionnary of sources of the form
-                    # {"source-name" : [versions ..]}. Same as the binary
-                    # dictionnary before
-                    if src_name in sources:
-                        if src_version not in sources[src_name]:
-                            sources[src_name].add(src_version)
+        # For every bin-cdrom, go through the control fields of all
+        # *.deb files
+        for infos in cdroms:
+            for info in infos:
+                bin_name = info.get('Package')
+                bin_version = info.get('Version')
+                src_name = None
+                src_version = None
+
+                # Source: <SOURCE> [(VERSION)]
+                #
+                # This field is optional.  If it is not present, the
+                # source package default to the bin package
+                if 'Source' in info:
+                    src_infos = info['Source'].strip(' ').split(' ')
+                    src_name = src_infos[0]
+                    if len(src_infos) > 1:
+                        src_version = src_infos[1].strip('()')
+
+                # Built-Using: <SRC (=VERSION)>...
+                #
+                # Sources list in the built-using field are
+                # seperated by a comma
+                if 'Built-Using' in info:
+                    for name, version in parse_built_using(info['Built-Using']):
+                        # TODO - This is not component aware!
+                        if name in sources:
+                            if version not in sources[name]:
+                                sources[name].add(version)
+                                src_cnt += 1
+                        else:
                             src_cnt += 1
-                    else:
-                        sources[src_name] = {src_version}
+                            sources[name] = {version}
+
+                # No source was found
+                if src_name is None:
+                    src_name = bin_name
+                    src_version = bin_version
+
+                # No source version was found
+                elif src_version is None:
+                    src_version = bin_version
+
+                # TODO - This is not component aware!
+                #
+                # Let's build a dictionnary of sources of the form
+                # {"source-name" : [versions ..]}. Same as the binary
+                # dictionnary before
+                if src_name in sources:
+                    if src_version not in sources[src_name]:
+                        sources[src_name].add(src_version)
                         src_cnt += 1
-
-                    # Prune version of this binary
-                    bin_cnt += 1
-                    try:
-                        binaries[bin_name].remove(bin_version)
-                        logging.info('Validating binary %s_%s',
-                                     bin_name, bin_version)
-                        logging.info('Adding source %s_%s', src_name, src_version)
-                    except KeyError:
-                        logging.error('Foreign binary found %s_%s',
-                                      bin_name, bin_version)
-                        self.ret = 1
+                else:
+                    sources[src_name] = {src_version}
+                    src_cnt += 1
+
+                # Prune version of this binary
+                bin_cnt += 1
+                try:
+                    binaries[bin_name].remove(bin_version)
+                    logging.info('Validating binary %s_%s',
+                                 bin_name, bin_version)
+                    logging.info('Adding source %s_%s', src_name, src_version)
+                except (KeyError, ValueError):
+                    logging.error('Foreign binary found %s_%s',
+                                  bin_name, bin_version)
+                    self.ret = 1
 
         # List all missing binaries
         for bin_name in binaries:
@@ -382,8 +417,18 @@ class CheckCdroms(CheckBase):
         return sources, src_cnt
 
     def run(self):
-        sources, src_cnt = self.do_bin()
-        self.do_src(sources, src_cnt)
+        apt_pkg.init()
+
+        # The images are read in parallel, and checked in order
+        with ThreadPoolExecutor() as executor:
+            bin_cdroms = executor.map(self.read_bin_cdrom,
+                                      sorted(self.directory.glob('bin-cdrom*')))
+            src_cdroms = executor.map(self.read_src_cdrom,
+                                      sorted(self.directory.glob('src-cdrom*')))
+
+            sources, src_cnt = self.do_bin(bin_cdroms)
+            self.do_src(sources, src_cnt, src_cdroms)
+
         return self.ret
 
 
@@ -392,6 +437,12 @@ class CheckImage(CheckBase):
 
     """Check if image can boot"""
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._unpacked = {}
+        self._unpack_locks = {}
+        self._lock = threading.Lock()
+
     @staticmethod
     def open_tgz(path):
         tmp = tempfile.NamedTemporaryFile(prefix='elbe')
@@ -400,10 +451,39 @@ class CheckImage(CheckBase):
         ], check=True, stdout=tmp)
         return tmp
 
-    def open_img(self, path):
-        if path.name.endswith('.tar.gz'):
-            return self.open_tgz(path)
-        return open(path)
+    def unpack_img(self, path):
+        """
+        Returns the name of the raw image 'path'.  A packed image is
+        only unpacked once, even if several checks boot it.
+        """
+        if not path.name.endswith('.tar.gz'):
+            return str(path)
+
+        with self._lock:
+            lock = self._unpack_locks.setdefault(path, threading.Lock())
+
+        with lock:
+            if path not in self._unpacked:
+                self._unpacked[path] = self.open_tgz(path)
+            return self._unpacked[path].name
+
+    @contextmanager
+    def open_img(self, path, private):
+        """
+        Yields the name of the image file to boot.  If 'private' is set,
+        the guest gets its own copy of the image, so it does not see the
+        changes of other boots of the same image.  The copy shares the
+        data blocks with the original, if the filesystem supports it.
+        """
+        img = self.unpack_img(path)
+        if not private:
+            yield img
+            return
+
+        with tempfile.TemporaryDirectory(prefix='elbe', dir=os.path.dirname(img)) as tmp:
+            copy = os.path.join(tmp, os.path.basename(img))
+            copy_file(img, copy)
+            yield copy
 
     def run(self):
 
@@ -412,10 +492,24 @@ class CheckImage(CheckBase):
         fail_cnt = 0
         total_cnt = 0
 
-        # For all image
-        for tag in self.xml.all('.//check-image-list/check'):
-            fail_cnt += self.do_img(tag)
-            total_cnt += 1
+        checks = list(self.xml.all('.//check-image-list/check'))
+        boots = Counter(tag.text('./img') for tag in checks)
+
+        owner = threading.current_thread().ident
+
+        def _do_img(n, tag):
+            with logging_thread_alias(owner):
+                return self.do_img(n, tag, private=boots[tag.text('./img')] > 1)
+
+        try:
+            # Independent images are booted concurrently
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                for ret in executor.map(_do_img, range(len(checks)), checks):
+                    fail_cnt += ret
+                    total_cnt += 1
+        finally:
+            for tmp in self._unpacked.values():
+                tmp.close()
 
         for tag in self.xml.all('.//check-image-list/check-script'):
             fail_cnt += self.do_check_script(tag)
@@ -453,7 +547,7 @@ class CheckImage(CheckBase):
             '-machine', 'pflash0=pflash0',
         ])
 
-    def do_img(self, tag):
+    def do_img(self, n, tag, private=False):
 
         img = tag.text('./img')
         img_name = find_packed_image(self.directory, img)
@@ -467,14 +561,17 @@ class CheckImage(CheckBase):
         if interpreter_firmware is not None:
             fw_opts = self._firmware_opts(interpreter_firmware)
 
-        with self.open_img(img_name) as img:
+        with self.open_img(img_name, private) as boot_img:
+
+            # ELBE_IMG always points to the opened image.  It is passed
+            # to each guest, instead of being set in the shared os.environ
+            env = dict(os.environ, ELBE_IMG=boot_img)
 
-            # ELBE_IMG always points to the opened image
-            os.environ['ELBE_IMG'] = img.name
+            opts = _expandvars(tag
+                               .text('./interpreter-opts')
+                               .strip(' \t\n'), env)
 
-            opts = os.path.expandvars(tag
-                                      .text('./interpreter-opts')
-                                      .strip(' \t\n'))
+            logfile = self.directory / f'check-img-{n}-{img}.log'
 
             for candidate, action in [('login',  self.do_login),
                                       ('serial', self.do_serial)]:
@@ -482,12 +579,13 @@ class CheckImage(CheckBase):
                 element = tag.et.find(os.path.join('./action', candidate))
 
                 if element is not None:
-                    return action(element, img_name, qemu, opts + ' ' + fw_opts)
+                    return action(element, img_name, qemu, opts + ' ' + fw_opts,
+                                  env, logfile)
 
         # No valid action!
         return 1
 
-    def do_login(self, _element, img_name, qemu, opts):
+    def do_login(self, _element, img_name, qemu, opts, env, logfile):
 
         passwd = 'root'
         if self.xml.node('.//action/login'):
@@ -510,64 +608,73 @@ class CheckImage(CheckBase):
             ('EOF', ''),
         ]
 
-        return self.do_comm(img_name, qemu, opts, comm)
+        return self.do_comm(img_name, qemu, opts, comm, env, logfile)
 
-    def do_serial(self, element, img_name, qemu, opts):
+    def do_serial(self, element, img_name, qemu, opts, env, logfile):
 
-        comm = [(action.tag, action.et.text) for action in element]
+        comm = [(action.tag, action.text) for action in element]
 
-        return self.do_comm(img_name, qemu, opts, comm)
+        return self.do_comm(img_name, qemu, opts, comm, env, logfile)
 
-    def do_comm(self, img_name, qemu, opts, comm):
+    def do_comm(self, img_name, qemu, opts, comm, env, logfile):
 
-        child = pexpect.spawn(qemu + ' ' + opts, cwd=self.directory)
         transcript = []
+        steps = []
         ret = 0
 
-        try:
-            for action, text in comm:
-
-                if action == 'expect':
-
-                    # Try to expect something from the guest If there's a
-                    # timeout; the test fails Otherwise; Add to the transcript
-                    # what we received
-                    try:
-                        child.expect(text, timeout=120)
-                    except pexpect.exceptions.TIMEOUT:
-                        logging.error('Was expecting "%s" but got timeout (%ds)',
-                                      text, child.timeout)
-                        ret = 1
+        with open(logfile, 'wb') as log:
+            child = pexpect.spawn(qemu + ' ' + opts, cwd=self.directory, env=env)
+
+            # Everything the guest prints goes to its own log, while it runs
+            child.logfile_read = log
+
+            try:
+                for action, text in comm:
+
+                    steps.append((action, text, time.monotonic()))
+
+                    if action == 'expect':
+
+                        # Try to expect something from the guest If there's a
+                        # timeout; the test fails Otherwise; Add to the transcript
+                        # what we received
+                        try:
+                            child.expect(text, timeout=self.timeout)
+                        except pexpect.exceptions.TIMEOUT:
+                            logging.error('Was expecting "%s" but got timeout (%ds)',
+                                          text, self.timeout)
+                            ret = 1
+                            break
+                        else:
+                            transcript.append(child.before.decode('utf-8'))
+                            transcript.append(child.after.decode('utf-8'))
+
+                    elif action == 'sendline':
+                        child.sendline(text)
+
+                    # We're expecting the serial line to be closed by the guest.  If
+                    # there's a timeout, it means that the guest has not closed the
+                    # line and the test has failed.  In every case the test ends
+                    # here.
+                    elif action == 'EOF':
+                        try:
+                            child.expect(pexpect.EOF)
+                        except pexpect.exceptions.TIMEOUT:
+                            logging.error('Was expecting EOF but got timeout (%ds)',
+                                          child.timeout)
+                            ret = 1
+                        else:
+                            transcript.append(child.before.decode('utf-8'))
                         break
-                    else:
-                        transcript.append(child.before.decode('utf-8'))
-                        transcript.append(child.after.decode('utf-8'))
-
-                elif action == 'sendline':
-                    child.sendline(text)
-
-                # We're expecting the serial line to be closed by the guest.  If
-                # there's a timeout, it means that the guest has not closed the
-                # line and the test has failed.  In every case the test ends
-                # here.
-                elif action == 'EOF':
-                    try:
-                        child.expect(pexpect.EOF)
-                    except pexpect.exceptions.TIMEOUT:
-                        print(
-                            'Was expecting EOF but got timeout '
-                            f'({child.timeout})')
-                        self.ret = 1
-                    else:
-                        transcript.append(child.before.decode('utf-8'))
-                    break
-
-        # Woops. The guest has die and we didn't expect that!
-        except pexpect.exceptions.EOF as E:
-            logging.error('Communication was interrupted unexpectedly %s', E)
-            ret = 1
-
-        child.close()
+
+            # Woops. The guest has die and we didn't expect that!
+            except pexpect.exceptions.EOF as E:
+                logging.error('Communication was interrupted unexpectedly %s', E)
+                ret = 1
+            finally:
+                child.close()
+
+        end = time.monotonic()
 
         logging.info('Transcript for image %s:\n'
                      '~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n'
@@ -575,6 +682,10 @@ class CheckImage(CheckBase):
                      '~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~',
                      img_name, ''.join(transcript))
 
+        logging.info('Timings for image %s (log in %s):\n%s\n%7.1f s  total',
+                     img_name, logfile, _format_steps(steps, end),
+                     end - steps[0][2] if steps else 0)
+
         return ret or child.exitstatus
 
     def do_check_script(self, tag):
@@ -597,6 +708,33 @@ class CheckImage(CheckBase):
         return not not ps.returncode
 
 
+def _expandvars(s, env):
+    """
+    Expands $VAR and ${VAR} in 's' from 'env', like os.path.expandvars()
+    does it from os.environ.  Unknown variables are left unchanged.
+    """
+    def _expand(m):
+        name = m.group(1) or m.group(2)
+        return env.get(name, m.group(0))
+
+    return re.sub(r'\$(?:(\w+)|\{([^}]*)\})', _expand, s)
+
+
+def _format_steps(steps, end):
+    """
+    Formats the duration of each step of a boot check.  A step lasts
+    until the next one starts.  The text of sent lines is not shown,
+    as it may be a password.
+    """
+    lines = []
+    for i, (action, text, start) in enumerate(steps):
+        stop = steps[i + 1][2] if i + 1 < len(steps) else end
+        if action == 'sendline':
+            text = ''
+        lines.append(f'{stop - start:7.1f} s  {action} {text or ""}'.rstrip())
+    return '\n'.join(lines)
+
+
 def _append_to_path_variable(var, value, env):
     if var in env:
         env[var] = env[var] + ':' + value
@@ -69,9 +69,14 @@ def _set_xml(client, args):
               help='Build source CDROM')
 @add_argument('--skip-pbuilder', action='store_true', dest='skip_pbuilder',
               help="skip pbuilder section of XML (don't build packages)")
+@add_argument('--build-cache', action='store_true', dest='build_cache',
+              help='Reuse results of unchanged build stages from the build cache')
+@add_argument('--jobs', type=int, default=1,
+              help='Number of independent build stages to run concurrently')
 @_add_project_dir_argument
 def _build(client, args):
-    client.service.build(args.project_dir, args.build_bin, args.build_sources, args.skip_pbuilder)
+    client.service.build(args.project_dir, args.build_bin, args.build_sources, args.skip_pbuilder,
+                         None, args.build_cache, args.jobs)
 
 
 @_add_project_dir_argument
@@ -8,11 +8,16 @@ import datetime
 import itertools
 import json
 import os
+import re
 import sys
 import urllib.parse
 
 from elbepack.aptpkgutils import XMLPackage
-from elbepack.commands.parselicence import LicenseType, extract_licenses_from_report
+from elbepack.commands.parselicence import (
+    LicenseType,
+    extract_licenses,
+    license_dep5_to_spdx,
+)
 from elbepack.elbexml import ElbeXML
 from elbepack.uuid7 import uuid7
 from elbepack.version import elbe_version
@@ -129,46 +134,43 @@ class _FileStream:
         return open(self.path, self.mode)
 
 
-def run_command(argv):
-    aparser = argparse.ArgumentParser(prog='elbe cyclonedx-sbom')
-    aparser.add_argument('-o', '--output', type=_FileStream('w', sys.stdout), default='-')
-    aparser.add_argument('-e', '--errors', type=_FileStream('w', sys.stderr), default='-')
-    aparser.add_argument('-d', dest='elbe_build', required=True)
-    aparser.add_argument('-m', dest='mapping', nargs='?', default=None)
-    args = aparser.parse_args(argv)
+class _SBOM:
+    """
+    The packages of a build and their licences, from which the SBOM
+    formats are generated.  Both licence files are read once, and the
+    components are built once per package.
+    """
 
-    ts = datetime.datetime.now(tz=datetime.timezone.utc)
-    project_dir = args.elbe_build
-    source_file = ElbeXML(os.path.join(project_dir, 'source.xml'))
-
-    project_name = source_file.text('/name').strip()
-    project_version = source_file.text('/version').strip()
-    project_description = source_file.text('/description').strip()
-    licenses = extract_licenses_from_report(
-                   os.path.join(project_dir, 'licence-target.xml'), args.mapping)
-    chroot_lics = extract_licenses_from_report(
-                   os.path.join(project_dir, 'licence-chroot.xml'), args.mapping)
-
-    pkg_list = []
-    for p in source_file.node('fullpkgs'):
-        pkg = XMLPackage(p)
-        pkg_list.append(pkg)
-
-    components = []
-    for pkg in pkg_list:
-        components.append(_component_from_apt_pkg(pkg, licenses))
-
-    formulation_components = []
-    for p in itertools.chain(
-        source_file.node('debootstrappkgs') or [],
-        source_file.node('initvmpkgs') or [],
-    ):
-        # Duplicates are disallowed by the schema
-        c = _component_from_apt_pkg(XMLPackage(p), chroot_lics)
-        if c not in formulation_components:
-            formulation_components.append(c)
+    def __init__(self, project_dir, mapping_fname):
+        source_file = ElbeXML(os.path.join(project_dir, 'source.xml'))
+
+        self.name = source_file.text('/name').strip()
+        self.version = source_file.text('/version').strip()
+        self.description = source_file.text('/description').strip()
 
-    output = {
+        mapping = license_dep5_to_spdx(mapping_fname)
+        self.licenses = extract_licenses(
+            os.path.join(project_dir, 'licence-target.xml'), mapping)
+        self.chroot_licenses = extract_licenses(
+            os.path.join(project_dir, 'licence-chroot.xml'), mapping)
+
+        self.packages = [XMLPackage(p) for p in source_file.node('fullpkgs')]
+        self.components = [_component_from_apt_pkg(pkg, self.licenses)
+                           for pkg in self.packages]
+
+        # Duplicates are disallowed by the schema
+        formulation = {}
+        for p in itertools.chain(
+            source_file.node('debootstrappkgs') or [],
+            source_file.node('initvmpkgs') or [],
+        ):
+            c = _component_from_apt_pkg(XMLPackage(p), self.chroot_licenses)
+            formulation.setdefault((c['name'], c['version'], c['purl']), c)
+        self.formulation_components = list(formulation.values())
+
+
+def _cyclonedx_document(sbom, ts):
+    return {
         'bomFormat': 'CycloneDX',
         'specVersion': '1.6',
         'serialNumber': uuid7(ts).urn,
@@ -184,40 +186,141 @@ def run_command(argv):
           ],
           'component': {
             'type': 'operating-system',
-            'name': project_name,
-            'version': project_version,
-            'description': project_description,
+            'name': sbom.name,
+            'version': sbom.version,
+            'description': sbom.description,
           },
         },
-        'components': components,
+        'components': sbom.components,
         'formulation': [
           {
-            'components': formulation_components,
+            'components': sbom.formulation_components,
           },
         ],
     }
 
+
+_spdx_checksum_algorithms = {
+    'MD5': 'MD5',
+    'SHA-1': 'SHA1',
+    'SHA-256': 'SHA256',
+    'SHA-512': 'SHA512',
+}
+
+_spdx_id_re = re.compile(r'[^A-Za-z0-9.-]')
+
+
+def _spdx_id(prefix, name):
+    return prefix + _spdx_id_re.sub('-', name)
+
+
+def _spdx_package(component, extracted, used_refs):
+    expressions = []
+    for lic in component.get('licenses', []):
+        lic = lic['license']
+        if 'id' in lic:
+            expressions.append(lic['id'])
+        elif 'text' in lic:
+            # Every distinct text of a licence gets its own reference
+            key = (lic['name'], lic['text']['content'])
+            if key not in extracted:
+                ref = _spdx_id('LicenseRef-', lic['name'])
+                if ref in used_refs:
+                    ref = f'{ref}-{len(extracted)}'
+                used_refs.add(ref)
+                extracted[key] = {
+                    'licenseId': ref,
+                    'name': lic['name'],
+                    'extractedText': lic['text']['content'],
+                }
+            expressions.append(extracted[key]['licenseId'])
+        else:
+            expressions.append(f"({lic['name']})")
+
+    return {
+        'SPDXID': _spdx_id('SPDXRef-Package-', f"{component['name']}-{component['version']}"),
+        'name': component['name'],
+        'versionInfo': component['version'],
+        'downloadLocation': 'NOASSERTION',
+        'filesAnalyzed': False,
+        'licenseConcluded': 'NOASSERTION',
+        'licenseDeclared': ' AND '.join(expressions) or 'NOASSERTION',
+        'copyrightText': 'NOASSERTION',
+        'checksums': [
+            {'algorithm': _spdx_checksum_algorithms[h['alg']], 'checksumValue': h['content']}
+            for h in component['hashes'] if h['alg'] in _spdx_checksum_algorithms
+        ],
+        'externalRefs': [
+            {
+                'referenceCategory': 'PACKAGE-MANAGER',
+                'referenceType': 'purl',
+                'referenceLocator': component['purl'],
+            },
+        ],
+    }
+
+
+def _spdx_document(sbom, ts):
+    extracted = {}
+    used_refs = set()
+    packages = {}
+    for c in sbom.components:
+        p = _spdx_package(c, extracted, used_refs)
+        packages.setdefault(p['SPDXID'], p)
+
+    return {
+        'spdxVersion': 'SPDX-2.3',
+        'dataLicense': 'CC0-1.0',
+        'SPDXID': 'SPDXRef-DOCUMENT',
+        'name': f'{sbom.name}-{sbom.version}',
+        'documentNamespace': f'https://spdx.org/spdxdocs/elbe/{uuid7(ts)}',
+        'creationInfo': {
+            'created': ts.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'creators': [f'Tool: elbe-{elbe_version}'],
+        },
+        'documentDescribes': list(packages),
+        'packages': list(packages.values()),
+        'hasExtractedLicensingInfos': list(extracted.values()),
+    }
+
+
+def _print_error_report(errors, pkg, licenses):
+    pkg_errors = licenses.get(pkg.name, (None, None))[1]
+    if pkg_errors:
+        print(f'{pkg.name}', file=errors)
+        for error in pkg_errors:
+            print(f'  {error}', file=errors)
+        print('', file=errors)
+
+
+def run_command(argv):
+    aparser = argparse.ArgumentParser(prog='elbe cyclonedx-sbom')
+    aparser.add_argument('-o', '--output', type=_FileStream('w', sys.stdout), default='-')
+    aparser.add_argument('-e', '--errors', type=_FileStream('w', sys.stderr), default='-')
+    aparser.add_argument('--spdx', type=_FileStream('w', sys.stdout), default=None,
+                         help='also write an SPDX document')
+    aparser.add_argument('-d', dest='elbe_build', required=True)
+    aparser.add_argument('-m', dest='mapping', nargs='?', default=None)
+    args = aparser.parse_args(argv)
+
+    ts = datetime.datetime.now(tz=datetime.timezone.utc)
+    sbom = _SBOM(args.elbe_build, args.mapping)
+
+    # json.dump() writes the document piece by piece
     with args.output.open() as out:
-        json.dump(output, out, indent=2, cls=CycloneDXEncoder)
+        json.dump(_cyclonedx_document(sbom, ts), out, indent=2, cls=CycloneDXEncoder)
         out.write('\n')
 
-    def _print_error_report(dest, pkg_errors):
-        if pkg_errors is not None:
-            print(f'{pkg.name}', file=errors)
-            for error in pkg_errors:
-                print(f'  {error}', file=errors)
-            print('', file=errors)
-
-    def _errors_from_pkg(pkg, licenses):
-        if pkg.name in licenses:
-            if licenses[pkg.name][1]:
-                return licenses[pkg.name][1]
+    if args.spdx is not None:
+        with args.spdx.open() as out:
+            json.dump(_spdx_document(sbom, ts), out, indent=2)
+            out.write('\n')
 
     with args.errors.open() as errors:
         errors.write('\nThe following target-packages have errors:\n\n')
-        for pkg in pkg_list:
-            _print_error_report(errors, _errors_from_pkg(pkg, licenses))
+        for pkg in sbom.packages:
+            _print_error_report(errors, pkg, sbom.licenses)
 
         errors.write('\nThe following chroot-packages have errors:\n\n')
-        for pkg in pkg_list:
-            _print_error_report(errors, _errors_from_pkg(pkg, chroot_lics))
+        for pkg in sbom.packages:
+            _print_error_report(errors, pkg, sbom.chroot_licenses)
@@ -8,6 +8,7 @@ import errno
 import importlib
 import os
 import socket
+import socketserver
 import wsgiref.simple_server
 import wsgiref.util
 from pkgutil import iter_modules
@@ -41,8 +42,9 @@ class _ElbeWSGIRequestHandler(wsgiref.simple_server.WSGIRequestHandler):
         pass  # Noop
 
 
-class _ReusePortWSGIServer(wsgiref.simple_server.WSGIServer):
+class _ReusePortWSGIServer(socketserver.ThreadingMixIn, wsgiref.simple_server.WSGIServer):
     allow_reuse_address = True
+    daemon_threads = True
 
 
 def get_daemonlist():
@@ -78,6 +80,9 @@ def run_command(argv):
                          help='interface to host daemon')
     aparser.add_argument('--port', dest='port', type=int, default=7587,
                          help='port to host daemon')
+    aparser.add_argument('--jobs', dest='jobs', type=int,
+                         default=os.environ.get('ELBE_DAEMON_JOBS', '1'),
+                         help='number of projects to build concurrently')
 
     args = aparser.parse_args(argv)
 
@@ -87,7 +92,7 @@ def run_command(argv):
         for d in daemons:
             print(f'enable {d}')
             cmdmod = importlib.import_module('.' + d, elbepack.daemons.__name__)
-            app = cmdmod.get_app()
+            app = cmdmod.get_app(jobs=args.jobs)
             if hasattr(app, 'stop'):
                 stack.callback(app.stop)
             mapping[d] = app
@@ -95,34 +95,33 @@ def run_command(argv):
             pkglist = get_initvm_pkglist()
             cache = Cache()
             cache.open()
-            for pkg in pkglist:
-                pkg_id = f'{pkg.name}-{pkg.installed_version}'
-                retry = 1
-                while retry < 3:
-                    try:
-                        p = cache[pkg.name]
-                        pkgver = p.installed
-                        deb = pkgver.fetch_binary(args.archive, ElbeAcquireProgress(cb=None))
-                        repo.includedeb(deb, 'main', prio=pkgver.priority)
-                        break
-                    except ValueError:
-                        logging.exception('No package "%s"', pkg_id)
-                        retry = 3
-                    except FetchError:
-                        logging.exception('Package "%s-%s" could not be downloaded',
-                                          pkg.name, pkgver.version)
-                        retry += 1
-                    except TypeError:
-                        logging.exception('Package "%s" missing name or version',
+            # The packages are added to the repo in batches at the end of the block.
+            # Packages, that can not be added, are logged and skipped.
+            with repo.bulk(ignore_errors=True):
+                for pkg in pkglist:
+                    pkg_id = f'{pkg.name}-{pkg.installed_version}'
+                    retry = 1
+                    while retry < 3:
+                        try:
+                            p = cache[pkg.name]
+                            pkgver = p.installed
+                            deb = pkgver.fetch_binary(args.archive, ElbeAcquireProgress(cb=None))
+                            repo.includedeb(deb, 'main', prio=pkgver.priority)
+                            break
+                        except ValueError:
+                            logging.exception('No package "%s"', pkg_id)
+                            retry = 3
+                        except FetchError:
+                            logging.exception('Package "%s-%s" could not be downloaded',
+                                              pkg.name, pkgver.version)
+                            retry += 1
+                        except TypeError:
+                            logging.exception('Package "%s" missing name or version',
+                                              pkg_id)
+                            retry = 3
+                        if retry >= 3:
+                            logging.error('Failed to get binary Package "%s"',
                                           pkg_id)
-                        retry = 3
-                    except subprocess.CalledProcessError:
-                        logging.exception('Package "%s-%s" could not be added to repo.',
-                                          pkg.name, pkgver.version)
-                        retry += 1
-                    if retry >= 3:
-                        logging.error('Failed to get binary Package "%s"',
-                                      pkg_id)
 
         repo.finalize()
 
@@ -5,6 +5,7 @@
 import argparse
 import logging
 import os
+import shutil
 import sys
 
 from elbepack.elbeproject import ElbeProject
@@ -44,6 +45,9 @@ def run_command(argv):
     aparser.add_argument('--debug', action='store_true', dest='debug',
                          default=False,
                          help='Enable various features to debug the build')
+    aparser.add_argument('--delta', action='store_true', dest='delta',
+                         default=False,
+                         help='Ship binary diffs against the base version of upgraded packages')
     aparser.add_argument('xmlfile', nargs='?')
 
     args = aparser.parse_args(argv)
@@ -57,6 +61,9 @@ def run_command(argv):
     if not args.output:
         aparser.error('No output file specified')
 
+    if args.delta and not shutil.which('debdelta'):
+        aparser.error('--delta requires debdelta to be installed')
+
     with elbe_logging(streams=sys.stdout):
         try:
             project = ElbeProject(args.target, name=args.name,
@@ -78,15 +85,12 @@ def run_command(argv):
             sys.exit(36)
         project.postsh_file = args.postsh_file
 
-    update_xml = None
-    if len(args) >= 1:
-        update_xml = args[0]
-
     with elbe_logging(projects=project.builddir):
         try:
-            gen_update_pkg(project, update_xml, args.output, args.uildtype,
+            gen_update_pkg(project, args.xmlfile, args.output, args.buildtype,
                            args.skip_validation, args.debug,
-                           cfg_dir=args.cfg_dir, cmd_dir=args.cmd_dir)
+                           cfg_dir=args.cfg_dir, cmd_dir=args.cmd_dir,
+                           delta=args.delta)
 
         except ValidationError:
             logging.exception('XML validation failed.  Bailing out')
@@ -3,19 +3,30 @@
 # SPDX-FileCopyrightText: 2016-2017 Linutronix GmbH
 
 import argparse
+import contextlib
 import dataclasses
 import datetime
 import enum
+import hashlib
 import io
+import itertools
 import os
+import re
 import subprocess
-from tempfile import NamedTemporaryFile
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
 
+from elbepack.licencexml import iter_pkglicenses, pkglicenses_writer
+from elbepack.pickle_cache import load_pickle_cache, store_pickle_cache
 from elbepack.spdx import SPDX_LICENSE_IDENTIFIERS
 from elbepack.treeutils import etree
 from elbepack.version import elbe_version
 
 
+# Number of packages, that are held in memory at once for nomos
+_batch_size = 256
+
+
 @dataclasses.dataclass
 class Statistics:
     total_pkgs: int = 0
@@ -26,6 +37,18 @@ class Statistics:
     def __str__(self):
         return ' '.join([f'{k}={v}' for k, v in dataclasses.asdict(self).items()])
 
+    def count(self, pkg):
+        self.total_pkgs += 1
+
+        if pkg.has('machinereadable'):
+            self.num_machine_readable += 1
+
+        if pkg.has('heuristics'):
+            self.num_heuristics += 1
+
+        if pkg.has('error'):
+            self.num_error_pkgs += 1
+
 
 class LicenseType(enum.Enum):
     SPDX = enum.auto()
@@ -128,20 +151,89 @@ class license_dep5_to_spdx (dict):
         return retval
 
 
-def scan_nomos(license_text):
-    with NamedTemporaryFile() as f:
-        f.write(license_text.encode('utf-8'))
-        nomos_out = subprocess.run([
-            '/usr/share/fossology/nomos/agent/nomos', f.name,
-        ], check=True, capture_output=True, encoding='utf-8').stdout
+_nomos = '/usr/share/fossology/nomos/agent/nomos'
+
+_nomos_re = re.compile(r'^File (\S+) contains license\(s\) (.*)$')
+
+
+class NomosScanner:
+    """
+    Runs nomos on licence texts.  The texts are written to a temporary
+    directory, and every nomos process scans a batch of them, with up to
+    'jobs' processes at once.
+
+    The results are kept by the sha256 of the text, so identical texts
+    are only scanned once.  If 'cache_fname' is given, the results are
+    stored there and reused by later runs.
+    """
+
+    batch_size = 64
 
-    expected_start = f'File {os.path.basename(f.name)} contains license(s) '
-    if not nomos_out.startswith(expected_start):
-        raise Exception('nomos output error')
+    def __init__(self, cache_fname=None, jobs=None):
+        self.cache_fname = cache_fname
+        self.jobs = jobs or os.cpu_count()
+        self.results = {}
 
-    licenses = nomos_out[len(expected_start):].strip()
+        if cache_fname is not None:
+            self.results = load_pickle_cache(cache_fname) or {}
 
-    return licenses.split(',')
+    def _run(self, directory, names):
+        nomos_out = subprocess.run([_nomos, *names], cwd=directory, check=True,
+                                   capture_output=True, encoding='utf-8').stdout
+
+        results = {}
+        for line in nomos_out.splitlines():
+            m = _nomos_re.match(line)
+            if m:
+                results[m.group(1)] = m.group(2).strip().split(',')
+
+        if set(results) != set(names):
+            raise Exception('nomos output error')
+
+        return results
+
+    def scan(self, texts):
+        """
+        Returns the list of licences, that nomos finds, for every text in
+        'texts'.
+        """
+        keys = [hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts]
+        todo = {key: text for key, text in zip(keys, texts) if key not in self.results}
+
+        if todo:
+            with TemporaryDirectory() as directory:
+                for key, text in todo.items():
+                    with open(os.path.join(directory, key), 'w', encoding='utf-8') as f:
+                        f.write(text)
+
+                names = list(todo)
+                batches = [names[i:i + self.batch_size]
+                           for i in range(0, len(names), self.batch_size)]
+                with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                    for results in executor.map(self._run, itertools.repeat(directory), batches):
+                        self.results.update(results)
+
+        return [self.results[key] for key in keys]
+
+    def save(self):
+        if self.cache_fname is None:
+            return
+
+        store_pickle_cache(self.cache_fname, self.results)
+
+
+def scan_nomos(license_text):
+    return NomosScanner().scan([license_text])[0]
+
+
+def _add_nomos_licenses(pkgs, scanner):
+    for pkg, nomos_l in zip(pkgs, scanner.scan([pkg.text('text') for pkg in pkgs])):
+        if nomos_l[0] != 'No_license_found':
+            nomos_node = pkg.append('nomos_licenses')
+            nomos_node.et.text = '\n'
+            for lic in nomos_l:
+                ll = nomos_node.append('license')
+                ll.et.text = lic
 
 
 def license_string(pkg):
@@ -158,94 +250,93 @@ def license_string(pkg):
     return ' AND '.join(l_list)
 
 
-def _apply_mapping(licenses, mapping, *, use_nomos=False, only_errors=False):
-    for pkg in list(licenses.root):
-        errors = []
-
-        pkg_name = pkg.et.attrib['name']
-
-        if pkg.has('heuristics'):
-            if not mapping.have_override(pkg_name):
-                errors.append(
-                    f'no override for heuristics based package "{pkg_name}"')
-
-        if mapping.have_override(pkg_name):
-            pkg.append('have_override')
-
-        if pkg.has('debian_licenses'):
+def _apply_mapping(pkg, mapping):
+    """
+    Adds the SPDX licences and the errors of the mapping to the
+    'pkglicense' node 'pkg'.
+    """
+    errors = []
+
+    pkg_name = pkg.et.attrib['name']
+
+    if pkg.has('heuristics'):
+        if not mapping.have_override(pkg_name):
+            errors.append(
+                f'no override for heuristics based package "{pkg_name}"')
+
+    if mapping.have_override(pkg_name):
+        pkg.append('have_override')
+
+    if pkg.has('debian_licenses'):
+        sp = pkg.ensure_child('spdx_licenses')
+        sp.clear()
+        sp.et.text = '\n'
+        lics = []
+        for lic in pkg.node('debian_licenses'):
+            if lic.et.text in lics:
+                continue
+            lics.append(lic.et.text)
+
+        mapped_lics = mapping.map_lic(pkg_name, lics, errors)
+
+        for lic in mapped_lics:
+            ll = sp.append('license')
+            ll.et.text = lic
+
+        if not mapped_lics:
+            errors.append(f'empty mapped licenses in package "{pkg_name}"')
+    else:
+        if not mapping.have_override(pkg_name):
+            errors.append(
+                'no debian_licenses and no override in package '
+                f'"{pkg_name}"')
+        else:
             sp = pkg.ensure_child('spdx_licenses')
             sp.clear()
             sp.et.text = '\n'
-            lics = []
-            for lic in pkg.node('debian_licenses'):
-                if lic.et.text in lics:
-                    continue
-                lics.append(lic.et.text)
-
-            mapped_lics = mapping.map_lic(pkg_name, lics, errors)
-
-            for lic in mapped_lics:
+            for lic in mapping.get_override(pkg_name):
                 ll = sp.append('license')
                 ll.et.text = lic
 
-            if not mapped_lics:
-                errors.append(f'empty mapped licenses in package "{pkg_name}"')
-        else:
-            if not mapping.have_override(pkg_name):
-                errors.append(
-                    'no debian_licenses and no override in package '
-                    f'"{pkg_name}"')
-            else:
-                sp = pkg.ensure_child('spdx_licenses')
-                sp.clear()
-                sp.et.text = '\n'
-                for lic in mapping.get_override(pkg_name):
-                    ll = sp.append('license')
-                    ll.et.text = lic
-
-        if errors:
-            for e in errors:
-                ee = pkg.append('error')
-                ee.et.text = e
-        elif only_errors:
-            # No Errors, and only_errors is active
-            # Remove package node
-            licenses.root.remove_child(pkg)
-
-        if use_nomos:
-            nomos_l = scan_nomos(pkg.text('text'))
-            if nomos_l[0] != 'No_license_found':
-                nomos_node = pkg.append('nomos_licenses')
-                nomos_node.et.text = '\n'
-                for lic in nomos_l:
-                    ll = nomos_node.append('license')
-                    ll.et.text = lic
-
-
-def _compute_statistics(licenses):
-    statistics = Statistics()
-    for pkg in list(licenses.root):
+    for e in errors:
+        ee = pkg.append('error')
+        ee.et.text = e
 
-        statistics.total_pkgs += 1
 
-        if pkg.has('machinereadable'):
-            statistics.num_machine_readable += 1
+def _mapped_packages(licence_file, mapping, nomos=None):
+    """
+    Yields the packages of the licence XML file 'licence_file' with the
+    'mapping' applied.  If the NomosScanner 'nomos' is given, the packages
+    are scanned in batches.
+    """
+    pkgs = iter_pkglicenses(licence_file)
 
-        if pkg.has('heuristics'):
-            statistics.num_heuristics += 1
+    while True:
+        batch = list(itertools.islice(pkgs, _batch_size if nomos else 1))
+        if not batch:
+            break
 
-        if pkg.has('error'):
-            statistics.num_error_pkgs += 1
+        for pkg in batch:
+            _apply_mapping(pkg, mapping)
 
-    return statistics
+        if nomos is not None:
+            _add_nomos_licenses(batch, nomos)
+
+        yield from batch
 
 
 def extract_licenses_from_report(licence_file, mapping_file):
+    return extract_licenses(licence_file, license_dep5_to_spdx(mapping_file))
+
+
+def extract_licenses(licence_file, mapping):
+    """
+    Returns a dict of the packages in the licence XML file 'licence_file'
+    to their licences and errors, mapped with the license_dep5_to_spdx
+    'mapping'.
+    """
     extracted_licenses = {}
-    licence_tree = etree(licence_file)
-    mapping = license_dep5_to_spdx(mapping_file)
-    _apply_mapping(licence_tree, mapping)
-    for pkg in list(licence_tree.root):
+    for pkg in _mapped_packages(licence_file, mapping):
         pkg_name = pkg.et.attrib['name']
         errors = []
         licenses = []
@@ -306,6 +397,11 @@ def run_command(argv):
         default=False,
         help='Use the external nomos tool on the copyright text, '
              'and record the ouput in out xml')
+    aparser.add_argument(
+        '--nomos-cache',
+        dest='nomos_cache',
+        help='Keep the results of nomos in this file, '
+             'so that unchanged licence texts are not scanned again')
     aparser.add_argument(
         '--errors-only',
         action='store_true',
@@ -320,16 +416,18 @@ def run_command(argv):
 
     args = aparser.parse_args(argv)
 
-    tree = etree(args.licencefile)
-
     mapping = license_dep5_to_spdx(args.mapping)
+    statistics = Statistics()
 
-    _apply_mapping(tree, mapping, use_nomos=args.use_nomos, only_errors=args.only_errors)
-    statistics = _compute_statistics(tree)
+    nomos = None
+    if args.use_nomos:
+        nomos = NomosScanner(args.nomos_cache)
 
-    if args.tagvalue is not None:
-        created = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
-        with io.open(args.tagvalue, 'wt', encoding='utf-8') as fp:
+    with contextlib.ExitStack() as stack:
+        fp = None
+        if args.tagvalue is not None:
+            created = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+            fp = stack.enter_context(io.open(args.tagvalue, 'wt', encoding='utf-8'))
             fp.write('SPDXVersion: SPDX-1.2\n')
             fp.write('DataLicense: CC0-1.0\n')
             fp.write('\n')
@@ -341,7 +439,17 @@ def run_command(argv):
             fp.write('## Package Information\n')
             fp.write('\n')
 
-            for pkg in tree.root:
+        write = None
+        if args.output is not None:
+            write = stack.enter_context(pkglicenses_writer(args.output, encoding='ascii'))
+
+        for pkg in _mapped_packages(args.licencefile, mapping, nomos):
+            if args.only_errors and not pkg.has('error'):
+                continue
+
+            statistics.count(pkg)
+
+            if fp is not None:
                 fp.write(f"## Package {pkg.et.attrib['name']}\n")
                 fp.write(f"PackageName: {pkg.et.attrib['name']}\n")
                 fp.write('PackageDownloadLocation: NOASSERTION\n')
@@ -357,8 +465,11 @@ def run_command(argv):
                 fp.write('PackageLicenseInfoFromFiles: NOASSERTION\n')
                 fp.write('\n')
 
-    if args.output is not None:
-        tree.write(args.output)
+            if write is not None:
+                write(pkg.et)
+
+    if nomos is not None:
+        nomos.save()
 
     print('statistics:')
     print(statistics)
@@ -5,31 +5,190 @@
 import logging
 import mimetypes
 import os
+import re
 import wsgiref.util
 
+from elbepack.hashes import sha256sum
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Uploads are only accepted into the project directories
+_upload_base = '/var/cache/elbe'
+
+# Real paths of the files, that the start_* calls of the soap daemon have
+# prepared for an upload
+_uploads: set[str] = set()
+
+_range_re = re.compile(r'^bytes=(\d+)-(\d*)$')
+_content_range_re = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+_chunk_size = 1024 * 1024
+
+
+def _text(respond, status, text):
+    respond(status, [('Content-Type', 'text/plain')])
+    return [text.encode()]
+
+
+# Checksums of served files, by name, size and modification time
+_sha256_cache: dict[str, tuple[int, int, str]] = {}
+
+
+def _sha256(fn):
+    st = os.stat(fn)
+    cached = _sha256_cache.get(fn)
+    if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+        return cached[2]
+
+    digest = sha256sum(fn)
+    _sha256_cache[fn] = (st.st_size, st.st_mtime_ns, digest)
+    return digest
+
+
+def _get(environ, respond, fn):
+    if environ.get('QUERY_STRING') == 'sha256':
+        return _text(respond, '200 OK', _sha256(fn))
 
-# taken from wsgiref examples
-def _app(environ, respond):
-    # Get the file name and MIME type
-    fn = environ['PATH_INFO']
     mime_type = mimetypes.guess_type(fn)[0] or 'application/octet-stream'
+    size = os.stat(fn).st_size
+    start, end = 0, size - 1
+
+    m = _range_re.match(environ.get('HTTP_RANGE', ''))
+    if m:
+        start = int(m.group(1))
+        if m.group(2):
+            end = min(int(m.group(2)), end)
+        if start > end:
+            respond('416 Range Not Satisfiable', [('Content-Range', f'bytes */{size}')])
+            return []
+
+    headers = [
+        ('Content-Type', mime_type),
+        ('Content-Length', str(end - start + 1)),
+        ('Accept-Ranges', 'bytes'),
+    ]
 
-    # Return 200 OK if file exists, otherwise 404 Not Found
     logger.info('Serving as %s: "%s"', mime_type, fn)
-    if os.path.exists(fn):
-        respond('200 OK', [
-            ('Content-Type', mime_type),
-            ('Content-Length', str(os.stat(fn).st_size)),
-        ])
-        return wsgiref.util.FileWrapper(open(fn, 'rb'))
+    if m:
+        headers.append(('Content-Range', f'bytes {start}-{end}/{size}'))
+        respond('206 Partial Content', headers)
     else:
-        respond('404 Not Found', [('Content-Type', 'text/plain')])
-        return [b'not found']
+        respond('200 OK', headers)
+
+    if environ['REQUEST_METHOD'] == 'HEAD':
+        return []
+
+    f = open(fn, 'rb')
+    f.seek(start)
+    return wsgiref.util.FileWrapper(_LimitedReader(f, end - start + 1))
+
+
+class _LimitedReader:
+    def __init__(self, f, size):
+        self.f = f
+        self.left = size
+
+    def read(self, size=_chunk_size):
+        data = self.f.read(min(size, self.left))
+        self.left -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def allow_upload(builddir, fname):
+    """
+    Allows to upload the file 'fname' of the project 'builddir' by PUT,
+    until disallow_upload() is called.
+    """
+    builddir = os.path.realpath(builddir)
+    if os.path.dirname(builddir) != _upload_base or os.path.basename(fname) != fname:
+        raise ValueError(f'Invalid upload {fname} to {builddir}')
+
+    _uploads.add(os.path.join(builddir, fname))
+
+
+def disallow_upload(builddir, fname=None):
+    """
+    Ends the upload of the file 'fname' of the project 'builddir', or of
+    all files of the project, if 'fname' is None.
+    """
+    builddir = os.path.realpath(builddir)
+    if fname is not None:
+        _uploads.discard(os.path.join(builddir, fname))
+    else:
+        _uploads.difference_update([fn for fn in _uploads
+                                    if os.path.dirname(fn) == builddir])
+
+
+def _put(environ, respond, fn):
+    """
+    Write the request body into the existing file 'fn', which has to be
+    allowed by allow_upload().
+
+    A 'Content-Range: bytes <start>-<end>/<total>' header continues an
+    interrupted upload at <start>, which must not be beyond the data,
+    that has already been received.
+    """
+    if (os.path.realpath(fn) not in _uploads or
+            not os.path.isfile(fn) or os.path.islink(fn)):
+        return _text(respond, '403 Forbidden', 'upload not allowed')
+
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    start = 0
+
+    if 'HTTP_CONTENT_RANGE' in environ:
+        m = _content_range_re.match(environ['HTTP_CONTENT_RANGE'])
+        if not m or int(m.group(2)) - int(m.group(1)) + 1 != length:
+            return _text(respond, '400 Bad Request', 'invalid Content-Range')
+        start = int(m.group(1))
+
+    if start > os.stat(fn).st_size:
+        respond('416 Range Not Satisfiable',
+                [('Content-Range', f'bytes */{os.stat(fn).st_size}')])
+        return []
+
+    logger.info('Receiving %d bytes at %d: "%s"', length, start, fn)
+
+    stream = environ['wsgi.input']
+    with open(fn, 'r+b') as f:
+        f.seek(start)
+        f.truncate()
+        while length:
+            data = stream.read(min(length, _chunk_size))
+            if not data:
+                break
+            f.write(data)
+            length -= len(data)
+
+    if length:
+        return _text(respond, '400 Bad Request', 'incomplete upload')
+
+    respond('204 No Content', [])
+    return []
+
+
+def _app(environ, respond):
+    # Get the file name
+    fn = environ['PATH_INFO']
+    method = environ['REQUEST_METHOD']
+
+    if method == 'PUT':
+        return _put(environ, respond, fn)
+
+    if method not in ('GET', 'HEAD'):
+        return _text(respond, '405 Method Not Allowed', 'method not allowed')
+
+    # Return 404 Not Found, if the file does not exist
+    if not os.path.isfile(fn):
+        return _text(respond, '404 Not Found', 'not found')
+
+    return _get(environ, respond, fn)
 
 
-def get_app():
+def get_app(jobs=1):
+    # Files are served independently of the number of build jobs
     return _app
@@ -3,6 +3,7 @@
 # SPDX-FileCopyrightText: 2014-2017 Linutronix GmbH
 
 import logging
+import threading
 import warnings
 
 # spyne uses a bundled version of six, which triggers warnings in spyne version 2.14.0.
@@ -24,9 +25,9 @@ logging.getLogger('spyne').setLevel(logging.INFO)
 
 
 class EsoapApp(Application):
-    def __init__(self, *args, **kargs):
+    def __init__(self, *args, jobs=1, **kargs):
         super().__init__(*args, **kargs)
-        self.pm = ProjectManager('/var/cache/elbe')
+        self.pm = ProjectManager('/var/cache/elbe', jobs)
 
     def stop(self):
         self.pm.stop()
@@ -35,16 +36,25 @@ class EsoapApp(Application):
 class StoppableWsgiApplication(WsgiApplication):
     def __init__(self, app):
         self._app = app
+        self._lock = threading.Lock()
         super().__init__(app)
 
+    def __call__(self, environ, start_response):
+        # Requests are served concurrently, to not block the SOAP calls
+        # during file transfers.  The SOAP calls themselves are handled
+        # one at a time.
+        with self._lock:
+            return list(super().__call__(environ, start_response))
+
     def stop(self):
         self._app.stop()
 
 
-def get_app():
+def get_app(jobs=1):
 
     app = EsoapApp([ESoap], 'soap',
                    in_protocol=Soap11(validator='lxml'),
-                   out_protocol=Soap11())
+                   out_protocol=Soap11(),
+                   jobs=jobs)
 
     return StoppableWsgiApplication(app)
@@ -21,6 +21,7 @@ class SoapFile (ComplexModel):
 
     name = Unicode()
     description = Unicode()
+    size = UnsignedInteger()
 
 
 class ServerStatus(ComplexModel):
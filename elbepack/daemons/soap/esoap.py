@@ -17,6 +17,7 @@ from spyne.model.fault import Fault
 from spyne.model.primitive import Boolean, Integer, String
 from spyne.service import ServiceBase
 
+from elbepack.daemons.repo import allow_upload, disallow_upload
 from elbepack.db import ElbeDBError, InvalidLogin
 from elbepack.elbexml import ValidationError
 from elbepack.projectmanager import InvalidState, ProjectManagerError
@@ -74,6 +75,18 @@ def _linux_meminfo():
     return r
 
 
+def _start_upload(pm, builddir, fname):
+    # Only files of existing projects can be uploaded
+    pm.db.get_project_data(builddir)
+
+    with open(os.path.join(builddir, fname), 'w'):
+        # Now write empty File
+        pass
+
+    allow_upload(builddir, fname)
+    return fname
+
+
 class ESoap (ServiceBase):
 
     __name__ = 'soap'
@@ -162,10 +175,12 @@ class ESoap (ServiceBase):
     def build_cdroms(self, builddir, build_bin, build_src):
         self.app.pm.build_cdroms(builddir, build_bin, build_src)
 
-    @rpc(String, Boolean, Boolean, Boolean, String)
-    def build(self, builddir, build_bin, build_src, skip_pbuilder, base_image_path):
+    @rpc(String, Boolean, Boolean, Boolean, String, Boolean, Integer)
+    def build(self, builddir, build_bin, build_src, skip_pbuilder, base_image_path,
+              build_cache, jobs):
 
-        self.app.pm.build_project(builddir, build_bin, build_src, skip_pbuilder, base_image_path)
+        self.app.pm.build_project(builddir, build_bin, build_src, skip_pbuilder, base_image_path,
+                                  bool(build_cache), jobs or 1)
 
     @rpc(String, Boolean, Boolean, String)
     def build_pbuilder(self, builddir, cross, noccache, ccachesize):
@@ -182,53 +197,40 @@ class ESoap (ServiceBase):
 
     @rpc(String, _returns=String)
     def start_cdrom(self, builddir):
-        fname = 'uploaded_cdrom.iso'
-
-        with open(os.path.join(builddir, fname), 'w'):
-            # Now write empty File
-            pass
-
-        return fname
+        return _start_upload(self.app.pm, builddir, 'uploaded_cdrom.iso')
 
     @rpc(String)
     def finish_cdrom(self, builddir):
+        disallow_upload(builddir, 'uploaded_cdrom.iso')
         self.app.pm.set_upload_cdrom(builddir)
 
     @rpc(String, _returns=String)
     def start_base_image(self, builddir):
-        fname = 'uploaded_base_image.img'
-
-        with open(os.path.join(builddir, fname), 'w'):
-            # Now write empty File
-            pass
-
-        return fname
+        return _start_upload(self.app.pm, builddir, 'uploaded_base_image.img')
 
     @rpc(String)
     def finish_base_image(self, builddir):
-        pass
+        disallow_upload(builddir, 'uploaded_base_image.img')
 
     @rpc(String, _returns=String)
     def start_pdebuild(self, builddir):
-        fname = 'current_pdebuild.tar.gz'
-        with open(os.path.join(builddir, fname), 'w'):
-            # Now write empty File
-            pass
-
-        return fname
+        return _start_upload(self.app.pm, builddir, 'current_pdebuild.tar.gz')
 
     @rpc(String, String, Boolean)
     def finish_pdebuild(self, builddir, profile, cross):
+        disallow_upload(builddir, 'current_pdebuild.tar.gz')
         self.app.pm.build_pdebuild(builddir, profile, cross)
 
     @rpc(String, String, _returns=String)
     def start_upload_orig(self, builddir, fname):
         self.app.pm.add_orig_fname(builddir, fname)
+        allow_upload(builddir, fname)
         return fname
 
     @rpc(String)
     def finish_upload_orig(self, builddir):
-        pass
+        # The name of the orig tarball is chosen by the client
+        disallow_upload(builddir)
 
     @rpc(String)
     def reset_project(self, builddir):
@@ -236,6 +238,7 @@ class ESoap (ServiceBase):
 
     @rpc(String)
     def del_project(self, builddir):
+        disallow_upload(builddir)
         self.app.pm.del_project(builddir)
 
     @rpc(String, _returns=String)
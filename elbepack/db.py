@@ -533,3 +533,7 @@ class ProjectFileData:
             self.description = str(pf.description)
         else:
             self.description = None
+        try:
+            self.size = os.path.getsize(os.path.join(self.builddir, self.name))
+        except OSError:
+            self.size = None
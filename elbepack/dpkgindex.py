@@ -0,0 +1,134 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import array
+import bisect
+import logging
+import os
+
+from elbepack.pickle_cache import load_pickle_cache, store_pickle_cache
+
+
+# dpkg package states, in which the files of a package are not installed
+_not_installed = {'not-installed', 'config-files'}
+
+
+def _unprefix(path, removeprefix):
+    if removeprefix and path.startswith(removeprefix):
+        return path[len(removeprefix):]
+    return path
+
+
+def installed_packages(root, arch, states=None):
+    """
+    Returns a list of (name, list file) of the packages, that are
+    installed in 'root' according to the dpkg status file.  The names
+    carry an architecture qualifier, if the package is not of the
+    architecture 'arch' or 'all', like python-apt does it.
+
+    If 'states' is given, only packages in one of these dpkg states, like
+    'installed', are returned.
+    """
+    info = os.path.join(root, 'var/lib/dpkg/info')
+    pkgs = []
+
+    def _add(fields):
+        name = fields.get('Package')
+        status = fields.get('Status', '').split()
+        if not name or len(status) != 3 or status[2] in _not_installed:
+            return
+        if states is not None and status[2] not in states:
+            return
+
+        pkgarch = fields.get('Architecture', arch)
+        listfile = os.path.join(info, f'{name}:{pkgarch}.list')
+        if not os.path.exists(listfile):
+            listfile = os.path.join(info, f'{name}.list')
+
+        if pkgarch not in (arch, 'all'):
+            name = f'{name}:{pkgarch}'
+
+        pkgs.append((name, listfile))
+
+    fields = {}
+    with open(os.path.join(root, 'var/lib/dpkg/status'), encoding='utf-8') as f:
+        for line in f:
+            if line == '\n':
+                _add(fields)
+                fields = {}
+            elif not line[0].isspace():
+                key, _, value = line.partition(':')
+                if key in ('Package', 'Status', 'Architecture'):
+                    fields[key] = value.strip()
+    _add(fields)
+
+    return pkgs
+
+
+class DpkgFileIndex:
+    """
+    Maps the files installed in a root filesystem to the packages, that
+    own them.  The index is read from the dpkg status file and the list
+    files of the packages, without going through python-apt.
+
+    The paths are stored with 'removeprefix' stripped, in a sorted list
+    with a parallel array of package numbers, so lookups use bisection.
+    With removeprefix='/usr', /bin/sh and /usr/bin/sh are the same file,
+    as they are on a merged-/usr system.
+    """
+
+    def __init__(self, root, arch, removeprefix='/usr'):
+        self.removeprefix = removeprefix
+
+        owners = {}
+        self.packages = []
+        for name, listfile in sorted(installed_packages(root, arch)):
+            try:
+                with open(listfile, encoding='utf-8', errors='surrogateescape') as f:
+                    paths = f.read().splitlines()
+            except FileNotFoundError:
+                logging.warning('No list of files for installed package %s', name)
+                continue
+
+            pkgid = len(self.packages)
+            self.packages.append(name)
+            for path in paths:
+                # Later packages win, like in RPCAPTCache.get_fileindex()
+                owners[_unprefix(path, removeprefix)] = pkgid
+
+        self.paths = sorted(owners)
+        self.owners = array.array('I', (owners[p] for p in self.paths))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def lookup(self, path):
+        """
+        Returns the name of the package owning 'path', or None.
+        """
+        path = _unprefix(path, self.removeprefix)
+        i = bisect.bisect_left(self.paths, path)
+        if i < len(self.paths) and self.paths[i] == path:
+            return self.packages[self.owners[i]]
+        return None
+
+    @classmethod
+    def load(cls, root, arch, cache_fname=None, removeprefix='/usr'):
+        """
+        Returns the index of 'root'.  If 'cache_fname' is given, the index
+        is stored there and reused, as long as the dpkg status file has not
+        been modified.
+        """
+        if cache_fname is None:
+            return cls(root, arch, removeprefix)
+
+        st = os.stat(os.path.join(root, 'var/lib/dpkg/status'))
+        key = (root, arch, removeprefix, st.st_mtime_ns, st.st_size)
+
+        index = load_pickle_cache(cache_fname, key)
+        if index is None:
+            index = cls(root, arch, removeprefix)
+            store_pickle_cache(cache_fname, index, key)
+
+        return index
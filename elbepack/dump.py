@@ -11,6 +11,8 @@ from apt import Cache
 
 from elbepack.aptpkgutils import APTPackage, XMLPackage
 from elbepack.archivedir import archive_tmpfile
+from elbepack.dpkgindex import DpkgFileIndex
+from elbepack.filesystem import merge_snapshots, snapshot_path
 from elbepack.finetuning import do_finetuning
 from elbepack.log import report, validation
 from elbepack.shellhelper import do
@@ -102,22 +104,29 @@ def check_full_pkgs(pkgs, fullpkgs, cache):
 
     errors = 0
 
+    # Query the state of all packages at once
+    installed = {p.name: p for p in cache.get_installed_pkgs()}
+    names = [p.et.text.split(':')[0] for p in pkgs or []]
+    if fullpkgs:
+        names += [p.et.text for p in fullpkgs]
+    state = cache.get_install_state(names)
+
     if pkgs:
         for p in pkgs:
             name = p.et.text
             nomulti_name = name.split(':')[0]
-            if not cache.has_pkg(nomulti_name):
+            if state[nomulti_name] is None:
                 validation.error("Package '%s' does not exist", nomulti_name)
                 errors += 1
                 continue
 
-            if not cache.is_installed(nomulti_name):
+            if not state[nomulti_name]:
                 validation.error("Package '%s' is not installed", nomulti_name)
                 errors += 1
                 continue
 
             ver = p.et.get('version')
-            pkg = cache.get_pkg(nomulti_name)
+            pkg = installed[nomulti_name]
             if ver and not fnmatchcase(pkg.installed_version, ver):
                 validation.error("Package '%s' version '%s' does not match installed version %s",
                                  name, ver, pkg.installed_version)
@@ -144,17 +153,17 @@ def check_full_pkgs(pkgs, fullpkgs, cache):
 
         pindex[name] = p
 
-        if not cache.has_pkg(name):
+        if state[name] is None:
             validation.error("Package '%s' does not exist", name)
             errors += 1
             continue
 
-        if not cache.is_installed(name):
+        if not state[name]:
             validation.error("Package '%s' is not installed", name)
             errors += 1
             continue
 
-        pkg = cache.get_pkg(name)
+        pkg = installed[name]
 
         if not fnmatchcase(pkg.installed_version, ver):
             validation.error("Package '%s' version %s does not match installed version %s",
@@ -173,7 +182,7 @@ def check_full_pkgs(pkgs, fullpkgs, cache):
                                      name, k, v, k, pkg.installed_hashes[k])
                     errors += 1
 
-    for cp in cache.get_installed_pkgs():
+    for cp in installed.values():
         if cp.name not in pindex:
             validation.error('Additional package %s installed, that was not requested',
                              cp.name)
@@ -183,7 +192,7 @@ def check_full_pkgs(pkgs, fullpkgs, cache):
         validation.info('No Errors found')
 
 
-def elbe_report(xml, buildenv, cache, targetfs):
+def elbe_report(xml, buildenv, cache, targetfs, fileindex_cache=None):
 
     rfs = buildenv.rfs
 
@@ -233,19 +242,20 @@ def elbe_report(xml, buildenv, cache, targetfs):
             report.info('|%s|%s|%s', p.name, p.installed_version,
                         f'{p.origin.site} {p.origin.codename} {p.origin.component}')
 
-    index = cache.get_fileindex(removeprefix='/usr')
-    mt_index = targetfs.mtime_snap()
+    arch = xml.text('project/buildimage/arch', key='arch')
+    index = DpkgFileIndex.load(rfs.path, arch, fileindex_cache)
+    mt_index = targetfs.mtime_snapshot()
 
     if xml.has('archive') and not xml.text('archive') is None:
         with archive_tmpfile(xml.text('archive')) as fp:
             do(f'tar xvfj "{fp.name}" -h -C "{targetfs.path}"')
-        mt_index_postarch = targetfs.mtime_snap()
+        mt_index_postarch = targetfs.mtime_snapshot()
     else:
         mt_index_postarch = mt_index
 
     if xml.has('target/finetuning'):
         do_finetuning(xml, buildenv, targetfs)
-        mt_index_post_fine = targetfs.mtime_snap()
+        mt_index_post_fine = targetfs.mtime_snapshot()
     else:
         mt_index_post_fine = mt_index_postarch
 
@@ -255,28 +265,39 @@ def elbe_report(xml, buildenv, cache, targetfs):
     report.info('')
 
     tgt_pkg_list = set()
+    deleted = []
+    archive_changes = []
+
+    # The last snapshot holds the files of the finished target
+    for key, (mtime, mtime_postarch, mtime_post_fine) in merge_snapshots(
+            mt_index, mt_index_postarch, mt_index_post_fine):
+        fpath = snapshot_path(key)
 
-    for fpath, _ in targetfs.walk_files(sort=True):
-        unprefixed = fpath[len('/usr'):] if fpath.startswith('/usr') else fpath
-        if unprefixed in index:
-            pkg = index[unprefixed]
+        if mtime_postarch is not None and mtime_postarch != mtime:
+            archive_changes.append((fpath, mtime_postarch, mtime_post_fine))
+
+        if mtime_post_fine is None:
+            if mtime is not None:
+                deleted.append(fpath)
+            continue
+
+        pkg = index.lookup(fpath)
+        if pkg is not None:
             tgt_pkg_list.add(pkg)
         else:
             pkg = 'postinst generated'
 
-        if fpath in mt_index_post_fine:
-            if fpath in mt_index_postarch:
-                if mt_index_post_fine[fpath] != mt_index_postarch[fpath]:
-                    pkg = 'modified finetuning'
-                elif fpath in mt_index:
-                    if mt_index_postarch[fpath] != mt_index[fpath]:
-                        pkg = 'from archive'
-                    # else leave pkg as is
-                else:
-                    pkg = 'added in archive'
+        if mtime_postarch is not None:
+            if mtime_post_fine != mtime_postarch:
+                pkg = 'modified finetuning'
+            elif mtime is not None:
+                if mtime_postarch != mtime:
+                    pkg = 'from archive'
+                # else leave pkg as is
             else:
-                pkg = 'added in finetuning'
-        # else leave pkg as is
+                pkg = 'added in archive'
+        else:
+            pkg = 'added in finetuning'
 
         report.info('|+%s+|%s', fpath, pkg)
 
@@ -285,14 +306,8 @@ def elbe_report(xml, buildenv, cache, targetfs):
     report.info('-------------')
     report.info('')
 
-    for fpath in list(mt_index.keys()):
-        if fpath not in mt_index_post_fine:
-            unprefixed = fpath[len('/usr'):] if fpath.startswith('/usr') else fpath
-            if unprefixed in index:
-                pkg = index[unprefixed]
-            else:
-                pkg = 'postinst generated'
-            report.info('|+%s+|%s', fpath, pkg)
+    for fpath in deleted:
+        report.info('|+%s+|%s', fpath, index.lookup(fpath) or 'postinst generated')
 
     report.info('')
     report.info('Target Package List')
@@ -329,13 +344,11 @@ def elbe_report(xml, buildenv, cache, targetfs):
     validation.info('------------------')
     validation.info('')
 
-    for fpath in list(mt_index_postarch.keys()):
-        if (fpath not in mt_index or
-           mt_index_postarch[fpath] != mt_index[fpath]):
-            if fpath not in mt_index_post_fine:
-                validation.warning('Archive file %s deleted in finetuning',
-                                   fpath)
-            elif mt_index_post_fine[fpath] != mt_index_postarch[fpath]:
-                validation.warning('Archive file %s modified in finetuning',
-                                   fpath)
+    for fpath, mtime_postarch, mtime_post_fine in archive_changes:
+        if mtime_post_fine is None:
+            validation.warning('Archive file %s deleted in finetuning',
+                               fpath)
+        elif mtime_post_fine != mtime_postarch:
+            validation.warning('Archive file %s modified in finetuning',
+                               fpath)
     return list(tgt_pkg_list)
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2015-2018 Linutronix GmbH
 
+import concurrent.futures
 import contextlib
 import filecmp
 import io
@@ -9,87 +10,106 @@ import logging
 import os
 import pathlib
 import shutil
+import stat
 import subprocess
 import tempfile
 import time
 
+from elbepack.filecopy import copy_file, copy_tree
 from elbepack.filesystem import Filesystem
 from elbepack.fstab import fstabentry
 from elbepack.imgutils import mount
-from elbepack.licencexml import copyright_xml
+from elbepack.licencexml import CopyrightCache, copyright_executor, copyright_xml
 from elbepack.packers import default_packer
 from elbepack.shellhelper import chroot, do
 from elbepack.version import elbe_version
 
 
-def copy_filelist(src, file_lst, dst):
+def _plan_filelist(src, file_lst):
+    """
+    Classifies the paths in 'file_lst', their parent directories and the
+    targets of the symlinks among them.  Returns the list of directories
+    and symlinks as (path, symlink target or None), sorted from the root
+    on, and the list of other files.  Every path is looked at only once,
+    so circular symlinks are no problem.
+    """
+    tree = []
+    files = []
 
-    files = set()
-    copied = set()
+    seen = set()
+    togo = [f.rstrip('\n') for f in file_lst]
 
-    # Make sure to copy parent directories
-    #
-    # For example, if file_lst = ['/usr/bin/bash'],
-    # we might get {'/usr/bin', '/usr', '/usr/bin/bash'}
-    for f in file_lst:
-        parts = f.rstrip('\n')
-        while parts != os.sep:
-            files.add(parts)
-            parts, _ = os.path.split(parts)
+    while togo:
+        f = togo.pop()
 
-    # Start from closest to root first
-    files = list(files)
-    files.sort()
-    files.reverse()
+        # Make sure to copy parent directories
+        #
+        # For example, for f = '/usr/bin/bash',
+        # we might get '/usr/bin/bash', '/usr/bin' and '/usr'
+        while f and f != os.sep and f not in seen:
+            seen.add(f)
 
-    while files:
+            try:
+                mode = os.lstat(src.fname(f)).st_mode
+            except FileNotFoundError:
+                # Let the copy report the missing file
+                mode = 0
+
+            if stat.S_ISLNK(mode):
+                tgt = src.readlink(f)
+                tree.append((f, tgt))
+
+                # The target needs to be copied as well
+                tgt = os.path.normpath(os.path.join(os.path.dirname(f), tgt))
+                if src.lexists(tgt):
+                    togo.append(tgt)
+            elif stat.S_ISDIR(mode):
+                tree.append((f, None))
+            else:
+                files.append(f)
 
-        f = files.pop()
-        copied.add(f)
+            f = os.path.dirname(f)
 
-        if src.islink(f):
+    return sorted(tree), files
 
-            tgt = src.readlink(f)
 
-            if not src.lexists(tgt):
-                dst.symlink(tgt, f, allow_exists=True)
-                continue
+def copy_filelist(src, file_lst, dst, jobs=None):
 
-            # If the target is not yet in the destination RFS, we need
-            # to defer the copy of the symlink after the target is
-            # resolved.  Thus, we recusively call copy_filelist
-            #
-            # Not that this will result in an infinite loop for
-            # circular symlinks
-            if not dst.lexists(tgt):
-                if not os.path.isabs(tgt):
-                    lst = [os.path.join(os.path.dirname(f), tgt)]
-                else:
-                    lst = [tgt]
-                copy_filelist(src, lst, dst)
+    tree, files = _plan_filelist(src, file_lst)
 
+    # Start from closest to root first
+    for f, tgt in tree:
+        if tgt is not None:
             dst.symlink(tgt, f, allow_exists=True)
+            continue
 
-        elif src.isdir(f):
-            if not dst.isdir(f):
-                dst.mkdir(f)
-            st = src.stat(f)
-            dst.chown(f, st.st_uid, st.st_gid)
+        if not dst.isdir(f):
+            dst.mkdir(f)
+        st = src.stat(f)
+        dst.chown(f, st.st_uid, st.st_gid)
 
-        else:
-            try:
-                shutil.copy2(src.realpath(f), dst.realpath(f))
-            except OSError as E:
-                logging.warning('Error while copying from %s to %s of file %s - %s',
-                                src.path, dst.path, f, E)
+    def _copy(f):
+        try:
+            copy_file(src.realpath(f), dst.realpath(f))
+        except OSError as E:
+            logging.warning('Error while copying from %s to %s of file %s - %s',
+                            src.path, dst.path, f, E)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for _ in executor.map(_copy, files):
+            pass
 
     # update utime which will change after a file has been copied into
     # the directory
-    for f in copied:
-        if src.isdir(f) and not src.islink(f):
+    for f, tgt in tree:
+        if tgt is None:
             shutil.copystat(src.fname(f), dst.fname(f))
 
 
+# Number of copyright files, that are held in memory at once
+_licence_batch = 256
+
+
 def dpkg_architecture():
     return subprocess.check_output(
         ['dpkg', '--print-architecture'], text=True, encoding='ascii',
@@ -112,29 +132,22 @@ def extract_target(src, xml, dst, cache):
         arch = xml.text('project/buildimage/arch', key='arch')
 
         if xml.tgt.has('diet'):
-            withdeps = []
-            for p in pkglist:
-                deps = cache.get_dependencies(p)
-                withdeps += [d.name for d in deps]
-                withdeps += [p]
+            pkglist = cache.get_dependency_closure(pkglist)
 
-            pkglist = list(set(withdeps))
+        # Only read the lists, that exist, instead of trying all names
+        info = 'var/lib/dpkg/info'
+        existing = set(os.listdir(src.fname(info)))
 
-        file_list = []
+        file_list = set()
         for line in pkglist:
-            file_list += _readlines(src, f'var/lib/dpkg/info/{line}.list')
-            file_list += _readlines(src, f'var/lib/dpkg/info/{line}.conffiles')
+            for name in (line, f'{line}:{arch}'):
+                for ext in ('list', 'conffiles'):
+                    if f'{name}.{ext}' in existing:
+                        file_list.update(_readlines(src, f'{info}/{name}.{ext}'))
 
-            file_list += _readlines(src, f'var/lib/dpkg/info/{line}:{arch}.list')
-            file_list += _readlines(src, f'var/lib/dpkg/info/{line}:{arch}.conffiles')
-
-        file_list = sorted(set(file_list),
-                           key=lambda k: k[4:] if k.startswith('/usr') else k)
         copy_filelist(src, file_list, dst)
     else:
-        # first copy most diretories
-        for f in src.listdir():
-            subprocess.call(['cp', '-a', '--reflink=auto', f, dst.fname('')])
+        copy_tree(src.path, dst.path)
 
     try:
         dst.mkdir_p('dev')
@@ -190,43 +203,63 @@ class ElbeFilesystem(Filesystem):
         with self.open('etc/elbe_base.xml', 'wb', opener=opener) as elbe_base:
             xml.xml.write(elbe_base)
 
-    def write_licenses(self, f, pkglist, xml_fname=None):
-        licence_xml = copyright_xml()
-        for pkg in pkglist:
-            copyright_file = os.path.join('/usr/share/doc', pkg, 'copyright')
-            copyright_fname = self.fname(copyright_file)
-            if os.path.isfile(copyright_fname):
-                try:
-                    with io.open(copyright_fname, 'r',
-                                 encoding='utf-8', errors='replace') as lic:
-                        lic_text = lic.read()
-                except IOError as e:
-                    logging.exception('Error while processing license file %s',
-                                      copyright_fname)
-                    lic_text = u"Error while processing license file %s: '%s'" % (
-                        copyright_file, e.strerror)
-            else:
-                logging.warning('License file does not exist, skipping %s',
-                                copyright_fname)
-                continue
-            # in Python2 'pkg' is a binary string whereas in Python3 it is a
-            # unicode string. So make sure that pkg ends up as a unicode string
-            # in both Python2 and Python3.
-            pkg = pkg.encode(encoding='utf-8').decode(encoding='utf-8')
-
-            if f is not None:
-                f.write(pkg)
-                f.write(':\n======================================'
-                        '==========================================')
-                f.write('\n')
-                f.write(lic_text)
-                f.write('\n\n')
-
+    def _read_copyright(self, pkg):
+        copyright_file = os.path.join('/usr/share/doc', pkg, 'copyright')
+        copyright_fname = self.fname(copyright_file)
+        if not os.path.isfile(copyright_fname):
+            logging.warning('License file does not exist, skipping %s',
+                            copyright_fname)
+            return None
+
+        try:
+            with io.open(copyright_fname, 'r',
+                         encoding='utf-8', errors='replace') as lic:
+                return lic.read()
+        except IOError as e:
+            logging.exception('Error while processing license file %s',
+                              copyright_fname)
+            return u"Error while processing license file %s: '%s'" % (
+                copyright_file, e.strerror)
+
+    def write_licenses(self, f, pkglist, xml_fname=None, cache=None):
+        """
+        Writes the copyright files of the packages in 'pkglist' to the
+        file 'f' and the licence XML 'xml_fname'.  The packages are
+        processed in batches, which are parsed in parallel by one process
+        pool, and the results are kept in the CopyrightCache 'cache'.
+        """
+        if cache is None:
+            cache = CopyrightCache()
+
+        with contextlib.ExitStack() as stack:
+            licence_xml = None
             if xml_fname is not None:
-                licence_xml.add_copyright_file(pkg, lic_text)
+                licence_xml = stack.enter_context(copyright_xml(xml_fname))
+                executor = stack.enter_context(copyright_executor())
+
+            for i in range(0, len(pkglist), _licence_batch):
+                licences = []
+                for pkg in pkglist[i:i + _licence_batch]:
+                    lic_text = self._read_copyright(pkg)
+                    if lic_text is not None:
+                        licences.append((pkg, lic_text))
+
+                if licence_xml is not None:
+                    parsed = cache.parse([lic_text for _, lic_text in licences], executor)
+                else:
+                    parsed = [None] * len(licences)
+
+                for (pkg, lic_text), p in zip(licences, parsed):
+                    if f is not None:
+                        f.write(pkg)
+                        f.write(':\n======================================'
+                                '==========================================')
+                        f.write('\n')
+                        f.write(lic_text)
+                        f.write('\n\n')
 
-        if xml_fname is not None:
-            licence_xml.write(xml_fname)
+                    if licence_xml is not None:
+                        licence_xml.add_copyright_file(pkg, lic_text, p)
 
 
 def _file_or_directory_seem_equal(a, b):
@@ -485,24 +518,20 @@ class TargetFs(ChRootFilesystem):
             _make_tarball('', targz_name)
 
         if self.xml.has('target/package/cpio'):
-            oldwd = os.getcwd()
             cpio_name = self.xml.text('target/package/cpio/name')
-            os.chdir(self.fname(''))
             try:
                 do(
                     f'find . -print | cpio -ov -H newc >'
-                    f'{os.path.join(targetdir, cpio_name)}')
+                    f'{os.path.join(targetdir, cpio_name)}',
+                    cwd=self.fname(''))
                 # only append filename if creating cpio was successful
                 self.images.append(cpio_name)
             except subprocess.CalledProcessError:
                 # error was logged; continue
                 pass
-            os.chdir(oldwd)
 
         if self.xml.has('target/package/squashfs'):
-            oldwd = os.getcwd()
             sfs_name = self.xml.text('target/package/squashfs/name')
-            os.chdir(self.fname(''))
             try:
                 options = ''
                 if self.xml.has('target/package/squashfs/options'):
@@ -510,13 +539,13 @@ class TargetFs(ChRootFilesystem):
 
                 do(
                     f"mksquashfs {self.fname('')} {targetdir}/{sfs_name} "
-                    f'-noappend -no-progress {options}')
+                    f'-noappend -no-progress {options}',
+                    cwd=self.fname(''))
                 # only append filename if creating mksquashfs was successful
                 self.images.append(sfs_name)
             except subprocess.CalledProcessError:
                 # error was logged; continue
                 pass
-            os.chdir(oldwd)
 
     def pack_images(self, builddir):
         for img, packer in self.image_packers.items():
@@ -12,12 +12,15 @@ import shutil
 import subprocess
 import sys
 import tarfile
+import tempfile
 
 from debian.changelog import Changelog
 
 from elbepack.aptpkgutils import XMLPackage
 from elbepack.archivedir import archive_tmpfile
+from elbepack.buildcache import files_digest, upstream_release_digest
 from elbepack.cdroms import mk_binary_cdrom, mk_source_cdrom
+from elbepack.dpkgindex import installed_packages
 from elbepack.dump import (
     check_full_pkgs,
     dump_debootstrappkgs,
@@ -29,6 +32,8 @@ from elbepack.efilesystem import TargetFs, extract_target
 from elbepack.elbexml import ElbeXML, NoInitvmNode, ValidationError
 from elbepack.filesystem import size_to_int
 from elbepack.finetuning import do_prj_finetuning
+from elbepack.hashes import sha256sum
+from elbepack.licencexml import CopyrightCache
 from elbepack.log import validation
 from elbepack.pbuilder import (
     pbuilder_get_debootstrap_key_path,
@@ -38,8 +43,9 @@ from elbepack.pbuilder import (
     pbuilder_write_repo_hook,
 )
 from elbepack.repomanager import ProjectRepo
-from elbepack.rfs import BuildEnv
+from elbepack.rfs import BuildEnv, proxy_env
 from elbepack.rpcaptcache import get_rpcaptcache
+from elbepack.scheduler import Stage, run_stages
 from elbepack.shellhelper import chroot, do
 from elbepack.templates import write_pack_template
 from elbepack.version import elbe_version
@@ -49,6 +55,27 @@ _xz_env = {
     'XZ_OPT': '-T0 -M40%',
 }
 
+# XML nodes, which influence the content of the buildenv after
+# debootstrap and install_packages()
+_buildenv_xml_paths = [
+    'project/buildtype',
+    'project/mirror',
+    'project/noauth',
+    'project/install-recommends',
+    'project/preference',
+    'project/raw-preference',
+    'project/suite',
+    'project/buildimage',
+    'project/preseed',
+    'target/hostname',
+    'target/domain',
+    'target/passwd_hashed',
+    'target/console',
+    'target/debootstrap',
+    'target/install-recommends',
+    'target/pkg-list',
+]
+
 
 class IncompatibleArchitectureException(Exception):
     def __init__(self, oldarch, newarch):
@@ -140,6 +167,13 @@ class ElbeProject:
         # Apt-Cache will be created on demand by the get_rpcaptcache method
         self._rpcaptcache = None
 
+        # BuildCache used by build(), None disables caching
+        self.build_cache = None
+
+        # Parsed copyright files, shared by all licence lists
+        self.copyright_cache = CopyrightCache(
+            os.path.join(self.builddir, 'copyright-cache.pickle'))
+
         # Initialise Repo Images to Empty list.
         self.repo_images = []
 
@@ -226,22 +260,21 @@ class ElbeProject:
         ]
 
     def get_sysroot_dev_packages_files(self):
-        def _dpkg_query(*args):
-            return subprocess.check_output(['/usr/bin/dpkg-query',
-                                            '--root', self.sysrootpath,
-                                            '--no-pager',
-                                            *args])
-
-        dev_packages = _dpkg_query('--showformat', '${db:Status-Status}|${Package}\n',
-                                   '--show', '*-dev').splitlines()
-        for line in dev_packages:
-            status, package = line.split(b'|')
-            if status != b'installed':
+        # The file lists are read directly, instead of asking dpkg-query
+        # for every package.
+        for name, listfile in installed_packages(self.sysrootpath, self.arch,
+                                                 states={'installed'}):
+            if not name.split(':')[0].endswith('-dev'):
                 continue
 
-            for file in _dpkg_query('--listfiles', package).splitlines():
-                file = file.decode('ascii')
+            try:
+                with open(listfile, encoding='utf-8') as f:
+                    files = f.read().splitlines()
+            except FileNotFoundError:
+                logging.warning('No list of files for installed package %s', name)
+                continue
 
+            for file in files:
                 # The package technically also contains parent directories up to the root.
                 if not os.path.isfile(os.path.join(self.sysrootpath, './' + file)):
                     continue
@@ -292,7 +325,7 @@ class ElbeProject:
                 raise AptCacheCommitError(str(e))
 
             self.gen_licenses('sysroot-target', sysrootenv,
-                              [p.name for p in cache.get_installed_pkgs()])
+                              [name for name, in cache.get_installed_fields(['name'])])
 
         try:
             sysrootenv.rfs.dump_elbeversion(self.xml)
@@ -305,13 +338,12 @@ class ElbeProject:
             chroot(self.sysrootpath, ['/usr/bin/symlinks', '-cr', '/usr/lib'])
             chroot(self.sysrootpath, ['/usr/bin/symlinks', '-cr', '/usr/lib64'])
 
-        paths = self.get_sysroot_paths()
+        paths = sysrootenv.rfs.find_paths(self.get_sysroot_paths())
+
+        with open(sysrootfilelist, 'w') as filelist_fd:
+            for p in paths:
+                filelist_fd.write(f'{p}\n')
 
-        do(['rm', sysrootfilelist], check=False)
-        os.chdir(self.sysrootpath)
-        for p in paths:
-            do(f'find -path "{p}" >> {sysrootfilelist}')
-        with open(sysrootfilelist, 'a') as filelist_fd:
             # include /lib if it is a symlink (buster and later)
             if os.path.islink(self.sysrootpath + '/lib'):
                 filelist_fd.write('./lib\n')
@@ -367,7 +399,7 @@ class ElbeProject:
                 raise AptCacheCommitError(str(e))
 
             self.gen_licenses('sysroot-host', host_sysrootenv,
-                              [p.name for p in cache.get_installed_pkgs()])
+                              [name for name, in cache.get_installed_fields(['name'])])
 
         # This is just a sysroot, some directories
         # need to be removed.
@@ -544,6 +576,17 @@ class ElbeProject:
                     src_lst = cache.get_corresponding_source_packages()
                     components[name] = (build_env.rfs, cache, src_lst)
 
+                src_cdrom_key = None
+                if self.build_cache is not None:
+                    src_cdrom_key = self._src_cdrom_cache_key(components, init_codename,
+                                                              cdrom_size)
+                    restored = self.build_cache.restore('src-cdrom', src_cdrom_key,
+                                                        self.builddir)
+                    if restored is not None:
+                        self.repo_images += [os.path.join(self.builddir, iso)
+                                             for iso in restored]
+                        return
+
                 try:
                     # Using kwargs here allows us to avoid making
                     # special case for when self.xml is None
@@ -555,18 +598,83 @@ class ElbeProject:
                     if self.xml is not None:
                         kwargs['mirror'] = self.xml.get_primary_mirror(env.rfs.fname('cdrom'))
 
+                    src_images = []
                     for iso in mk_source_cdrom(components,
                                                self.codename,
                                                init_codename,
                                                self.builddir,
                                                **kwargs):
-                        self.repo_images += iso
+                        src_images += iso
+                    self.repo_images += src_images
+
+                    if src_cdrom_key is not None:
+                        self.build_cache.store('src-cdrom', src_cdrom_key, src_images)
                 except SystemError as e:
                     # e.g. no deb-src urls specified
                     validation.error(str(e))
 
+    def _buildenv_cache_key(self, build_sources, skip_pbuild, base_image_path):
+        if base_image_path or self.xml.has('project/mirror/cdrom'):
+            return None
+
+        # Packages built by pbuilder are not known before the buildenv exists
+        if self.xml.has('target/pbuilder') and not skip_pbuild:
+            return None
+
+        sources_list = self.xml.create_apt_sources_list(build_sources=build_sources)
+        release = upstream_release_digest(sources_list, proxy_env(self.xml))
+        if release is None:
+            return None
+
+        return self.build_cache.key(
+            'buildenv', self.arch, sources_list, release,
+            files_digest(self.builddir, ['repo/dists/*/*/*/Packages']),
+            *[self.xml.node(p).tostring() for p in _buildenv_xml_paths if self.xml.has(p)])
+
+    def _restore_buildenv(self, key, build_sources):
+        do(['rm', '-rf', self.chrootpath])
+        if self.build_cache.restore('buildenv', key, self.builddir) is None:
+            return False
+
+        # The package lists recorded by install_packages()
+        cachedxml_path = os.path.join(self.builddir, 'buildenv.xml')
+        cachedxml = ElbeXML(cachedxml_path, skip_validate=True)
+        os.remove(cachedxml_path)
+
+        self.xml.get_debootstrappkgs_from(cachedxml)
+        try:
+            self.xml.get_initvmnode_from(cachedxml)
+        except NoInitvmNode:
+            pass
+        self.sync_xml_to_disk()
+
+        self.buildenv = BuildEnv(self.xml, self.chrootpath,
+                                 build_sources=build_sources, clean=False)
+        return True
+
+    def _store_buildenv(self, key):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            xmlpath = os.path.join(tmpdir, 'buildenv.xml')
+            self.xml.xml.write(xmlpath)
+            self.build_cache.store('buildenv', key, [self.chrootpath, xmlpath])
+
+    def _src_cdrom_cache_key(self, components, init_codename, cdrom_size):
+        pkg_lists = [f'{name}: {sorted(pkg_lst)}'
+                     for name, (_, _, pkg_lst) in sorted(components.items())]
+        nodes = [self.xml.node(p).tostring()
+                 for p in ['project/mirror', 'target/pkg-list', 'src-cdrom', 'debootstrappkgs']
+                 if self.xml.has(p)]
+        initvm_dscs = sorted(glob.glob('**/*.dsc', root_dir='/var/cache/elbe/sources',
+                                       recursive=True))
+
+        return self.build_cache.key('src-cdrom', self.codename, init_codename, cdrom_size,
+                                    *pkg_lists, *nodes, *initvm_dscs)
+
     def build(self, build_bin=False, build_sources=False, cdrom_size=None,
-              skip_pkglist=False, skip_pbuild=False, base_image_path=None):
+              skip_pkglist=False, skip_pbuild=False, base_image_path=None,
+              build_cache=None, jobs=1):
+
+        self.build_cache = build_cache
 
         # Write the log header
         self.write_log_header()
@@ -575,11 +683,20 @@ class ElbeProject:
         # self.buildenv might be set when we come here.
         # However, if its not a full_buildenv, we specify clean here,
         # so it gets rebuilt properly.
+        buildenv_key = None
+        buildenv_restored = False
         if not self.has_full_buildenv():
-            do(['mkdir', '-p', self.chrootpath])
-            self.buildenv = BuildEnv(self.xml, self.chrootpath,
-                                     build_sources=build_sources, clean=True,
-                                     base_image_path=base_image_path)
+            if self.build_cache is not None:
+                buildenv_key = self._buildenv_cache_key(build_sources, skip_pbuild,
+                                                        base_image_path)
+            if buildenv_key is not None:
+                buildenv_restored = self._restore_buildenv(buildenv_key, build_sources)
+
+            if not buildenv_restored:
+                do(['mkdir', '-p', self.chrootpath])
+                self.buildenv = BuildEnv(self.xml, self.chrootpath,
+                                         build_sources=build_sources, clean=True,
+                                         base_image_path=base_image_path)
             skip_pkglist = False
 
         # Import keyring
@@ -603,7 +720,7 @@ class ElbeProject:
         self.repo.finalize()
 
         # Install packages
-        if not skip_pkglist:
+        if not skip_pkglist and not buildenv_restored:
             self.install_packages(self.buildenv)
 
         try:
@@ -611,11 +728,13 @@ class ElbeProject:
         except IOError:
             logging.exception('Dump elbeversion failed')
 
+        if buildenv_key is not None and not buildenv_restored:
+            self._store_buildenv(buildenv_key)
+
         # Extract target FS. We always create a new instance here with
         # clean=true, because we want a pristine directory.
         self.targetfs = TargetFs(self.targetpath, self.buildenv.xml,
                                  clean=True)
-        os.chdir(self.buildenv.rfs.fname(''))
         extract_target(self.buildenv.rfs, self.xml, self.targetfs,
                        self.get_rpcaptcache())
 
@@ -650,33 +769,30 @@ class ElbeProject:
         except MemoryError:
             logging.exception('Write source.xml failed (archive to huge?)')
 
-        # Elbe report
         cache = self.get_rpcaptcache()
-        tgt_pkgs = elbe_report(self.xml, self.buildenv, cache, self.targetfs)
-
-        # chroot' licenses
-        self.gen_licenses('chroot', self.buildenv,
-                          [p.name for p in cache.get_installed_pkgs()])
-
-        self.gen_licenses('target', self.buildenv, tgt_pkgs)
+        chroot_pkgs = [name for name, in cache.get_installed_fields(['name'])]
 
         # Use some handwaving to determine grub version
         grub_arch = 'ia32' if self.arch == 'i386' else self.arch
+        grub_pkgs = cache.get_install_state(['grub-pc',
+                                             f'grub-efi-{grub_arch}-bin',
+                                             'shim-signed',
+                                             f'grub-efi-{grub_arch}-signed',
+                                             'grub-legacy'])
         grub_fw_type = []
         grub_version = 0
-        if self.get_rpcaptcache().is_installed('grub-pc'):
+        if grub_pkgs['grub-pc']:
             grub_version = 202
             grub_fw_type.append('bios')
-        if self.get_rpcaptcache().is_installed(f'grub-efi-{grub_arch}-bin'):
+        if grub_pkgs[f'grub-efi-{grub_arch}-bin']:
             grub_version = 202
             grub_tgt = 'x86_64' if self.arch == 'amd64' else self.arch
             grub_fw_type.extend(['efi', grub_tgt + '-efi'])
-        if (self.get_rpcaptcache().is_installed('shim-signed') and
-                self.get_rpcaptcache().is_installed(
-                    f'grub-efi-{grub_arch}-signed')):
+        if (grub_pkgs['shim-signed'] and
+                grub_pkgs[f'grub-efi-{grub_arch}-signed']):
             grub_version = 202
             grub_fw_type.append('shimfix')
-        if self.get_rpcaptcache().is_installed('grub-legacy'):
+        if grub_pkgs['grub-legacy']:
             logging.warning('package grub-legacy is installed, '
                             'this is obsolete.')
             grub_version = 97
@@ -686,9 +802,27 @@ class ElbeProject:
                             'are installed, skipping grub',
                             grub_arch)
 
-        self.targetfs.part_target(self.builddir, grub_version, grub_fw_type)
-
-        self.build_cdroms(build_bin, build_sources, cdrom_size, tgt_pkg_lst=tgt_pkgs)
+        # The stages after the report only read the finished buildenv and
+        # target, so they may run concurrently.  The apt cache is not
+        # used by more than one of them.
+        run_stages([
+            Stage('report',
+                  lambda: elbe_report(self.xml, self.buildenv, cache, self.targetfs,
+                                      os.path.join(self.builddir, 'dpkg-fileindex.pickle'))),
+            Stage('licences-chroot',
+                  lambda _: self.gen_licenses('chroot', self.buildenv, chroot_pkgs),
+                  deps=['report']),
+            Stage('licences-target',
+                  lambda tgt_pkgs: self.gen_licenses('target', self.buildenv, list(tgt_pkgs)),
+                  deps=['report']),
+            Stage('images',
+                  lambda _: self.targetfs.part_target(self.builddir, grub_version, grub_fw_type),
+                  deps=['report']),
+            Stage('cdroms',
+                  lambda tgt_pkgs: self.build_cdroms(build_bin, build_sources, cdrom_size,
+                                                     tgt_pkg_lst=list(tgt_pkgs)),
+                  deps=['report']),
+        ], jobs=jobs)
 
         if self.postbuild_file:
             logging.info('Postbuild script')
@@ -767,13 +901,15 @@ class ElbeProject:
         orig_files = glob.glob(os.path.join(self.builddir, f'{src_pkg_name}*.orig.*'))
 
         if '3.0 (quilt)' in formatfile and not orig_files:
-            do(['origtargz', '--download-only', '--tar-only'], cwd=pdebuilder_current)
+            do(['origtargz', '--download-only', '--tar-only'], cwd=pdebuilder_current,
+               env_add=proxy_env(self.xml))
         else:
             for orig_fname in orig_files:
                 do(['mv', orig_fname, os.path.join(self.builddir, 'pdebuilder')])
 
         try:
             debuild_env = {
+                **proxy_env(self.xml),
                 'DEBUILD_DPKG_BUILDPACKAGE_OPTS': '-sa -jauto',
                 'DEB_BUILD_PROFILES': profile.replace(',', ' '),
                 'DEB_BUILD_OPTIONS': ' '.join(deb_build_opts),
@@ -821,7 +957,8 @@ class ElbeProject:
     def update_pbuilder(self):
         do(['pbuilder', '--update',
             '--configfile', os.path.join(self.builddir, 'pbuilderrc'),
-            '--aptconfdir', os.path.join(self.builddir, 'aptconfdir')])
+            '--aptconfdir', os.path.join(self.builddir, 'aptconfdir')],
+           env_add=proxy_env(self.xml))
 
     def create_pbuilder(self, cross, noccache, ccachesize):
         # Remove old pbuilder directory, if it exists
@@ -871,12 +1008,14 @@ class ElbeProject:
                 '--buildplace', os.path.join(self.builddir, 'pbuilder_cross'),
                 '--configfile', os.path.join(self.builddir, 'cross_pbuilderrc'),
                 '--aptconfdir', os.path.join(self.builddir, 'aptconfdir'),
-                '--debootstrapopts', '--include=git,gnupg', *no_check_gpg, *keyring])
+                '--debootstrapopts', '--include=git,gnupg', *no_check_gpg, *keyring],
+               env_add=proxy_env(self.xml))
         else:
             do(['pbuilder', '--create',
                 '--configfile', os.path.join(self.builddir, 'pbuilderrc'),
                 '--aptconfdir', os.path.join(self.builddir, 'aptconfdir'),
-                '--debootstrapopts', '--include=git,gnupg', *no_check_gpg, *keyring])
+                '--debootstrapopts', '--include=git,gnupg', *no_check_gpg, *keyring],
+               env_add=proxy_env(self.xml))
 
     def sync_xml_to_disk(self):
         try:
@@ -900,7 +1039,8 @@ class ElbeProject:
         if env.rpcaptcache is None:
             env.rpcaptcache = get_rpcaptcache(env.rfs, arch,
                                               norecommend,
-                                              self.xml.prj.has('noauth'))
+                                              self.xml.prj.has('noauth'),
+                                              env_add=env.proxy_env())
         return env.rpcaptcache
 
     def drop_rpcaptcache(self, env=None):
@@ -1046,15 +1186,14 @@ class ElbeProject:
                 pkgs = pkgs + target.xml.get_buildenv_packages()
 
             # Now install requested packages
-            for p in pkgs:
-                try:
-                    self.get_rpcaptcache(env=target).mark_install(p, None)
-                except KeyError:
-                    logging.exception('No Package %s', p)
-                except SystemError:
-                    logging.exception('Unable to correct problems '
-                                      'in package %s',
-                                      p)
+            failed = self.get_rpcaptcache(env=target).mark_install_pkgs(pkgs)
+            for p, exc in failed:
+                if isinstance(exc, KeyError):
+                    logging.error('No Package %s', p, exc_info=exc)
+                else:
+                    logging.error('Unable to correct problems '
+                                  'in package %s',
+                                  p, exc_info=exc)
 
             # temporary disabled because of
             # https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=776057
@@ -1078,6 +1217,22 @@ class ElbeProject:
         lic_xml_fname = os.path.join(self.builddir, f'licence-{rfs}.xml')
         pkg_list.sort()
 
+        key = None
+        if self.build_cache is not None:
+            copyrights = []
+            for pkg in pkg_list:
+                copyright_fname = env.rfs.fname(os.path.join('/usr/share/doc', pkg, 'copyright'))
+                if os.path.isfile(copyright_fname):
+                    copyrights.append(f'{pkg} {sha256sum(copyright_fname)}')
+
+            key = self.build_cache.key('licences', rfs, *copyrights)
+            if self.build_cache.restore('licences', key, self.builddir) is not None:
+                return
+
         with io.open(lic_txt_fname, 'w+',
                      encoding='utf-8', errors='replace') as f:
-            env.rfs.write_licenses(f, pkg_list, lic_xml_fname)
+            env.rfs.write_licenses(f, pkg_list, lic_xml_fname, self.copyright_cache)
+        self.copyright_cache.save()
+
+        if key is not None:
+            self.build_cache.store('licences', key, [lic_txt_fname, lic_xml_fname])
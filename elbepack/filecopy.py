@@ -0,0 +1,213 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import concurrent.futures
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import stat
+import time
+
+# From linux/fs.h
+_FICLONE = 0x40049409
+
+# copy_file_range() is not supported between these files
+_no_copy_file_range = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+
+# Extended attributes, that can not be copied, are skipped like in shutil
+_no_xattr = {errno.EPERM, errno.ENOTSUP, errno.ENODATA, errno.EINVAL, errno.EACCES}
+
+
+def copy_fd(fsrc, fdst):
+    """
+    Copies the content of the file descriptor 'fsrc' to 'fdst'.
+    """
+    # Share the data blocks, if the filesystem supports reflinks
+    try:
+        fcntl.ioctl(fdst, _FICLONE, fsrc)
+        return
+    except OSError:
+        pass
+
+    # Let the kernel copy the data, without passing it through user space
+    size = os.fstat(fsrc).st_size
+    offset = 0
+    try:
+        while offset < size:
+            n = os.copy_file_range(fsrc, fdst, size - offset)
+            if n == 0:
+                break
+            offset += n
+        return
+    except OSError as e:
+        if e.errno not in _no_copy_file_range:
+            raise
+
+    os.lseek(fsrc, offset, os.SEEK_SET)
+    os.lseek(fdst, offset, os.SEEK_SET)
+    with open(fsrc, 'rb', closefd=False) as s, open(fdst, 'wb', closefd=False) as d:
+        shutil.copyfileobj(s, d)
+
+
+def copy_file(src, dst):
+    """
+    Copies the content and metadata of the file 'src' to 'dst', like
+    shutil.copy2().  The content is shared by a reflink, or copied with
+    copy_file_range(), if the filesystem supports it.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        copy_fd(fsrc.fileno(), fdst.fileno())
+    shutil.copystat(src, dst)
+
+
+def _copy_xattrs(src, dst, follow_symlinks=True):
+    try:
+        names = os.listxattr(src, follow_symlinks=follow_symlinks)
+    except OSError as e:
+        if e.errno not in _no_xattr:
+            raise
+        return
+
+    for name in names:
+        try:
+            value = os.getxattr(src, name, follow_symlinks=follow_symlinks)
+            os.setxattr(dst, name, value, follow_symlinks=follow_symlinks)
+        except OSError as e:
+            if e.errno not in _no_xattr:
+                raise
+
+
+def _copy_metadata(src, dst, st):
+    """
+    Applies ownership, mode, extended attributes and timestamps of 'src'
+    to 'dst', like 'cp -a'.  The ownership is changed first, because it
+    resets setuid bits and file capabilities.
+    """
+    follow = not stat.S_ISLNK(st.st_mode)
+
+    try:
+        os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=follow)
+    except PermissionError:
+        # Only root may give files away, cp does not complain either
+        pass
+
+    if follow:
+        os.chmod(dst, stat.S_IMODE(st.st_mode))
+
+    _copy_xattrs(src, dst, follow_symlinks=follow)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=follow)
+
+
+def copy_tree(src, dst, jobs=None, link=None):
+    """
+    Copies the content of the directory 'src' into the directory 'dst',
+    like 'cp -a --reflink=auto src/. dst'.  Ownership, modes, extended
+    attributes, timestamps and hardlinks are preserved.
+
+    Regular files, for which link(path) returns True, are hardlinked to
+    the file in 'src' instead, if the filesystem allows it.
+
+    The tree is walked once, creating the directories, symlinks and
+    special files.  The regular files are then copied by 'jobs' threads.
+    Errors are logged, and the copy goes on with the next file.
+
+    Returns the number of copied files and bytes.
+    """
+    start = time.monotonic()
+
+    dirs = []
+    files = []
+    hardlinks = []
+    inodes = {}
+    nbytes = 0
+
+    def _try(func, *args, **kwargs):
+        try:
+            func(*args, **kwargs)
+        except OSError as e:
+            logging.warning('Error while copying %s - %s', args[0], e)
+
+    os.makedirs(dst, exist_ok=True)
+    dirs.append((src, dst, os.lstat(src)))
+
+    todo = [(src, dst)]
+    while todo:
+        srcdir, dstdir = todo.pop()
+        try:
+            entries = list(os.scandir(srcdir))
+        except OSError as e:
+            logging.warning('Error while copying %s - %s', srcdir, e)
+            continue
+
+        for entry in entries:
+            s = entry.path
+            d = os.path.join(dstdir, entry.name)
+            st = entry.stat(follow_symlinks=False)
+
+            if stat.S_ISDIR(st.st_mode):
+                if not os.path.isdir(d):
+                    _try(os.mkdir, d)
+                dirs.append((s, d, st))
+                todo.append((s, d))
+                continue
+
+            # Only the first name of an inode is copied, the others are linked
+            if st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                if key in inodes:
+                    hardlinks.append((inodes[key], d))
+                    continue
+                inodes[key] = d
+
+            if stat.S_ISREG(st.st_mode):
+                if link is not None and link(s):
+                    try:
+                        if os.path.lexists(d):
+                            os.unlink(d)
+                        os.link(s, d)
+                        continue
+                    except OSError:
+                        pass
+                files.append((s, d, st))
+                nbytes += st.st_size
+                continue
+
+            if os.path.lexists(d):
+                _try(os.unlink, d)
+            if stat.S_ISLNK(st.st_mode):
+                _try(os.symlink, os.readlink(s), d)
+            else:
+                _try(os.mknod, d, st.st_mode, st.st_rdev)
+            _try(_copy_metadata, s, d, st)
+
+    def _copy(s, d, st):
+        with open(s, 'rb') as fsrc, open(d, 'wb') as fdst:
+            copy_fd(fsrc.fileno(), fdst.fileno())
+        _copy_metadata(s, d, st)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_copy, *f): f[0] for f in files}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except OSError as e:
+                logging.warning('Error while copying %s - %s', futures[future], e)
+
+    for target, d in hardlinks:
+        if os.path.lexists(d):
+            _try(os.unlink, d)
+        _try(os.link, target, d, follow_symlinks=False)
+
+    # The timestamps of the directories change, while they are filled
+    for s, d, st in reversed(dirs):
+        _try(_copy_metadata, s, d, st)
+
+    elapsed = time.monotonic() - start
+    logging.info('Copied %d files, %.1f MiB in %.1f s (%.1f MiB/s)',
+                 len(files), nbytes / 2**20, elapsed,
+                 nbytes / 2**20 / max(elapsed, 1e-3))
+
+    return len(files), nbytes
@@ -3,8 +3,11 @@
 # SPDX-FileCopyrightText: 2014-2017 Linutronix GmbH
 
 import errno
+import fnmatch
 import gzip
+import heapq
 import os
+import re
 import shutil
 from glob import glob
 from string import digits
@@ -417,16 +420,141 @@ class Filesystem:
                 realpath = os.path.join(dirpath, f)
                 yield '/' + fpath, realpath
 
-    def mtime_snap(self, dirname='', exclude_dirs=None):
-        if not exclude_dirs:
-            exclude_dirs = []
-        mtime_index = {}
+    def find_paths(self, patterns):
+        """
+        Returns the paths, relative to the filesystem and starting with
+        './', which match any of 'patterns', like 'find -path <pattern>'
+        would for each of them.  As in find, '*' also matches '/', and
+        symlinks are not followed.  The tree is only walked once.
+
+        >>> this.mkdir_p('find/usr/lib/sub')
+        >>> this.write_file('find/usr/lib/libc.so.6', 0o644, '')
+        >>> this.write_file('find/usr/lib/sub/libm.so.6', 0o644, '')
+        >>> this.write_file('find/usr/lib/libc.a', 0o644, '')
+        >>> this.symlink('usr/lib', 'find/lib')
+        >>> sorted(Filesystem(this.fname('find')).find_paths(
+        ...     ['./usr/lib/*.so.*', './lib', './usr/lib/sub']))
+        ['./lib', './usr/lib/libc.so.6', './usr/lib/sub', './usr/lib/sub/libm.so.6']
+        """
+        match = re.compile('|'.join(fnmatch.translate(p) for p in patterns)).match
+
+        found = []
+        todo = ['.']
+        while todo:
+            path = todo.pop()
+            try:
+                with os.scandir(os.path.join(self.path, path)) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+
+            for entry in entries:
+                p = f'{path}/{entry.name}'
+                if match(p):
+                    found.append(p)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        todo.append(p)
+                except OSError:
+                    pass
 
-        for fpath, realpath in self.walk_files(dirname, exclude_dirs):
-            stat = os.lstat(realpath)
-            mtime_index[fpath] = stat.st_mtime
+        return found
 
-        return mtime_index
+    def mtime_snapshot(self):
+        """
+        Returns a list of (key, mtime) for all files in the filesystem,
+        taken in a single scandir() pass.  The list is ordered like
+        walk_files(sort=True) and sorted by key, so that snapshots can be
+        compared with merge_snapshots().  Use snapshot_path() to get the
+        path of a key, as it is returned by walk_files().
+
+        >>> this.mkdir_p('snap/sub')
+        >>> this.write_file('snap/sub/b', 0o644, '')
+        >>> this.write_file('snap/a', 0o644, '')
+        >>> this.symlink('sub', 'snap/link')
+        >>> snap = Filesystem(this.fname('snap')).mtime_snapshot()
+        >>> [snapshot_path(key) for key, _ in snap]
+        ['//a', '/sub/b']
+        >>> [p for p, _ in Filesystem(this.fname('snap')).walk_files(sort=True)]
+        ['//a', '/sub/b']
+        """
+        entries = []
+        _scan_mtimes(self.path, (), entries)
+        return entries
+
+
+def _scan_mtimes(path, dirkey, entries):
+    dirs = []
+    files = []
+
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                # Like os.walk(), symlinks to directories count as
+                # directories, but are not descended into.
+                if is_dir:
+                    if not entry.is_symlink():
+                        dirs.append(entry.name)
+                else:
+                    files.append((entry.name, entry.stat(follow_symlinks=False).st_mtime))
+    except OSError:
+        return
+
+    files.sort()
+    entries.extend(((dirkey, name), mtime) for name, mtime in files)
+
+    for name in sorted(dirs):
+        _scan_mtimes(os.path.join(path, name), dirkey + (name,), entries)
+
+
+def snapshot_path(key):
+    """
+    >>> snapshot_path(((), 'file'))
+    '//file'
+    >>> snapshot_path((('usr', 'bin'), 'file'))
+    '/usr/bin/file'
+    """
+    dirkey, name = key
+    # Mirror the paths of walk_files()
+    if not dirkey:
+        return '//' + name
+    return '/' + '/'.join(dirkey) + '/' + name
+
+
+def merge_snapshots(*snapshots):
+    """
+    Merge joins the snapshots and yields (key, mtimes) for each file in
+    any of them, in key order.  mtimes holds the mtime of the file in
+    each of the snapshots, or None if the file is missing in it.
+
+    >>> a = [(((), 'x'), 1.0), ((('d',), 'y'), 2.0)]
+    >>> b = [(((), 'x'), 3.0)]
+    >>> list(merge_snapshots(a, b))
+    [(((), 'x'), [1.0, 3.0]), ((('d',), 'y'), [2.0, None])]
+    """
+    def _tagged(i, snapshot):
+        for key, mtime in snapshot:
+            yield key, i, mtime
+
+    merged = heapq.merge(*[_tagged(i, snapshot) for i, snapshot in enumerate(snapshots)])
+
+    current = None
+    mtimes = None
+    for key, i, mtime in merged:
+        if key != current:
+            if current is not None:
+                yield current, mtimes
+            current = key
+            mtimes = [None] * len(snapshots)
+        mtimes[i] = mtime
+
+    if current is not None:
+        yield current, mtimes
 
 
 class TmpdirFilesystem (Filesystem):
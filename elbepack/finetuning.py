@@ -296,9 +296,10 @@ class AddFileAction(FinetuningAction):
 @_register_action('raw_cmd')
 class RawCmdAction(FinetuningAction):
 
-    def execute(self, _buildenv, target):
+    def execute(self, buildenv, target):
         with target:
-            chroot(target.path, shlex.split(self.node.et.text))
+            chroot(target.path, shlex.split(self.node.et.text),
+                   env_add=buildenv.proxy_env())
 
 
 @_register_action('command')
@@ -323,10 +324,10 @@ class CmdAction(ImageFinetuningAction):
                    env_add={'ELBE_MNT': mnt},
                    log_cmd=script)
 
-    def execute(self, _buildenv, target):
+    def execute(self, buildenv, target):
         with target:
             chroot(target.path, '/bin/sh', input=self.node.et.text.encode('ascii'),
-                   log_cmd=self.node.et.text)
+                   log_cmd=self.node.et.text, env_add=buildenv.proxy_env())
 
 
 @_register_action('buildenv_command')
@@ -334,7 +335,8 @@ class BuildenvCmdAction(FinetuningAction):
 
     def execute(self, buildenv, _target):
         with buildenv:
-            chroot(buildenv.path, '/bin/sh', input=self.node.et.text.encode('ascii'))
+            chroot(buildenv.path, '/bin/sh', input=self.node.et.text.encode('ascii'),
+                   env_add=buildenv.proxy_env())
 
 
 @_register_action('purge')
@@ -386,19 +388,19 @@ class UpdatedAction(FinetuningAction):
             cache = get_rpcaptcache(buildenv.rfs, arch)
 
             pkglist = cache.get_installed_pkgs()
-            for pkg in pkglist:
-                try:
-                    cache.download_binary(
-                        pkg.name, '/tmp/pkgs', pkg.installed_version)
-                except ValueError:
-                    logging.exception('No package %s-%s',
-                                      pkg.name, pkg.installed_version)
-                except FetchError:
-                    logging.exception('Package %s-%s could not be downloaded',
-                                      pkg.name, pkg.installed_version)
-                except TypeError:
-                    logging.exception('Package %s-%s missing name or version',
-                                      pkg.name, pkg.installed_version)
+            debs, summary = cache.download_binaries(
+                [(pkg.name, pkg.installed_version, '/tmp/pkgs') for pkg in pkglist])
+            logging.info('Binaries: %s', summary)
+
+            for (name, version, _), deb in debs.items():
+                if isinstance(deb, FetchError):
+                    logging.error('Package %s-%s could not be downloaded: %s',
+                                  name, version, deb)
+                elif isinstance(deb, TypeError):
+                    logging.error('Package %s-%s missing name or version',
+                                  name, version)
+                elif isinstance(deb, Exception):
+                    logging.error('No package %s-%s: %s', name, version, deb)
         r = UpdateRepo(target.xml,
                        target.path + '/var/cache/elbe/repos/base')
 
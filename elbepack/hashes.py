@@ -11,16 +11,21 @@ class HashValidationFailed(Exception):
     pass
 
 
-def validate_sha256(fname, expected_hash):
+def sha256sum(fname):
     m = hashlib.sha256()
     with open(fname, 'rb') as f:
         buf = f.read(65536)
         while buf:
             m.update(buf)
             buf = f.read(65536)
-    if m.hexdigest() != expected_hash:
+    return m.hexdigest()
+
+
+def validate_sha256(fname, expected_hash):
+    digest = sha256sum(fname)
+    if digest != expected_hash:
         raise HashValidationFailed(
-                f'file "{fname}" failed to verify ! got: "{m.hexdigest()}" '
+                f'file "{fname}" failed to verify ! got: "{digest}" '
                 f'expected: "{expected_hash}"')
 
 
@@ -124,7 +124,7 @@ def _submit_and_dl_result(control, xmlfile, cdrom, base_image, args):
         print('Upload finished')
 
     control.service.build(prjdir, args.build_bin, args.build_sources, bool(cdrom),
-                          uploaded_base_image_path)
+                          uploaded_base_image_path, args.build_cache, args.jobs)
 
     print('Build started, waiting till it finishes')
 
@@ -286,6 +286,12 @@ def _add_submit_arguments(f):
     f = add_argument('--base-image', dest='base_image',
                      help='Use a base image instead of debootstrap (experimental)')(f)
 
+    f = add_argument('--build-cache', dest='build_cache', action='store_true', default=False,
+                     help='Reuse results of unchanged build stages from the build cache')(f)
+
+    f = add_argument('--jobs', type=int, default=1,
+                     help='Number of independent build stages to run concurrently')(f)
+
     return f
 
 
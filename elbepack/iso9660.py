@@ -0,0 +1,155 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import io
+import os
+
+_sector_size = 2048
+
+# Escape sequences of the Joliet supplementary volume descriptor
+_joliet_escapes = (b'%/@', b'%/C', b'%/E')
+
+
+class _ExtentReader(io.RawIOBase):
+    def __init__(self, fd, start, size):
+        super().__init__()
+        self.fd = fd
+        self.start = start
+        self.size = size
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.size - self.pos)
+        if n <= 0:
+            return 0
+        data = os.pread(self.fd, n, self.start + self.pos)
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+class ISO9660:
+    """
+    Read-only access to the files of an ISO9660 image, without extracting
+    it.  The Joliet names are used, if the image has them, which is the
+    case for the cdroms generated by elbe.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.fd = os.open(fname, os.O_RDONLY)
+        try:
+            self.joliet, self._root = self._find_root()
+            self.files = dict(self._walk())
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
+
+    def close(self):
+        os.close(self.fd)
+
+    def _read(self, offset, size):
+        data = os.pread(self.fd, size, offset)
+        if len(data) != size:
+            raise ValueError(f'{self.fname}: unexpected end of image')
+        return data
+
+    def _find_root(self):
+        primary = None
+        sector = 16
+        while True:
+            vd = self._read(sector * _sector_size, _sector_size)
+            if vd[1:6] != b'CD001':
+                raise ValueError(f'{self.fname}: not an ISO9660 image')
+
+            if vd[0] == 1 and primary is None:
+                primary = vd[156:156 + 34]
+            elif vd[0] == 2 and vd[88:91] in _joliet_escapes:
+                return True, vd[156:156 + 34]
+            elif vd[0] == 255:
+                break
+
+            sector += 1
+
+        if primary is None:
+            raise ValueError(f'{self.fname}: no primary volume descriptor')
+
+        return False, primary
+
+    def _records(self, extent, size):
+        data = self._read(extent * _sector_size, size)
+        i = 0
+        while i < size:
+            length = data[i]
+            if length == 0:
+                # Records do not cross sector boundaries
+                i = (i // _sector_size + 1) * _sector_size
+                continue
+            yield data[i:i + length]
+            i += length
+
+    def _name(self, record):
+        name = record[33:33 + record[32]]
+        if self.joliet:
+            name = name.decode('utf-16-be')
+        else:
+            name = name.decode('ascii').lower()
+
+        name = name.split(';')[0]
+        if not self.joliet:
+            name = name.rstrip('.')
+        return name
+
+    def _walk(self):
+        todo = [('', self._root)]
+        while todo:
+            path, dirrecord = todo.pop()
+            extent = int.from_bytes(dirrecord[2:6], 'little')
+            size = int.from_bytes(dirrecord[10:14], 'little')
+
+            for record in self._records(extent, size):
+                # Skip the entries of the directory itself and its parent
+                if record[32] == 1 and record[33] in (0, 1):
+                    continue
+
+                name = f'{path}/{self._name(record)}'.lstrip('/')
+                flags = record[25]
+
+                if flags & 0x02:
+                    todo.append((name, record))
+                elif flags & 0x80:
+                    raise ValueError(f'{self.fname}: multi-extent file {name} is not supported')
+                else:
+                    yield name, (int.from_bytes(record[2:6], 'little'),
+                                 int.from_bytes(record[10:14], 'little'))
+
+    def open(self, path):
+        """
+        Returns a binary file object for reading the file 'path'.
+        """
+        extent, size = self.files[path]
+        return io.BufferedReader(_ExtentReader(self.fd, extent * _sector_size, size))
@@ -2,11 +2,15 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2016-2017 Linutronix GmbH
 
-
+import contextlib
+import hashlib
 import io
 import logging
+import multiprocessing
 import re
+import threading
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 from debian.copyright import (
     Copyright,
@@ -16,7 +20,10 @@ from debian.copyright import (
     NotMachineReadableError,
 )
 
-from elbepack.treeutils import etree
+from lxml.etree import Element, iterparse, xmlfile
+
+from elbepack.pickle_cache import load_pickle_cache, store_pickle_cache
+from elbepack.treeutils import elem
 
 remove_re = re.compile('[\x00-\x08\x0B-\x0C\x0E-\x1F\x7F]')
 
@@ -45,49 +52,189 @@ def get_heuristics_license_list(c):
     return set(licenses)
 
 
-class copyright_xml:
-    def __init__(self):
-        self.outxml = etree(None)
-        self.pkglist = self.outxml.setroot('pkglicenses')
+def parse_copyright(copyright_text):
+    """
+    Parses a copyright file.  Returns a tuple (kind, data, error):
+
+    - ('machinereadable', [(globs, licence, copyright), ...], None) for a
+      machine readable file,
+    - ('heuristics', [licence, ...], error), if only the 'License:' lines
+      could be found,
+    - (None, None, error) otherwise.
+
+    'error' is a tuple of the kind of the problem and its message.  The
+    result can be pickled, so it can be computed in another process.
+    """
+    # remove illegal characters from copyright_text
+    copyright_text, _ = remove_re.subn('', copyright_text)
+
+    # Make sure, that the text is valid unicode
+    bytesio = io.StringIO(copyright_text.encode(encoding='utf-8',
+                                                errors='replace')
+                                        .decode(encoding='utf-8',
+                                                errors='replace'))
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+
+            c = Copyright(bytesio, strict=True)
+
+            files = []
+
+            # Note!  Getters of cc can throw nasty exceptions!
+            for cc in c.all_files_paragraphs():
+                files.append((tuple(cc.files), cc.license.synopsis, cc.copyright))
+
+    except (NotMachineReadableError, MachineReadableFormatError, ValueError) as E:
+        error = ('Error', str(E))
+    except Warning as W:
+        error = ('Warning', str(W))
+    else:
+        return ('machinereadable', files, None)
+
+    bytesio.seek(0)
+
+    c = do_heuristics(bytesio)
+
+    if c is not None:
+        return ('heuristics', sorted(get_heuristics_license_list(c)), error)
+
+    # Heuristics did not find anything either
+    return (None, None, error)
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode('utf-8', errors='surrogateescape')).hexdigest()
+
+
+def copyright_executor(jobs=None):
+    """
+    Returns a process pool for CopyrightCache.parse().  The workers are
+    started by a forkserver, so they do not inherit the threads and open
+    files of the build.
+    """
+    return ProcessPoolExecutor(max_workers=jobs,
+                               mp_context=multiprocessing.get_context('forkserver'))
+
+
+class CopyrightCache:
+    """
+    Results of parse_copyright(), by the sha256 of the copyright text.
+
+    Identical copyright files in the chroot, the target and the sysroots
+    are thus parsed only once.  If 'fname' is given, the results are kept
+    there across builds.
+    """
 
-    def add_copyright_file(self, pkg_name, copyright_text):
+    def __init__(self, fname=None):
+        self.fname = fname
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        self.entries = {}
+
+        if self.fname is not None:
+            self.entries = load_pickle_cache(self.fname) or {}
+
+    def parse(self, texts, executor=None):
+        """
+        Returns the results of parse_copyright() for all 'texts'.  The
+        texts, which are not in the cache yet, are parsed in the process
+        pool 'executor'.  Without one, a pool is started for this call.
+        """
+        keys = [_sha256(text) for text in texts]
+
+        with self.lock:
+            if self.entries is None:
+                self._load()
+
+            todo = {}
+            for key, text in zip(keys, texts):
+                if key not in self.entries:
+                    todo[key] = text
+
+        if len(todo) > 1:
+            with contextlib.ExitStack() as stack:
+                if executor is None:
+                    executor = stack.enter_context(copyright_executor())
+                results = list(executor.map(parse_copyright, todo.values(), chunksize=16))
+        else:
+            results = [parse_copyright(text) for text in todo.values()]
+
+        with self.lock:
+            self.entries.update(zip(todo.keys(), results))
+            return [self.entries[key] for key in keys]
+
+    def save(self):
+        with self.lock:
+            if self.fname is None or self.entries is None:
+                return
+
+            store_pickle_cache(self.fname, self.entries)
+
+
+@contextlib.contextmanager
+def pkglicenses_writer(fname, encoding='utf-8'):
+    """
+    Writes the licence XML file 'fname' incrementally.  Yields a function,
+    which writes one 'pkglicense' element to the file.
+    """
+    with open(fname, 'wb') as f:
+        with xmlfile(f, encoding=encoding) as xf:
+            with xf.element('pkglicenses'):
+                yield xf.write
+
+        # Make sure, that we end with a newline
+        f.write(b'\n')
+
+
+class copyright_xml:
+    """
+    Writes the licence XML file 'fname'.  Every package is written, as
+    soon as it is added, so the whole document is never held in memory.
+    Use it as a context manager, or call close() at the end.
+    """
+
+    def __init__(self, fname):
+        self._stack = contextlib.ExitStack()
+        self._write = self._stack.enter_context(pkglicenses_writer(fname))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self._stack.__exit__(typ, value, traceback)
+
+    def close(self):
+        self._stack.close()
+
+    def add_copyright_file(self, pkg_name, copyright_text, parsed=None):
+        """
+        Adds the licence information of a package.  'parsed' is the result
+        of parse_copyright() for 'copyright_text', if it is already known.
+        """
+        if parsed is None:
+            parsed = parse_copyright(copyright_text)
+        kind, data, error = parsed
 
         # remove illegal characters from copyright_text
         copyright_text, _ = remove_re.subn('', copyright_text)
 
-        xmlpkg = self.pkglist.append('pkglicense')
+        xmlpkg = elem(Element('pkglicense'))
+        xmlpkg.et.tail = '\n'
         xmlpkg.et.attrib['name'] = pkg_name
         txtnode = xmlpkg.append('text')
         txtnode.et.text = copyright_text
-        # in Python2 'txtnode.et.text' is a binary string whereas in Python3 it
-        # is a unicode string. So make sure that 'txtnode.et.text' ends up as a
-        # unicode string in both Python2 and Python3.
-        bytesio = io.StringIO(txtnode.et.text.encode(encoding='utf-8',
-                                                     errors='replace')
-                                             .decode(encoding='utf-8',
-                                                     errors='replace'))
-        try:
-            with warnings.catch_warnings():
-                warnings.simplefilter('error')
-
-                c = Copyright(bytesio, strict=True)
-
-                files = []
-
-                # Note!  Getters of cc can throw nasty exceptions!
-                for cc in c.all_files_paragraphs():
-                    files.append((cc.files, cc.license.synopsis, cc.copyright))
-
-        except (NotMachineReadableError, MachineReadableFormatError, ValueError) as E:
-            logging.warning("Error in copyright of package '%s': %s", pkg_name, E)
-        except Warning as W:
-            logging.warning("Warning in copyright of package '%s' : %s", pkg_name, W)
-        else:
 
+        if error is not None:
+            logging.warning("%s in copyright of package '%s': %s", error[0], pkg_name, error[1])
+
+        if kind == 'machinereadable':
             xmlpkg.append('machinereadable')
             xmllic = xmlpkg.append('debian_licenses')
             seen = []
-            for f in files:
+            for f in data:
                 if f[1] in seen:
                     continue
                 seen.append(f[1])
@@ -95,7 +242,7 @@ class copyright_xml:
                 ll.et.text = f[1]
 
             detailed = xmlpkg.append('detailed')
-            for f in files:
+            for f in data:
                 ff = detailed.append('files')
                 for g in f[0]:
                     gg = ff.append('glob')
@@ -107,25 +254,24 @@ class copyright_xml:
                 cc = ff.append('copyright')
                 cc.et.text = f[2]
 
-            return
-
-        bytesio.seek(0)
-
-        c = do_heuristics(bytesio)
-
-        if c is not None:
-            lics = get_heuristics_license_list(c)
+        elif kind == 'heuristics':
             xmlpkg.append('heuristics')
             xmllic = xmlpkg.append('debian_licenses')
-            for i in lics:
+            for i in data:
                 ltag = xmllic.append('license')
                 ltag.et.text = i
 
-            return
+        self._write(xmlpkg.et)
+
 
-        # Heuristics did not find anything either
-        # just return
-        return
+def iter_pkglicenses(fname):
+    """
+    Yields the 'pkglicense' nodes of the licence XML file 'fname' one by
+    one.  Every node is removed from the document, as soon as the next
+    one is read, so the whole document is never held in memory.
+    """
+    for _, el in iterparse(fname, tag='pkglicense', huge_tree=True, remove_comments=True):
+        yield elem(el)
 
-    def write(self, fname):
-        self.outxml.write(fname, encoding='utf-8')
+        # Free the package, once the caller does not need it anymore
+        el.getparent().remove(el)
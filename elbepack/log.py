@@ -83,6 +83,24 @@ def reset_level(proj):
         pass
 
 
+# Threads, whose log records are accounted to another thread
+_thread_aliases: dict[int, int] = {}
+
+
+@contextmanager
+def logging_thread_alias(owner):
+    """
+    Log records of the current thread as if they were emitted
+    by the thread with the ident 'owner'.
+    """
+    ident = threading.current_thread().ident
+    _thread_aliases[ident] = owner
+    try:
+        yield
+    finally:
+        del _thread_aliases[ident]
+
+
 class ThreadFilter(logging.Filter):
 
     def __init__(self, allowed, *args, **kwargs):
@@ -96,6 +114,7 @@ class ThreadFilter(logging.Filter):
             thread = record._thread
         else:
             thread = record.thread
+        thread = _thread_aliases.get(thread, thread)
         retval = record.name in self.allowed and thread == self.thread
         if retval and not hasattr(record, 'context'):
             record.context = f'[{record.levelname}]'
@@ -0,0 +1,44 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import os
+import pickle
+import tempfile
+
+from elbepack.version import elbe_version
+
+
+def load_pickle_cache(fname, key=None):
+    """
+    Returns the data, that store_pickle_cache() has stored in 'fname'
+    with the same 'key' and elbe version, or None.
+    """
+    try:
+        with open(fname, 'rb') as f:
+            cached_key, data = pickle.load(f)
+    except (OSError, EOFError, ValueError, AttributeError, ImportError,
+            pickle.UnpicklingError):
+        return None
+
+    if cached_key != (elbe_version, key):
+        return None
+
+    return data
+
+
+def store_pickle_cache(fname, data, key=None):
+    """
+    Stores 'data' in 'fname' under 'key' and the elbe version.  The file
+    is replaced atomically, so concurrent readers and writers always see
+    a complete file.
+    """
+    fd, tmp_fname = tempfile.mkstemp(dir=os.path.dirname(fname) or '.',
+                                     prefix=os.path.basename(fname) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(((elbe_version, key), data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fname, fname)
+    except BaseException:
+        os.unlink(tmp_fname)
+        raise
@@ -0,0 +1,160 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import errno
+import fcntl
+import os
+import time
+
+from elbepack.filecopy import copy_fd
+
+default_pool_path = '/var/cache/elbe/pool'
+
+# Size of the pool, above which unused files are evicted
+default_pool_size = int(os.environ.get('ELBE_POOL_SIZE_MB', '20480')) * 2**20
+
+
+class PackagePool:
+    """
+    Content-addressed store of the .deb and source files, that have been
+    downloaded in the initvm.  The files are stored by their SHA256, as
+    listed in the Packages and Sources indices, and are hardlinked or
+    reflinked into the projects, so every file is only stored once.
+
+    The pool directory is opened once, and all operations are relative to
+    it, so the pool can still be used after entering a chroot on the same
+    filesystem.
+
+    The access time of a file is set, when it is used.  evict() removes the
+    least recently used files, which are not linked anywhere else, until
+    the pool is smaller than 'maxsize'.
+    """
+
+    def __init__(self, path=default_pool_path, maxsize=default_pool_size):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.maxsize = maxsize
+        self.fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+
+    def close(self):
+        os.close(self.fd)
+
+    @staticmethod
+    def _name(sha256):
+        return f'{sha256[:2]}/{sha256}'
+
+    def _touch(self, name):
+        st = os.stat(name, dir_fd=self.fd)
+        os.utime(name, ns=(time.time_ns(), st.st_mtime_ns), dir_fd=self.fd)
+
+    def get(self, sha256, dst):
+        """
+        Links the file with the SHA256 'sha256' to 'dst'.  Returns whether
+        the pool has the file.
+        """
+        if sha256 is None:
+            return False
+
+        name = self._name(sha256)
+        if os.path.lexists(dst):
+            os.unlink(dst)
+
+        try:
+            os.link(name, dst, src_dir_fd=self.fd)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            try:
+                src = os.open(name, os.O_RDONLY, dir_fd=self.fd)
+            except FileNotFoundError:
+                return False
+            try:
+                with open(dst, 'wb') as f:
+                    copy_fd(src, f.fileno())
+            finally:
+                os.close(src)
+
+        self._touch(name)
+        return True
+
+    def put(self, fname, sha256):
+        """
+        Adds the file 'fname' with the SHA256 'sha256' to the pool.  The
+        caller has to verify, that the file has this hash.
+        """
+        if sha256 is None:
+            return
+
+        name = self._name(sha256)
+        try:
+            os.mkdir(sha256[:2], dir_fd=self.fd)
+        except FileExistsError:
+            pass
+
+        try:
+            os.link(fname, name, dst_dir_fd=self.fd)
+        except FileExistsError:
+            pass
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            tmp = f'{name}.{os.getpid()}.tmp'
+            dst = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644, dir_fd=self.fd)
+            try:
+                with open(fname, 'rb') as f:
+                    copy_fd(f.fileno(), dst)
+            finally:
+                os.close(dst)
+            os.rename(tmp, name, src_dir_fd=self.fd, dst_dir_fd=self.fd)
+
+        self._touch(name)
+
+    def evict(self):
+        """
+        Removes the least recently used files, until the pool is smaller
+        than 'maxsize'.  Files, which are also linked into a project, are
+        kept, as removing them would not free any space.
+
+        Returns the number of removed files and bytes.
+        """
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another process is already evicting
+            return 0, 0
+
+        try:
+            total = 0
+            unused = []
+            for d in os.scandir(self.fd):
+                if not d.is_dir(follow_symlinks=False):
+                    continue
+                dfd = os.open(d.name, os.O_RDONLY | os.O_DIRECTORY, dir_fd=self.fd)
+                try:
+                    for entry in os.scandir(dfd):
+                        st = entry.stat(follow_symlinks=False)
+                        total += st.st_size
+                        if st.st_nlink == 1:
+                            unused.append((st.st_atime_ns, st.st_size, f'{d.name}/{entry.name}'))
+                finally:
+                    os.close(dfd)
+
+            removed = 0
+            freed = 0
+            for _, size, name in sorted(unused):
+                if total <= self.maxsize:
+                    break
+                try:
+                    os.unlink(name, dir_fd=self.fd)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                removed += 1
+                freed += size
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+        return removed, freed
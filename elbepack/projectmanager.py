@@ -18,6 +18,7 @@ from elbepack.asyncworker import (
     PdebuildJob,
     UpdatePbuilderJob,
 )
+from elbepack.buildcache import BuildCache
 from elbepack.db import ElbeDB, ElbeDBError
 from elbepack.log import read_loggingQ
 from elbepack.uuid7 import uuid7
@@ -42,10 +43,11 @@ def _is_uuid(s):
 
 class ProjectManager:
 
-    def __init__(self, basepath):
+    def __init__(self, basepath, jobs=1):
         self.basepath = basepath    # Base path for new projects
         self.db = ElbeDB()          # Database of projects and users
-        self.worker = AsyncWorker(self.db)
+        self.worker = AsyncWorker(self.db, jobs)
+        self.build_cache = BuildCache(path.join(basepath, 'build-cache'))
 
     def stop(self):
         self.worker.stop()
@@ -108,10 +110,14 @@ class ProjectManager:
             build_bin,
             build_src,
             skip_pbuilder,
-            base_image_path):
+            base_image_path,
+            build_cache=False,
+            jobs=1):
         ep = self.open_project(builddir, allow_busy=False)
         self.worker.enqueue(BuildJob(ep, build_bin, build_src,
-                                     skip_pbuilder, base_image_path))
+                                     skip_pbuilder, base_image_path,
+                                     self.build_cache if build_cache else None,
+                                     jobs))
 
     def update_pbuilder(self, builddir):
         ep = self.open_project(builddir, allow_busy=False)
@@ -2,6 +2,8 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2014-2017 Linutronix GmbH
 
+import contextlib
+import logging
 import os
 import pathlib
 import subprocess
@@ -24,6 +26,38 @@ def _disk_usage(root):
     return total
 
 
+def plan_volumes(sizes, maxsize, used=0):
+    """
+    Distributes items of the given sizes over volumes of 'maxsize' bytes,
+    largest first, each into the first volume with enough space left.
+    The first volume already holds 'used' bytes.  An item larger than
+    'maxsize' gets a volume of its own.
+
+    Returns the index of the volume of each item.
+
+    >>> plan_volumes([60, 30, 50, 40, 20], 100)
+    [0, 1, 1, 0, 1]
+
+    >>> plan_volumes([60, 30], 100, used=50)
+    [1, 0]
+    """
+    free = [maxsize - used]
+    plan = [None] * len(sizes)
+
+    for i in sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True):
+        for vol, space in enumerate(free):
+            if sizes[i] <= space:
+                break
+        else:
+            vol = len(free)
+            free.append(maxsize)
+
+        free[vol] -= sizes[i]
+        plan[i] = vol
+
+    return plan
+
+
 class RepoAttributes:
     def __init__(self, codename, arch, components,
                  mirror='http://deb.debian.org/debian'):
@@ -56,6 +90,9 @@ class RepoAttributes:
 
 class RepoBase:
 
+    # Number of packages included by a single reprepro call in bulk()
+    _batch_size = 512
+
     def __init__(
             self,
             path,
@@ -83,6 +120,12 @@ class RepoBase:
         self.maxsize = maxsize
         self.volume = self.get_volume_path(self.volume_count)
 
+        # Running total of the size of the current volume, measured once
+        self._volume_size = None
+
+        # Packages collected by bulk()
+        self._pending = None
+
         # if repo exists retrive the keyid otherwise
         # generate a new key and generate repository config
         if self.volume.is_dir():
@@ -109,8 +152,37 @@ class RepoBase:
     def new_repo_volume(self):
         self.volume_count += 1
         self.volume = self.get_volume_path(self.volume_count)
+        self._volume_size = None
         self.gen_repo_conf()
 
+    def _volume_usage(self):
+        if self._volume_size is None:
+            self._volume_size = _disk_usage(self.volume)
+        return self._volume_size
+
+    def _reserve(self, size):
+        # Start a new volume, if the package does not fit into the current one
+        if self.maxsize and self._volume_usage() + size > self.maxsize:
+            self.new_repo_volume()
+
+    def _reprepro_add(self, cmd, size):
+        """
+        Runs the reprepro command 'cmd', which adds files of 'size' bytes
+        to the pool, and accounts them to the current volume.  Only the
+        database of reprepro is measured again, as it grows as well.
+        """
+        if not self.maxsize:
+            do(cmd)
+            return
+
+        usage = self._volume_usage()
+        db = self.volume / 'db'
+        db_size = _disk_usage(db)
+
+        do(cmd)
+
+        self._volume_size = usage + size + _disk_usage(db) - db_size
+
     def gen_repo_conf(self):
         dists = self.volume.joinpath('conf', 'distributions')
         dists.parent.mkdir(parents=True)
@@ -175,11 +247,9 @@ class RepoBase:
             do(['reprepro', '--basedir', self.volume, 'export', att.codename],
                env_add={'GNUPGHOME': '/var/cache/elbe/gnupg'})
 
-    def _includedeb(self, path, codename, components=None, prio=None):
-        if self.maxsize:
-            new_size = _disk_usage(self.volume) + os.path.getsize(path)
-            if new_size > self.maxsize:
-                self.new_repo_volume()
+    def _includedebs(self, paths, codename, components=None, prio=None):
+        size = sum(os.path.getsize(path) for path in paths)
+        self._reserve(size)
 
         global_opt = ['--keepunreferencedfiles',
                       '--export=silent-never',
@@ -194,10 +264,17 @@ class RepoBase:
                 components = [components]
             global_opt.extend(['--component', '|'.join(components)])
 
-        do(['reprepro', *global_opt, 'includedeb', codename, path])
+        self._reprepro_add(['reprepro', *global_opt, 'includedeb', codename, *paths], size)
+
+    def _includedeb(self, path, codename, components=None, prio=None):
+        self._includedebs([path], codename, components, prio)
 
     def includedeb(self, path, components=None, pkgname=None, force=False, prio=None):
         # pkgname needs only to be specified if force is enabled
+        if self._pending is not None:
+            self._pending.append((path, components, pkgname, force, prio))
+            return
+
         try:
             self._includedeb(path, self.repo_attr.codename,
                              components=components,
@@ -216,6 +293,73 @@ class RepoBase:
             else:
                 raise ce
 
+    @contextlib.contextmanager
+    def bulk(self, ignore_errors=False):
+        """
+        Collects the packages passed to includedeb() inside of the block,
+        and includes them with one reprepro call per batch at the end of
+        the block.
+
+        If a batch fails, its packages are included one by one, with the
+        semantics of includedeb().  With 'ignore_errors', a package that
+        can not be included is logged and skipped, instead of raising.
+        """
+        self._pending = []
+        try:
+            yield self
+            pending = self._pending
+        finally:
+            self._pending = None
+
+        self._flush(pending, ignore_errors)
+
+    def _batches(self, items):
+        batch = []
+        size = 0
+        for item in items:
+            item_size = os.path.getsize(item[0])
+            if batch and (len(batch) >= self._batch_size or
+                          (self.maxsize and
+                           self._volume_usage() + size + item_size > self.maxsize)):
+                yield batch
+                batch = []
+                size = 0
+            batch.append(item)
+            size += item_size
+        if batch:
+            yield batch
+
+    def _flush(self, pending, ignore_errors):
+        # reprepro takes the component and priority once per call
+        groups = {}
+        for item in pending:
+            _, components, _, _, prio = item
+            if isinstance(components, list):
+                components = tuple(components)
+            groups.setdefault((components, prio), []).append(item)
+
+        for (components, prio), items in groups.items():
+            if isinstance(components, tuple):
+                components = list(components)
+
+            for batch in self._batches(items):
+                try:
+                    self._includedebs([item[0] for item in batch],
+                                      self.repo_attr.codename,
+                                      components=components, prio=prio)
+                    continue
+                except subprocess.CalledProcessError:
+                    # Parts of the batch may have been included
+                    self._volume_size = None
+
+                for item in batch:
+                    try:
+                        self.includedeb(*item)
+                    except subprocess.CalledProcessError:
+                        if not ignore_errors:
+                            raise
+                        logging.exception('Package %s could not be added to repo.', item[0])
+
     def _include(self, path, codename, components=None):
 
         global_opt = ['--ignore=wrongdistribution',
@@ -233,6 +377,7 @@ class RepoBase:
             global_opt.extend(['--component', '|'.join(components)])
 
         do(['reprepro', *global_opt, 'include', codename, path])
+        self._volume_size = None
 
     def _removedeb(self, pkgname, codename, components=None):
 
@@ -246,6 +391,7 @@ class RepoBase:
 
         do(['reprepro', *global_opt, 'remove', codename, pkgname],
            env_add={'GNUPGHOME': '/var/cache/elbe/gnupg'})
+        self._volume_size = None
 
     def removedeb(self, pkgname, components=None):
         self._removedeb(pkgname, self.repo_attr.codename, components)
@@ -256,6 +402,7 @@ class RepoBase:
 
         do(['reprepro', *global_opt, 'removesrc', codename, srcname],
            env_add={'GNUPGHOME': '/var/cache/elbe/gnupg'})
+        self._volume_size = None
 
     def removesrc(self, path):
         with open(path) as fp:
@@ -275,14 +422,10 @@ class RepoBase:
                     for pp in p['Binary'].split():
                         self._removedeb(pp, codename, components)
 
-    def _includedsc(self, path, codename, components=None):
-        if self.maxsize:
-            new_size = _disk_usage(self.volume) + get_dsc_size(path)
-            if new_size > self.maxsize:
-                self.new_repo_volume()
-
-        if self.maxsize and (_disk_usage(self.volume) > self.maxsize):
-            self.new_repo_volume()
+    def _includedsc(self, path, codename, components=None, size=None):
+        if self.maxsize and size is None:
+            size = get_dsc_size(path)
+        self._reserve(size)
 
         global_opt = ['--keepunreferencedfiles',
                       '--keepunusednewfiles',
@@ -297,11 +440,11 @@ class RepoBase:
                 components = [components]
             global_opt.extend(['--component', '|'.join(components)])
 
-        do(['reprepro', *global_opt, 'includedsc', codename, path])
+        self._reprepro_add(['reprepro', *global_opt, 'includedsc', codename, path], size)
 
-    def includedsc(self, path, components=None, force=False):
+    def includedsc(self, path, components=None, force=False, size=None):
         try:
-            self._includedsc(path, self.repo_attr.codename, components)
+            self._includedsc(path, self.repo_attr.codename, components, size)
         except subprocess.CalledProcessError as ce:
             if force:
                 # Including dsc did not work.
@@ -310,10 +453,50 @@ class RepoBase:
                 #
                 # Try remove, and add again.
                 self.removesrc(path)
-                self._includedsc(path, self.repo_attr.codename, components)
+                self._includedsc(path, self.repo_attr.codename, components, size)
             else:
                 raise ce
 
+    def includedscs(self, paths, components=None, force=False):
+        """
+        Includes the source packages 'paths'.  If the repository is split
+        into volumes, the packages are distributed over the current and
+        new volumes up front by plan_volumes(), instead of filling the
+        volumes in the given order.
+
+        The plan only knows the sizes of the packages, but the database of
+        reprepro and the pool directories grow as well.  If a volume is
+        full before all of its planned packages are included, the remaining
+        packages are planned again, starting with the new volume.
+        """
+        if not self.maxsize:
+            for path in paths:
+                self.includedsc(path, components, force)
+            return
+
+        pending = [(path, get_dsc_size(path)) for path in paths]
+
+        while pending:
+            plan = plan_volumes([size for _, size in pending], self.maxsize,
+                                used=self._volume_usage())
+
+            # If nothing fits into the current volume, the first include
+            # starts the next one.
+            first = min(plan)
+            volume = self.volume_count + (1 if first > 0 else 0)
+
+            current = [item for item, vol in zip(pending, plan) if vol == first]
+            pending = [item for item, vol in zip(pending, plan) if vol != first]
+
+            for i, (path, size) in enumerate(current):
+                self.includedsc(path, components, force, size)
+                if self.volume_count > volume:
+                    pending = current[i + 1:] + pending
+                    break
+            else:
+                if pending:
+                    self.new_repo_volume()
+
     def include(self, path, components=None, force=False):
         if force:
             self._remove(path, self.repo_attr.codename, components)
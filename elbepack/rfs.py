@@ -55,6 +55,21 @@ def create_apt_prefs(xml, rfs):
     write_pack_template(rfs.fname(filename), 'preferences.mako', d)
 
 
+def proxy_env(xml):
+    """
+    Returns the environment variables, which make downloads use the
+    primary proxy of the project.
+    """
+    if not xml.prj.has('mirror/primary_proxy'):
+        return {'no_proxy': '', 'http_proxy': '', 'https_proxy': ''}
+
+    proxy = xml.prj.text('mirror/primary_proxy')
+    proxy = proxy.strip().replace('LOCALMACHINE', '10.0.2.2')
+    return {'no_proxy': '10.0.2.2,localhost,127.0.0.1',
+            'http_proxy': proxy,
+            'https_proxy': proxy}
+
+
 class DebootstrapException (Exception):
     def __init__(self):
         super().__init__('Debootstrap Failed')
@@ -253,27 +268,22 @@ class BuildEnv:
 
         return strapcmd, keyring
 
+    def proxy_env(self):
+        return proxy_env(self.xml)
+
     def debootstrap(self, arch='default'):
 
         cleanup = False
         suite = self.xml.prj.text('suite')
 
-        if self.xml.prj.has('mirror/primary_proxy'):
-            os.environ['no_proxy'] = '10.0.2.2,localhost,127.0.0.1'
-            proxy = self.xml.prj.text('mirror/primary_proxy')
-            proxy = proxy.strip().replace('LOCALMACHINE', '10.0.2.2')
-            os.environ['http_proxy'] = proxy
-            os.environ['https_proxy'] = proxy
-        else:
-            os.environ['no_proxy'] = ''
-            os.environ['http_proxy'] = ''
-            os.environ['https_proxy'] = ''
-
-        os.environ['LANG'] = 'C'
-        os.environ['LANGUAGE'] = 'C'
-        os.environ['LC_ALL'] = 'C'
-        os.environ['DEBIAN_FRONTEND'] = 'noninteractive'
-        os.environ['DEBONF_NONINTERACTIVE_SEEN'] = 'true'
+        # Several projects may be built concurrently by the daemon, so the
+        # environment is passed to the commands instead of os.environ.
+        env = self.proxy_env()
+        env.update({'LANG': 'C',
+                    'LANGUAGE': 'C',
+                    'LC_ALL': 'C',
+                    'DEBIAN_FRONTEND': 'noninteractive',
+                    'DEBONF_NONINTERACTIVE_SEEN': 'true'})
 
         logging.info('Debootstrap log')
 
@@ -290,7 +300,7 @@ class BuildEnv:
             cmd, keyring = self._strapcmd(arch, suite, cross, mmdebstrap)
             if keyring and self.xml.has('project/mirror/cdrom'):
                 self.convert_asc_to_gpg('/cdrom/targetrepo/repo.pub', '/elbe.keyring')
-            do(cmd)
+            do(cmd, env_add=env)
 
             if cross and not mmdebstrap:
                 ui = '/usr/share/elbe/qemu-elbe/' + self.xml.defs['userinterpr']
@@ -302,15 +312,17 @@ class BuildEnv:
 
                 if self.xml.has('project/noauth'):
                     chroot(self.rfs.path,
-                           ['/debootstrap/debootstrap', '--no-check-gpg', '--second-stage'])
+                           ['/debootstrap/debootstrap', '--no-check-gpg', '--second-stage'],
+                           env_add=env)
                 else:
                     chroot(self.rfs.path,
-                           ['/debootstrap/debootstrap', '--second-stage'])
+                           ['/debootstrap/debootstrap', '--second-stage'],
+                           env_add=env)
 
             self._cleanup_bootstrap()
 
             if cross:
-                chroot(self.rfs.path, ['dpkg', '--configure', '-a'])
+                chroot(self.rfs.path, ['dpkg', '--configure', '-a'], env_add=env)
 
         except subprocess.CalledProcessError as e:
             cleanup = True
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2014-2018 Linutronix GmbH
 
+import functools
 import os
 import sys
 import time
@@ -14,9 +15,14 @@ from apt_pkg import config
 
 from elbepack.aptpkgutils import (
     APTPackage,
+    DownloadPlan,
+    archive_filename,
     fetch_source,
     get_corresponding_source_packages,
     getalldeps,
+    getdepclosure,
+    is_present,
+    sha256_of,
 )
 from elbepack.aptprogress import (
     ElbeAcquireProgress,
@@ -24,6 +30,17 @@ from elbepack.aptprogress import (
     ElbeOpProgress,
 )
 from elbepack.log import async_logging
+from elbepack.pkgpool import PackagePool
+
+
+# Fields of installed packages, that get_installed_fields() can return
+installed_fields = {
+    'name': lambda p: p.name,
+    'installed_version': lambda p: p.installed.version,
+    'section': lambda p: p.section,
+    'is_auto_installed': lambda p: p.is_auto_installed,
+    'source_name': lambda p: p.installed.source_name,
+}
 
 
 class MyMan(BaseManager):
@@ -65,10 +82,22 @@ class InChRootObject:
 @MyMan.register('RPCAPTCache')
 class RPCAPTCache(InChRootObject):
 
-    def __init__(self, rfs, arch, norecommend=False, noauth=True):
+    def __init__(self, rfs, arch, norecommend=False, noauth=True, env_add=None):
+
+        # The pool is outside of the chroot, so it is opened before
+        try:
+            self.pool = PackagePool()
+        except OSError as e:
+            print(f'Package pool is not available: {e}')
+            self.pool = None
 
         super().__init__(rfs)
 
+        # This runs in the process of the manager, so changing the
+        # environment does not affect other projects.
+        if env_add:
+            os.environ.update(env_add)
+
         config.set('APT::Architecture', arch)
         if norecommend:
             config.set('APT::Install-Recommends', '0')
@@ -110,6 +139,20 @@ class RPCAPTCache(InChRootObject):
                        auto_inst=not nodeps,
                        from_user=from_user)
 
+    def mark_install_pkgs(self, pkgnames, from_user=True, nodeps=False):
+        """
+        Marks all of 'pkgnames' for installation in a single call.
+        Returns a list of (pkgname, exception) for the packages, which
+        could not be marked.
+        """
+        failed = []
+        for pkgname in pkgnames:
+            try:
+                self.mark_install(pkgname, None, from_user, nodeps)
+            except (KeyError, SystemError) as e:
+                failed.append((pkgname, e))
+        return failed
+
     def mark_install_devpkgs(self, ignore_pkgs, ignore_dev_pkgs):
 
         # we don't want to ignore libc
@@ -212,22 +255,74 @@ class RPCAPTCache(InChRootObject):
         self.cache.update(fetch_progress=ElbeAcquireProgress())
         self.cache.open(progress=ElbeOpProgress())
 
+    def _marked_archives(self):
+        archives = config.find_dir('Dir::Cache::archives')
+        for p in self.cache.get_changes():
+            if p.marked_install or p.marked_upgrade or p.marked_reinstall or \
+               p.marked_downgrade:
+                pkgver = p.candidate
+                yield (os.path.join(archives, archive_filename(pkgver)),
+                       pkgver.size, pkgver._records.hashes)
+
+    def _link_archives(self):
+        """
+        Links the packages, which are about to be installed, from the
+        package pool into the archives of apt.  Returns the packages,
+        which are not in the pool.
+        """
+        if self.pool is None:
+            return []
+
+        archives = list(self._marked_archives())
+        missing = []
+        for fname, size, hashes in archives:
+            try:
+                if self.pool.get(sha256_of(hashes), fname):
+                    continue
+            except OSError as e:
+                print(f'Can not link {fname} from the package pool: {e}')
+            missing.append((fname, size, hashes))
+        print(f'{len(archives) - len(missing)} of {len(archives)} packages linked '
+              'from the package pool')
+        return missing
+
+    def _pool_archives(self, archives):
+        # apt does not verify files, which already were in its archives,
+        # so the hashes are checked before a file is added to the pool
+        for fname, size, hashes in archives:
+            try:
+                if is_present(fname, size, hashes):
+                    self.pool.put(fname, sha256_of(hashes))
+            except OSError as e:
+                print(f'Can not add {fname} to the package pool: {e}')
+        if archives:
+            removed, freed = self.pool.evict()
+            if removed:
+                print(f'Evicted {removed} files, {freed / 2**20:.1f} MiB from the package pool')
+
     def fetch_archives(self):
         print('Fetching packages...')
+        archives = self._link_archives()
         self.cache.fetch_archives(ElbeAcquireProgress())
+        self._pool_archives(archives)
 
     def commit(self):
         os.environ['DEBIAN_FRONTEND'] = 'noninteractive'
         os.environ['DEBONF_NONINTERACTIVE_SEEN'] = 'true'
         print('Commiting changes ...')
+        archives = self._link_archives()
         self.cache.commit(ElbeAcquireProgress(),
                           ElbeInstallProgress(fileno=sys.stdout.fileno()))
+        self._pool_archives(archives)
         self.cache.open(progress=ElbeOpProgress())
 
     def get_dependencies(self, pkgname):
         deps = getalldeps(self.cache, pkgname)
         return [APTPackage(self.cache[p]) for p in deps]
 
+    def get_dependency_closure(self, pkgnames):
+        return sorted(getdepclosure(self.cache, pkgnames))
+
     def get_installed_pkgs(self, section='all'):
         if section == 'all':
             pl = [APTPackage(p) for p in self.cache if p.is_installed]
@@ -236,23 +331,21 @@ class RPCAPTCache(InChRootObject):
                 p.section == section and p.is_installed)]
         return pl
 
-    def get_fileindex(self, removeprefix=None):
+    def get_installed_fields(self, fields):
         """
-        Returns a map filepath => packagename indexed by the filepath.
-        Use removeprefix to remove any prefix from the actual filepath.
+        Returns a tuple of the 'fields' (see installed_fields) for every
+        installed package, without building APTPackage objects.
         """
-        index = {}
-
-        for p in self.cache:
-            if p.is_installed:
-                for f in p.installed_files:
-                    if removeprefix and f.startswith(removeprefix):
-                        unprefixed = f[len(removeprefix):]
-                    else:
-                        unprefixed = f
-                    index[unprefixed] = p.name
+        getters = [installed_fields[f] for f in fields]
+        return [tuple(g(p) for g in getters) for p in self.cache if p.is_installed]
 
-        return index
+    def get_install_state(self, pkgnames):
+        """
+        Returns a dict, which maps each of 'pkgnames' to None, if the
+        package does not exist, or whether it is installed.
+        """
+        return {name: self.cache[name].is_installed if name in self.cache else None
+                for name in pkgnames}
 
     def has_pkg(self, pkgname):
         return pkgname in self.cache
@@ -280,8 +373,99 @@ class RPCAPTCache(InChRootObject):
     def download_source(self, src_name, src_version, dest_dir):
         return self.rfs.fname(fetch_source(src_name, src_version, dest_dir, ElbeAcquireProgress()))
 
+    def _run_plan(self, plan):
+        results = plan.run(ElbeAcquireProgress())
+        return ({key: r if isinstance(r, Exception) else self.rfs.fname(r)
+                 for key, r in results.items()},
+                plan.summary())
+
+    def download_binaries(self, pkgs):
+        """
+        Downloads the binary packages 'pkgs', a list of (name, version,
+        path), with a single acquire run.  The installed version is used,
+        if the version is None.
+
+        Returns a dict of the .deb file or the exception for each entry
+        of 'pkgs', and a summary of the downloads.
+        """
+        plan = DownloadPlan(self.pool)
+        for name, version, path in pkgs:
+            try:
+                p = self.cache[name]
+                pkgver = p.installed if version is None else p.versions[version]
+                if pkgver is None:
+                    raise ValueError(f'{name} is not installed')
+            except (KeyError, ValueError, TypeError) as e:
+                plan.fail((name, version, path), e)
+                continue
+            plan.add_binary((name, version, path), pkgver, path)
+
+        return self._run_plan(plan)
+
+    def download_sources(self, pkgs, dest_dir):
+        """
+        Downloads the source packages 'pkgs', a list of (name, version),
+        with a single acquire run.
+
+        Returns a dict of the .dsc file or the exception for each
+        (name, version), and a summary of the downloads.
+        """
+        plan = DownloadPlan(self.pool)
+        for name, version in pkgs:
+            plan.add_source((name, version), name, version, dest_dir)
+
+        return self._run_plan(plan)
+
+
+class CachingProxy:
+    """
+    Wraps the proxy of a RPCAPTCache and remembers the results of the
+    queries in 'cached'.  Calling any other method may change the state
+    of the cache, so it drops the remembered results.
+    """
+
+    cached = frozenset([
+        'get_installed_pkgs',
+        'get_installed_fields',
+        'get_install_state',
+        'get_dependency_closure',
+        'has_pkg',
+        'is_installed',
+        'get_pkg',
+    ])
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+        self._results = {}
+
+    def _cached_call(self, name, *args, **kwargs):
+        key = (name,
+               *(tuple(a) if isinstance(a, list) else a for a in args),
+               *sorted(kwargs.items()))
+        try:
+            result = self._results[key]
+        except KeyError:
+            result = getattr(self._proxy, name)(*args, **kwargs)
+            self._results[key] = result
+
+        if isinstance(result, (list, dict)):
+            return result.copy()
+        return result
+
+    def __getattr__(self, name):
+        if name in self.cached:
+            return functools.partial(self._cached_call, name)
+
+        method = getattr(self._proxy, name)
+
+        def _call(*args, **kwargs):
+            self._results.clear()
+            return method(*args, **kwargs)
+
+        return _call
+
 
-def get_rpcaptcache(rfs, arch, norecommend=False, noauth=True):
+def get_rpcaptcache(rfs, arch, norecommend=False, noauth=True, env_add=None):
 
     mm = MyMan()
     mm.start()
@@ -290,4 +474,4 @@ def get_rpcaptcache(rfs, arch, norecommend=False, noauth=True):
     # see the creation of MyMan.RPCAPTCache by
     # MyMan.register()
     #
-    return mm.RPCAPTCache(rfs, arch, norecommend, noauth)
+    return CachingProxy(mm.RPCAPTCache(rfs, arch, norecommend, noauth, env_add))
@@ -0,0 +1,114 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from elbepack.log import logging_thread_alias
+
+
+class Stage:
+    """
+    A build step, which runs after all stages named in 'deps' have
+    finished.  'func' is called with the results of the 'deps' as
+    positional arguments.
+    """
+
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+
+
+def _check_graph(stages):
+    names = set()
+    for stage in stages:
+        if stage.name in names:
+            raise ValueError(f'Duplicate stage {stage.name}')
+        for dep in stage.deps:
+            if dep not in names:
+                raise ValueError(f'Stage {stage.name} depends on unknown '
+                                 f'or later stage {dep}')
+        names.add(stage.name)
+
+
+def _run_stage(stage, results):
+    logging.info('Stage %s started', stage.name)
+    start = time.monotonic()
+    result = stage.func(*[results[dep] for dep in stage.deps])
+    logging.info('Stage %s finished after %.1fs', stage.name, time.monotonic() - start)
+    return result
+
+
+def run_stages(stages, jobs=1):
+    """
+    Run 'stages', with up to 'jobs' of them concurrently.
+
+    The stages have to be listed in a valid order, i.e. dependencies of
+    a stage have to be listed before the stage itself.  With 'jobs' == 1
+    all stages run in the calling thread in the listed order.
+
+    Returns a dict mapping the stage names to the results.  If a stage
+    fails, no further stages are started and the exception is raised
+    after the running stages have finished.
+
+    >>> run_stages([
+    ...     Stage('a', lambda: 1),
+    ...     Stage('b', lambda a: a + 1, deps=['a']),
+    ...     Stage('c', lambda a, b: a + b, deps=['a', 'b']),
+    ... ], jobs=2)
+    {'a': 1, 'b': 2, 'c': 3}
+
+    >>> run_stages([Stage('b', lambda a: a, deps=['a'])])
+    Traceback (most recent call last):
+    ...
+    ValueError: Stage b depends on unknown or later stage a
+    """
+    _check_graph(stages)
+
+    results = {}
+
+    if jobs <= 1:
+        for stage in stages:
+            results[stage.name] = _run_stage(stage, results)
+        return results
+
+    owner = threading.current_thread().ident
+
+    def _run(stage):
+        with logging_thread_alias(owner):
+            return _run_stage(stage, results)
+
+    pending = list(stages)
+    running = {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='stage') as executor:
+        while pending or running:
+            if error is None:
+                for stage in list(pending):
+                    if len(running) >= jobs:
+                        break
+                    if all(dep in results for dep in stage.deps):
+                        pending.remove(stage)
+                        running[executor.submit(_run, stage)] = stage
+            elif not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                except Exception as e:
+                    logging.error('Stage %s failed', stage.name)
+                    if error is None:
+                        error = e
+
+    if error is not None:
+        raise error
+
+    return results
@@ -4,27 +4,43 @@
 # SPDX-FileCopyrightText: 2016 Claudius Heine <ch@denx.de>
 
 import binascii
+import contextlib
 import fnmatch
 import functools
 import logging
 import os
 import socket
 import sys
+import threading
 import time
 from base64 import b85decode
-from http.client import BadStatusLine
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.client import BadStatusLine, HTTPConnection, HTTPException
 from urllib.error import URLError
-from urllib.request import urlopen, urlretrieve
+from urllib.parse import quote
+from urllib.request import urlopen
 
 from suds.client import Client
 
 from elbepack.cli import CliError
 from elbepack.elbexml import ElbeXML
+from elbepack.hashes import sha256sum
 from elbepack.version import elbe_version
 
 
 _logger = logging.getLogger(__name__)
 
+_transfer_chunk_size = 1024 * 1024
+
+
+class TransferError(Exception):
+    """
+    The daemon rejected a file transfer request.
+    """
+
+    def __init__(self, path, response):
+        super().__init__(f'{path}: {response.status} {response.reason}')
+
 
 class ElbeVersionMismatch(RuntimeError):
     def __init__(self, client_version, server_version):
@@ -38,6 +54,38 @@ class ElbeVersionMismatch(RuntimeError):
             raise cls(client_version, server_version)
 
 
+class _TransferProgress:
+    """
+    Reports the number of transferred bytes of concurrent transfers on
+    stderr, if it is a terminal.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.shown = 0
+        self.lock = threading.Lock()
+        self.enabled = sys.stderr.isatty()
+
+    def _show(self):
+        mib = 1024 * 1024
+        print(f'\r{self.done / mib:.1f} of {self.total / mib:.1f} MiB downloaded',
+              end='', file=sys.stderr, flush=True)
+
+    def __call__(self, nbytes):
+        with self.lock:
+            self.done += nbytes
+            now = time.monotonic()
+            if self.enabled and now - self.shown >= 1:
+                self.shown = now
+                self._show()
+
+    def finish(self):
+        if self.enabled and self.shown:
+            self._show()
+            print(file=sys.stderr)
+
+
 class ElbeSoapClient:
     def __init__(self, host, port, timeout, retries=10):
 
@@ -75,48 +123,125 @@ class ElbeSoapClient:
     def from_args(cls, args):
         return cls(args.soaphost, args.soapport, args.soaptimeout, retries=args.retries)
 
-    def _file_download_url(self, builddir, filename):
-        return f'http://{self.host}:{self.port}/repo/{builddir}/{filename}'
+    def _file_path(self, builddir, filename):
+        return quote(f'/repo/{builddir}/{filename}')
 
-    def download_file(self, builddir, filename, dst_fname):
-        # XXX the retry logic might get removed in the future, if the error
-        # doesn't occur in real world. If it occurs, we should think about
-        # the root cause instead of stupid retrying.
-        retry = 5
+    def _file_download_url(self, builddir, filename):
+        return f'http://{self.host}:{self.port}{self._file_path(builddir, filename)}'
+
+    @contextlib.contextmanager
+    def _request(self, method, path, body=None, headers=None):
+        conn = HTTPConnection(self.host, self.port, timeout=self._timeout,
+                              blocksize=_transfer_chunk_size)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            with conn.getresponse() as r:
+                yield r
+        finally:
+            conn.close()
+
+    def _remote_sha256(self, path):
+        with self._request('GET', path + '?sha256') as r:
+            if r.status != 200:
+                raise TransferError(path, r)
+            return r.read().decode('ascii')
+
+    def _transfer(self, direction, fname, func):
+        # Retry interrupted transfers. They continue at the point, where
+        # the previous attempt has stopped.
+        current_retries = 0
 
         while True:
+            current_retries += 1
             try:
-                urlretrieve(self._file_download_url(builddir, filename), dst_fname)
-                return
-            except BadStatusLine as e:
-                retry = retry - 1
-
-                print(f'get_file {filename} failed, retry {retry} times',
-                      file=sys.stderr)
-                print(str(e), file=sys.stderr)
-                print(repr(e.line), file=sys.stderr)
-
-                if not retry:
-                    print('file transfer failed', file=sys.stderr)
-                    sys.exit(170)
+                if func():
+                    return
+                _logger.warning('%s %s: checksum mismatch, restarting', direction, fname)
+            except (OSError, HTTPException) as e:
+                _logger.warning('%s %s failed: %s', direction, fname, e)
+            except TransferError as e:
+                # Retrying does not help, if the daemon refuses the transfer
+                print(f'file transfer of {fname} failed: {e}', file=sys.stderr)
+                sys.exit(170)
+
+            if current_retries > self._retries:
+                print(f'file transfer of {fname} failed', file=sys.stderr)
+                sys.exit(170)
+            time.sleep(1)
+
+    def download_file(self, builddir, filename, dst_fname, progress=None):
+        path = self._file_path(builddir, filename)
+        part_fname = dst_fname + '.part'
+
+        def _download():
+            offset = 0
+            if os.path.isfile(part_fname):
+                offset = os.path.getsize(part_fname)
+
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            with self._request('GET', path, headers=headers) as r:
+                if r.status == 416:
+                    # The partial file is larger than the remote file
+                    os.unlink(part_fname)
+                    return False
+                if r.status not in (200, 206):
+                    raise TransferError(path, r)
+
+                with open(part_fname, 'ab' if r.status == 206 else 'wb') as f:
+                    while data := r.read(_transfer_chunk_size):
+                        f.write(data)
+                        if progress:
+                            progress(len(data))
+
+            if self._remote_sha256(path) != sha256sum(part_fname):
+                os.unlink(part_fname)
+                return False
+
+            os.replace(part_fname, dst_fname)
+            return True
+
+        self._transfer('download', filename, _download)
+
+    def _is_downloaded(self, builddir, f, dst_fname):
+        if not os.path.isfile(dst_fname):
+            return False
+        if os.path.getsize(dst_fname) != getattr(f, 'size', None):
+            return False
+        path = self._file_path(builddir, f.name)
+        return sha256sum(dst_fname) == self._remote_sha256(path)
 
     def _upload_file(self, build_dir, fname, source):
-        size = 1024 * 1024
-
-        with open(source, 'rb') as f:
-
-            while True:
-
-                bin_data = f.read(size)
-                data = binascii.b2a_base64(bin_data)
-
-                if not isinstance(data, str):
-                    data = data.decode('ascii')
-
-                self.service.append_to_file(build_dir, fname, data)
-
-                if len(bin_data) != size:
-                    break
+        path = self._file_path(build_dir, fname)
+        size = os.path.getsize(source)
+        digest = sha256sum(source)
+        restart = False
+
+        def _upload():
+            nonlocal restart
+
+            with self._request('HEAD', path) as r:
+                if r.status != 200:
+                    raise TransferError(path, r)
+                offset = int(r.getheader('Content-Length'))
+
+            if restart or offset > size:
+                offset = 0
+
+            if offset < size:
+                with open(source, 'rb') as f:
+                    f.seek(offset)
+                    headers = {
+                        'Content-Length': str(size - offset),
+                        'Content-Range': f'bytes {offset}-{size - 1}/{size}',
+                    }
+                    with self._request('PUT', path, body=f, headers=headers) as r:
+                        if r.status != 204:
+                            raise TransferError(path, r)
+
+            restart = self._remote_sha256(path) != digest
+            return not restart
+
+        self._transfer('upload', fname, _upload)
 
     def wait_busy(self, project_dir):
         current_retries = 0
@@ -208,10 +333,15 @@ class ElbeSoapClient:
         self.service.finish_base_image(builddir)
         return os.path.join(builddir, fname)
 
-    def get_files(self, builddir, outdir, *, pbuilder_only=False, wildcard=None):
-        files = self.service.get_files(builddir)
-
-        for f in files[0]:
+    def get_files(self, builddir, outdir, *, pbuilder_only=False, wildcard=None, jobs=4):
+        """
+        Yields the files of the project.  If 'outdir' is given, the files
+        are downloaded into it, with up to 'jobs' downloads at a time, and
+        each file is yielded once it has been downloaded.  Files, which
+        already exist in 'outdir' with the same content, are skipped.
+        """
+        files = []
+        for f in self.service.get_files(builddir)[0]:
             if (pbuilder_only and not f.name.startswith('pbuilder_cross')
                     and not f.name.startswith('pbuilder')):
                 continue
@@ -219,13 +349,32 @@ class ElbeSoapClient:
             if wildcard and not fnmatch.fnmatch(f.name, wildcard):
                 continue
 
-            yield f
+            files.append(f)
+
+        if not outdir:
+            yield from files
+            return
+
+        dst = os.path.abspath(outdir)
+        os.makedirs(dst, exist_ok=True)
+
+        progress = _TransferProgress(sum(getattr(f, 'size', None) or 0 for f in files))
+
+        def _get(f):
+            dst_fname = str(os.path.join(dst, os.path.basename(f.name)))
+            if self._is_downloaded(builddir, f, dst_fname):
+                _logger.info('%s is up to date', f.name)
+                progress(f.size)
+            else:
+                self.download_file(builddir, f.name, dst_fname, progress)
+            return f
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_get, f) for f in files]
+            for future in as_completed(futures):
+                yield future.result()
 
-            if outdir:
-                dst = os.path.abspath(outdir)
-                os.makedirs(dst, exist_ok=True)
-                dst_fname = str(os.path.join(dst, os.path.basename(f.name)))
-                self.download_file(builddir, f.name, dst_fname)
+        progress.finish()
 
     def dump_file(self, builddir, file):
         with urlopen(self._file_download_url(builddir, file)) as r:
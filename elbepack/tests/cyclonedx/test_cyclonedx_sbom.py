@@ -4,6 +4,7 @@
 
 import json
 import pathlib
+import re
 import tempfile
 import uuid
 import warnings
@@ -80,6 +81,29 @@ def test_reference_data():
     assert error_report == reference_errors
 
 
+def test_spdx(tmp_path):
+    spdx_output = tmp_path.joinpath('sbom.spdx.json')
+    run_elbe_subcommand([
+        'cyclonedx-sbom', '--output', tmp_path.joinpath('sbom.json'),
+        '--errors', tmp_path.joinpath('errors'),
+        '--spdx', spdx_output,
+        '-m', here.joinpath('example-mapping.xml'),
+        '-d', here.joinpath('build-simple-example'),
+    ])
+    test_bom = json.loads(tmp_path.joinpath('sbom.json').read_text())
+    spdx = json.loads(spdx_output.read_text())
+
+    assert spdx['spdxVersion'] == 'SPDX-2.3'
+    assert [p['name'] for p in spdx['packages']] == [c['name'] for c in test_bom['components']]
+    assert spdx['documentDescribes'] == [p['SPDXID'] for p in spdx['packages']]
+
+    refs = {e['licenseId'] for e in spdx['hasExtractedLicensingInfos']}
+    assert len(refs) == len(spdx['hasExtractedLicensingInfos'])
+    for p in spdx['packages']:
+        for ref in re.findall(r'LicenseRef-[A-Za-z0-9.-]+', p['licenseDeclared']):
+            assert ref in refs
+
+
 @pytest.mark.parametrize('uri, expected_repository_url', [
     (
         'http://deb.debian.org/debian/pool/a/adduser/adduser_3.134_all.deb',
@@ -0,0 +1,44 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+_JobQueue = pytest.importorskip('elbepack.asyncworker')._JobQueue
+
+
+def _job(builddir):
+    return SimpleNamespace(project=SimpleNamespace(builddir=builddir))
+
+
+def test_job_queue_projects():
+    queue = _JobQueue()
+    a1, a2, b1 = _job('a'), _job('a'), _job('b')
+    for job in (a1, a2, b1):
+        queue.put(job)
+
+    assert queue.get() is a1
+    # a2 has to wait for a1, so b1 is next
+    assert queue.get() is b1
+
+    queue.task_done(a1)
+    assert queue.get() is a2
+
+
+def test_job_queue_stop():
+    queue = _JobQueue()
+    job = _job('a')
+    queue.put(job)
+    queue.stop()
+
+    assert queue.get() is job
+
+    result = []
+    t = threading.Thread(target=lambda: result.append(queue.get()))
+    t.start()
+    t.join()
+
+    assert result == [None]
@@ -0,0 +1,98 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import os
+import urllib.request
+
+from elbepack.buildcache import BuildCache, _release_opener
+
+
+def test_key():
+    cache = BuildCache('/nonexistent')
+
+    assert cache.key('stage', 'a', 'b') == cache.key('stage', 'a', 'b')
+    assert cache.key('stage', 'a', 'b') != cache.key('other', 'a', 'b')
+    assert cache.key('stage', 'ab', '') != cache.key('stage', 'a', 'b')
+
+
+def test_store_restore(tmp_path):
+    cache = BuildCache(tmp_path / 'cache')
+    key = cache.key('stage', 'input')
+
+    src = tmp_path / 'src'
+    src.mkdir()
+    src.joinpath('file').write_text('content')
+    src.joinpath('dir').mkdir()
+    src.joinpath('dir', 'nested').write_text('nested')
+
+    dst = tmp_path / 'dst'
+    dst.mkdir()
+
+    assert cache.restore('stage', key, dst) is None
+
+    cache.store('stage', key, [src / 'file', src / 'dir'])
+
+    assert cache.restore('stage', key, dst) == ['dir', 'file']
+    assert dst.joinpath('file').read_text() == 'content'
+    assert dst.joinpath('dir', 'nested').read_text() == 'nested'
+
+
+def test_prune(tmp_path):
+    cache = BuildCache(tmp_path / 'cache', max_entries=2)
+
+    src = tmp_path / 'file'
+    src.write_text('content')
+
+    keys = [cache.key('stage', i) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.store('stage', key, [src])
+        os.utime(tmp_path / 'cache' / 'stage' / key, (i, i))
+
+    cache.prune('stage')
+
+    assert sorted(os.listdir(tmp_path / 'cache' / 'stage')) == sorted(keys[1:])
+
+
+def test_store_concurrent(tmp_path, monkeypatch):
+    cache = BuildCache(tmp_path / 'cache')
+    key = cache.key('stage', 'input')
+
+    src = tmp_path / 'file'
+    src.write_text('first')
+    cache.store('stage', key, [src])
+
+    # Another build has stored the entry after the check in store()
+    entry = tmp_path / 'cache' / 'stage' / key
+    src.write_text('second')
+    isdir = os.path.isdir
+    monkeypatch.setattr(os.path, 'isdir',
+                        lambda path: False if str(path) == str(entry) else isdir(path))
+    cache.store('stage', key, [src])
+    monkeypatch.undo()
+
+    assert entry.joinpath('file').read_text() == 'first'
+    assert [e for e in os.listdir(entry.parent) if e.startswith('.')] == []
+
+
+def _proxies(opener):
+    for handler in opener.handlers:
+        if isinstance(handler, urllib.request.ProxyHandler):
+            return handler.proxies
+    # An empty ProxyHandler does not register itself
+    return {}
+
+
+def test_release_opener():
+    env = {'no_proxy': '10.0.2.2,localhost,127.0.0.1',
+           'http_proxy': 'http://10.0.2.2:3142',
+           'https_proxy': 'http://10.0.2.2:3142'}
+
+    assert _proxies(_release_opener('http://deb.debian.org/debian/dists/bookworm/', env)) == {
+        'http': 'http://10.0.2.2:3142',
+        'https': 'http://10.0.2.2:3142',
+    }
+    assert _proxies(_release_opener('http://localhost/repo/dists/bookworm/', env)) == {}
+
+    env = {'no_proxy': '', 'http_proxy': '', 'https_proxy': ''}
+    assert _proxies(_release_opener('http://deb.debian.org/debian/dists/bookworm/', env)) == {}
@@ -0,0 +1,44 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import importlib
+
+import pytest
+
+pytest.importorskip('apt_pkg')
+pytest.importorskip('pexpect')
+
+check_build = importlib.import_module('elbepack.commands.check-build')
+
+
+@pytest.mark.parametrize('s, expanded', [
+    ('-drive file=$ELBE_IMG', '-drive file=sda.img'),
+    ('-drive file=${ELBE_IMG},if=virtio', '-drive file=sda.img,if=virtio'),
+    ('$ELBE_IMG$ELBE_IMG', 'sda.imgsda.img'),
+    # Unknown variables are kept
+    ('-m $MEMORY ${UNKNOWN}', '-m $MEMORY ${UNKNOWN}'),
+    ('costs 5$', 'costs 5$'),
+])
+def test_expandvars(s, expanded):
+    assert check_build._expandvars(s, {'ELBE_IMG': 'sda.img'}) == expanded
+
+
+def test_format_steps():
+    steps = [
+        ('expect', 'login:', 10.0),
+        ('sendline', 'secret', 12.5),
+        ('expect', '#', 13.0),
+        ('EOF', None, 14.0),
+    ]
+
+    assert check_build._format_steps(steps, 20.0).splitlines() == [
+        '    2.5 s  expect login:',
+        '    0.5 s  sendline',
+        '    1.0 s  expect #',
+        '    6.0 s  EOF',
+    ]
+
+
+def test_format_steps_empty():
+    assert check_build._format_steps([], 1.0) == ''
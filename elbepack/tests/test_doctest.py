@@ -8,10 +8,11 @@ import pytest
 
 import elbepack.aptpkgutils as aptpkgutils
 import elbepack.filesystem as filesystem
+import elbepack.scheduler as scheduler
 import elbepack.shellhelper as shellhelper
 
 
-@pytest.mark.parametrize('mod', [shellhelper, aptpkgutils])
+@pytest.mark.parametrize('mod', [shellhelper, aptpkgutils, scheduler])
 def test(mod):
     fail, _ = doctest.testmod(mod)
     assert fail == 0
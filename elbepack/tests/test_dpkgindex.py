@@ -0,0 +1,86 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import textwrap
+
+import pytest
+
+from elbepack.dpkgindex import DpkgFileIndex, installed_packages
+
+
+@pytest.fixture
+def root(tmp_path):
+    info = tmp_path / 'var' / 'lib' / 'dpkg' / 'info'
+    info.mkdir(parents=True)
+
+    tmp_path.joinpath('var', 'lib', 'dpkg', 'status').write_text(textwrap.dedent("""\
+        Package: coreutils
+        Status: install ok installed
+        Architecture: amd64
+        Description: GNU core utilities
+         with a continuation line
+
+        Package: libc6
+        Status: install ok installed
+        Architecture: armhf
+        Multi-Arch: same
+
+        Package: removed
+        Status: deinstall ok config-files
+        Architecture: amd64
+        """))
+
+    info.joinpath('coreutils.list').write_text('/.\n/bin\n/bin/ls\n/usr/share/doc/coreutils\n')
+    info.joinpath('libc6:armhf.list').write_text('/.\n/usr/lib/arm-linux-gnueabihf/libc.so.6\n')
+    info.joinpath('removed.list').write_text('/etc/removed.conf\n')
+
+    return tmp_path
+
+
+def test_lookup(root):
+    index = DpkgFileIndex(str(root), 'amd64')
+
+    assert index.packages == ['coreutils', 'libc6:armhf']
+    assert index.lookup('/bin/ls') == 'coreutils'
+    # merged /usr
+    assert index.lookup('/usr/bin/ls') == 'coreutils'
+    assert index.lookup('/usr/lib/arm-linux-gnueabihf/libc.so.6') == 'libc6:armhf'
+    assert index.lookup('/etc/removed.conf') is None
+    assert index.lookup('/bin/missing') is None
+
+
+def test_cache(root, tmp_path):
+    cache_fname = str(tmp_path / 'index.pickle')
+
+    index = DpkgFileIndex.load(str(root), 'amd64', cache_fname)
+    assert index.lookup('/bin/ls') == 'coreutils'
+
+    # The cache is used, as long as the dpkg status is unchanged
+    root.joinpath('var', 'lib', 'dpkg', 'info', 'coreutils.list').write_text('/bin/cat\n')
+    assert DpkgFileIndex.load(str(root), 'amd64', cache_fname).lookup('/bin/ls') == 'coreutils'
+
+    status = root / 'var' / 'lib' / 'dpkg' / 'status'
+    status.write_text(status.read_text() + '\n')
+    index = DpkgFileIndex.load(str(root), 'amd64', cache_fname)
+    assert index.lookup('/bin/ls') is None
+    assert index.lookup('/bin/cat') == 'coreutils'
+
+
+def test_installed_packages_states(root):
+    status = root / 'var' / 'lib' / 'dpkg' / 'status'
+    status.write_text(status.read_text() + textwrap.dedent("""
+        Package: libfoo-dev
+        Status: install ok unpacked
+        Architecture: amd64
+        """))
+
+    info = root / 'var' / 'lib' / 'dpkg' / 'info'
+    assert installed_packages(str(root), 'amd64') == [
+        ('coreutils', str(info / 'coreutils.list')),
+        ('libc6:armhf', str(info / 'libc6:armhf.list')),
+        ('libfoo-dev', str(info / 'libfoo-dev.list')),
+    ]
+    assert [name for name, _ in installed_packages(str(root), 'amd64', {'installed'})] == [
+        'coreutils', 'libc6:armhf',
+    ]
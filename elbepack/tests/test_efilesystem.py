@@ -0,0 +1,43 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import os
+
+from elbepack.efilesystem import copy_filelist
+from elbepack.filesystem import Filesystem
+
+
+def test_copy_filelist(tmp_path):
+    src = Filesystem(str(tmp_path / 'src'))
+    dst = Filesystem(str(tmp_path / 'dst'))
+    dst.mkdir_p('')
+
+    src.mkdir_p('usr/lib/x86_64-linux-gnu')
+    src.mkdir_p('usr/bin')
+    src.symlink('usr/lib', 'lib')
+    src.write_file('usr/bin/bash', 0o755, 'bash')
+    src.write_file('usr/lib/x86_64-linux-gnu/libc.so.6', 0o644, 'libc')
+    src.symlink('libc.so.6', 'usr/lib/x86_64-linux-gnu/libc.so')
+    src.symlink('../bin/bash', 'usr/lib/sh')
+    # Circular symlinks
+    src.symlink('loop-b', 'usr/bin/loop-a')
+    src.symlink('loop-a', 'usr/bin/loop-b')
+    src.write_file('usr/bin/unlisted', 0o755, 'unlisted')
+    os.utime(src.fname('usr/bin'), (0, 0))
+
+    copy_filelist(src, ['/lib/x86_64-linux-gnu/libc.so\n',
+                        '/usr/lib/sh\n',
+                        '/usr/bin/loop-a\n',
+                        '/usr/bin/missing\n'], dst)
+
+    assert dst.readlink('lib') == 'usr/lib'
+    assert dst.readlink('usr/lib/x86_64-linux-gnu/libc.so') == 'libc.so.6'
+    assert dst.read_file('usr/lib/x86_64-linux-gnu/libc.so.6') == 'libc'
+    assert dst.readlink('usr/lib/sh') == '../bin/bash'
+    assert dst.read_file('usr/bin/bash') == 'bash'
+    assert os.stat(dst.fname('usr/bin/bash')).st_mode & 0o777 == 0o755
+    assert dst.readlink('usr/bin/loop-b') == 'loop-a'
+    assert not dst.lexists('usr/bin/unlisted')
+    assert not dst.lexists('usr/bin/missing')
+    assert os.stat(dst.fname('usr/bin')).st_mtime == 0
@@ -0,0 +1,69 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import os
+import stat
+
+from elbepack.filecopy import copy_file, copy_tree
+
+
+def test_copy_file(tmp_path):
+    src = tmp_path / 'src'
+    src.write_bytes(bytes(range(256)) * 1024)
+    os.chmod(src, 0o640)
+    os.utime(src, ns=(0, 10**9))
+
+    copy_file(src, tmp_path / 'dst')
+
+    dst = tmp_path / 'dst'
+    assert dst.read_bytes() == src.read_bytes()
+    assert stat.S_IMODE(dst.stat().st_mode) == 0o640
+    assert dst.stat().st_mtime_ns == 10**9
+
+
+def test_copy_tree(tmp_path):
+    src = tmp_path / 'src'
+    src.joinpath('usr/bin').mkdir(parents=True)
+    src.joinpath('usr/bin/a').write_text('a')
+    os.chmod(src / 'usr/bin/a', 0o4755)
+    os.link(src / 'usr/bin/a', src / 'usr/bin/b')
+    os.symlink('usr/bin', src / 'bin')
+    os.mkfifo(src / 'fifo')
+    src.joinpath('empty').mkdir()
+    os.chmod(src / 'empty', 0o500)
+    os.utime(src / 'usr/bin', ns=(0, 10**9))
+
+    try:
+        os.setxattr(src / 'usr/bin/a', 'user.elbe', b'test')
+        xattrs = True
+    except OSError:
+        xattrs = False
+
+    dst = tmp_path / 'dst'
+    assert copy_tree(str(src), str(dst), jobs=2) == (1, 1)
+
+    assert dst.joinpath('usr/bin/a').read_text() == 'a'
+    assert stat.S_IMODE(dst.joinpath('usr/bin/a').stat().st_mode) == 0o4755
+    assert dst.joinpath('usr/bin/a').stat().st_ino == dst.joinpath('usr/bin/b').stat().st_ino
+    assert os.readlink(dst / 'bin') == 'usr/bin'
+    assert stat.S_ISFIFO(dst.joinpath('fifo').lstat().st_mode)
+    assert stat.S_IMODE(dst.joinpath('empty').stat().st_mode) == 0o500
+    assert dst.joinpath('usr/bin').stat().st_mtime_ns == 10**9
+    if xattrs:
+        assert os.getxattr(dst / 'usr/bin/a', 'user.elbe') == b'test'
+
+
+def test_copy_tree_link(tmp_path):
+    src = tmp_path / 'src'
+    src.joinpath('pool').mkdir(parents=True)
+    src.joinpath('pool/a.deb').write_text('a')
+    src.joinpath('db').mkdir()
+    src.joinpath('db/index').write_text('i')
+
+    dst = tmp_path / 'dst'
+    assert copy_tree(str(src), str(dst), link=lambda path: '/pool/' in path) == (1, 1)
+
+    assert dst.joinpath('pool/a.deb').stat().st_ino == src.joinpath('pool/a.deb').stat().st_ino
+    assert dst.joinpath('db/index').stat().st_ino != src.joinpath('db/index').stat().st_ino
+    assert dst.joinpath('db/index').read_text() == 'i'
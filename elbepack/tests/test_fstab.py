@@ -4,6 +4,7 @@
 
 import contextlib
 import pathlib
+import stat
 import subprocess
 import xml.etree.ElementTree as ET
 
@@ -119,3 +120,16 @@ def test_mkfs_empty_tree_does_not_fail(fstype, elbevalidate, tmp_path):
     with _mkfs_and_mount(elbevalidate, fstype, tmp_path, src) as root:
         entries = [p.name for p in root.iterdir() if p.name != 'lost+found']
         assert entries == []
+
+
+def test_imagepath_walk_and_glob(elbevalidate, tmp_path, reference_tree):
+    with _mkfs_and_mount(elbevalidate, 'ext4', tmp_path, reference_tree) as root:
+        tree = {str(p): st for p, st in root.walk_lstat() if 'lost+found' not in str(p)}
+        assert sorted(tree) == ['/.hidden', '/subdir', '/subdir/nested.txt', '/visible.txt']
+        assert tree['/visible.txt'].st_size == len('data\n')
+        assert stat.S_ISDIR(tree['/subdir'].st_mode)
+
+        assert [str(p) for p in root.glob('*.txt')] == ['/visible.txt']
+        assert sorted(str(p) for p in root.glob('**/*.txt')) == [
+            '/subdir/nested.txt', '/visible.txt',
+        ]
@@ -0,0 +1,105 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import posixpath
+
+import pytest
+
+from elbepack.iso9660 import ISO9660
+
+
+def _both(n, size):
+    return n.to_bytes(size, 'little') + n.to_bytes(size, 'big')
+
+
+def _record(name, extent, size, flags):
+    pad = b'' if len(name) % 2 else b'\0'
+    length = 33 + len(name) + len(pad)
+    return (bytes([length, 0]) + _both(extent, 4) + _both(size, 4) + bytes(7) +
+            bytes([flags, 0, 0]) + _both(1, 2) + bytes([len(name)]) + name + pad)
+
+
+def _make_iso(fname, files, joliet):
+    """Writes a minimal ISO9660 image, one sector per directory"""
+    dirs = {''}
+    for path in files:
+        while path:
+            path = posixpath.dirname(path)
+            dirs.add(path)
+
+    trees = [False, True] if joliet else [False]
+    sector = 16 + len(trees) + 1
+    extents = {}
+    for tree in trees:
+        for d in sorted(dirs):
+            extents[tree, d] = sector
+            sector += 1
+    for path, content in sorted(files.items()):
+        extents[path] = sector
+        sector += max(1, -(-len(content) // 2048))
+
+    image = bytearray(sector * 2048)
+
+    def _encode(name, is_file, tree):
+        if tree:
+            return (name + (';1' if is_file else '')).encode('utf-16-be')
+        return (name.upper() + (';1' if is_file else '')).encode('ascii')
+
+    for i, tree in enumerate(trees):
+        vd = bytearray(2048)
+        vd[0] = 2 if tree else 1
+        vd[1:6] = b'CD001'
+        if tree:
+            vd[88:91] = b'%/E'
+        vd[156:156 + 34] = _record(b'\0', extents[tree, ''], 2048, 2)
+        image[(16 + i) * 2048:(17 + i) * 2048] = vd
+
+        for d in dirs:
+            data = _record(b'\0', extents[tree, d], 2048, 2) + _record(b'\1', 0, 2048, 2)
+            for sub in sorted(dirs):
+                if sub and posixpath.dirname(sub) == d:
+                    data += _record(_encode(posixpath.basename(sub), False, tree),
+                                    extents[tree, sub], 2048, 2)
+            for path, content in sorted(files.items()):
+                if posixpath.dirname(path) == d:
+                    data += _record(_encode(posixpath.basename(path), True, tree),
+                                    extents[path], len(content), 0)
+            image[extents[tree, d] * 2048:extents[tree, d] * 2048 + len(data)] = data
+
+    term = 16 + len(trees)
+    image[term * 2048:term * 2048 + 6] = b'\xffCD001'
+
+    for path, content in files.items():
+        image[extents[path] * 2048:extents[path] * 2048 + len(content)] = content
+
+    with open(fname, 'wb') as f:
+        f.write(image)
+
+
+@pytest.mark.parametrize('joliet', [False, True])
+def test_iso9660(tmp_path, joliet):
+    files = {
+        'dists/bookworm/main/binary-amd64/packages': b'Package: a\n',
+        'pool/main/a/a/a_1.0_all.deb': bytes(range(256)) * 20,
+        'readme': b'',
+    }
+    _make_iso(tmp_path / 'test.iso', files, joliet)
+
+    with ISO9660(tmp_path / 'test.iso') as iso:
+        assert iso.joliet == joliet
+        assert sorted(iso.files) == sorted(files)
+
+        for path, content in files.items():
+            with iso.open(path) as f:
+                assert f.read() == content
+
+        with iso.open('pool/main/a/a/a_1.0_all.deb') as f:
+            f.seek(4000)
+            assert f.read(10) == files['pool/main/a/a/a_1.0_all.deb'][4000:4010]
+
+
+def test_not_an_iso(tmp_path):
+    tmp_path.joinpath('test.iso').write_bytes(bytes(20 * 2048))
+    with pytest.raises(ValueError):
+        ISO9660(tmp_path / 'test.iso')
@@ -0,0 +1,94 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import io
+
+from elbepack.efilesystem import ElbeFilesystem
+from elbepack.licencexml import (
+    CopyrightCache,
+    copyright_executor,
+    copyright_xml,
+    iter_pkglicenses,
+    parse_copyright,
+)
+
+
+machine_readable = """\
+Format: https://www.debian.org/doc/packaging-manuals/copyright-format/1.0/
+Upstream-Name: a
+
+Files: *
+Copyright: 2026 Someone
+License: MIT
+ Permission is hereby granted.
+"""
+
+heuristics = """\
+This is the copyright of b.
+
+License: GPL-2
+License: BSD-3-Clause
+"""
+
+
+def test_parse_copyright():
+    assert parse_copyright(machine_readable) == (
+        'machinereadable', [(('*',), 'MIT', '2026 Someone')], None)
+
+    kind, data, error = parse_copyright(heuristics)
+    assert kind == 'heuristics'
+    assert data == ['BSD-3-Clause', 'GPL-2']
+    assert error is not None
+
+    kind, data, error = parse_copyright('nothing to see here')
+    assert kind is None
+
+
+def test_copyright_cache(tmp_path):
+    fname = str(tmp_path / 'cache.pickle')
+
+    cache = CopyrightCache(fname)
+    assert cache.parse([machine_readable, heuristics, machine_readable]) == [
+        parse_copyright(machine_readable),
+        parse_copyright(heuristics),
+        parse_copyright(machine_readable),
+    ]
+    assert len(cache.entries) == 2
+    cache.save()
+
+    cache = CopyrightCache(fname)
+    assert cache.parse([heuristics]) == [parse_copyright(heuristics)]
+    assert len(cache.entries) == 2
+
+    cache = CopyrightCache()
+    with copyright_executor(jobs=2) as executor:
+        for text in (machine_readable, heuristics):
+            assert cache.parse([text, text + '\n'], executor) == [
+                parse_copyright(text),
+                parse_copyright(text + '\n'),
+            ]
+
+
+def test_write_licenses(tmp_path):
+    rfs = ElbeFilesystem(str(tmp_path / 'rfs'))
+    rfs.mkdir_p('usr/share/doc/a')
+    rfs.mkdir_p('usr/share/doc/b')
+    rfs.write_file('usr/share/doc/a/copyright', None, machine_readable)
+    rfs.write_file('usr/share/doc/b/copyright', None, heuristics)
+
+    txt = io.StringIO()
+    xml_fname = str(tmp_path / 'licence.xml')
+    rfs.write_licenses(txt, ['a', 'b', 'c'], xml_fname,
+                       CopyrightCache(str(tmp_path / 'cache.pickle')))
+
+    with copyright_xml(str(tmp_path / 'expected.xml')) as expected:
+        expected.add_copyright_file('a', machine_readable)
+        expected.add_copyright_file('b', heuristics)
+
+    assert (tmp_path / 'licence.xml').read_text() == (tmp_path / 'expected.xml').read_text()
+    assert txt.getvalue().startswith('a:\n')
+
+    pkgs = [(p.et.attrib['name'], p.has('machinereadable'), p.text('text'))
+            for p in iter_pkglicenses(xml_fname)]
+    assert pkgs == [('a', True, machine_readable), ('b', False, heuristics)]
@@ -7,7 +7,7 @@ import io
 import pathlib
 import re
 
-from elbepack.main import run_elbe_subcommand
+from elbepack.main import import_cmd_module, run_elbe_subcommand
 
 here = pathlib.Path(__file__).parent
 
@@ -41,3 +41,35 @@ def test_parselicence(tmp_path):
 
     spdx_reference = here.joinpath('test_parselicence_reference.spdx')
     assert _replace_changing_spdx_data(spdx_output.read_text()) == spdx_reference.read_text()
+
+
+def test_nomos_scanner(tmp_path, monkeypatch):
+    calls = tmp_path.joinpath('calls')
+    nomos = tmp_path.joinpath('nomos')
+    nomos.write_text(f"""#!/bin/sh
+echo "$#" >> {calls}
+for f in "$@"; do
+    if grep -q GPL "$f"; then
+        echo "File $f contains license(s) GPL,MIT"
+    else
+        echo "File $f contains license(s) No_license_found"
+    fi
+done
+""")
+    nomos.chmod(0o755)
+    parselicence = import_cmd_module('parselicence')
+    monkeypatch.setattr(parselicence, '_nomos', str(nomos))
+    monkeypatch.setattr(parselicence.NomosScanner, 'batch_size', 2)
+
+    cache = str(tmp_path / 'nomos.pickle')
+    scanner = parselicence.NomosScanner(cache)
+    texts = ['GPL a', 'b', 'GPL a', 'c', 'd']
+    assert scanner.scan(texts) == [['GPL', 'MIT'], ['No_license_found'], ['GPL', 'MIT'],
+                                   ['No_license_found'], ['No_license_found']]
+    # 4 distinct texts in batches of 2
+    assert sorted(calls.read_text().split()) == ['2', '2']
+    scanner.save()
+
+    scanner = parselicence.NomosScanner(cache)
+    assert scanner.scan(['d', 'GPL a']) == [['No_license_found'], ['GPL', 'MIT']]
+    assert sorted(calls.read_text().split()) == ['2', '2']
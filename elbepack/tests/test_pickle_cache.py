@@ -0,0 +1,23 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import os
+
+from elbepack.pickle_cache import load_pickle_cache, store_pickle_cache
+
+
+def test_pickle_cache(tmp_path):
+    fname = str(tmp_path / 'cache.pickle')
+
+    assert load_pickle_cache(fname) is None
+
+    store_pickle_cache(fname, {'a': 1}, key=('x', 1))
+    assert load_pickle_cache(fname, key=('x', 1)) == {'a': 1}
+    assert load_pickle_cache(fname, key=('x', 2)) is None
+    assert load_pickle_cache(fname) is None
+    assert os.listdir(tmp_path) == ['cache.pickle']
+
+    # A broken file is ignored
+    (tmp_path / 'cache.pickle').write_bytes(b'garbage')
+    assert load_pickle_cache(fname, key=('x', 1)) is None
@@ -0,0 +1,40 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import os
+
+from elbepack.pkgpool import PackagePool
+
+
+def test_pkgpool(tmp_path):
+    pool = PackagePool(str(tmp_path / 'pool'), maxsize=10)
+
+    a = tmp_path / 'a.deb'
+    a.write_bytes(b'a' * 8)
+    b = tmp_path / 'b.deb'
+    b.write_bytes(b'b' * 8)
+
+    pool.put(str(a), 'aa' * 32)
+    pool.put(str(b), 'bb' * 32)
+
+    assert pool.get('aa' * 32, str(tmp_path / 'c.deb'))
+    assert tmp_path.joinpath('c.deb').stat().st_ino == a.stat().st_ino
+    assert not pool.get('cc' * 32, str(tmp_path / 'd.deb'))
+    assert not pool.get(None, str(tmp_path / 'd.deb'))
+
+    # Files, which are still linked elsewhere, are kept
+    assert pool.evict() == (0, 0)
+
+    for f in ('a.deb', 'b.deb', 'c.deb'):
+        os.unlink(tmp_path / f)
+
+    # b is used more recently than a
+    assert pool.get('bb' * 32, str(tmp_path / 'e.deb'))
+    os.unlink(tmp_path / 'e.deb')
+
+    assert pool.evict() == (1, 8)
+    assert not tmp_path.joinpath('pool', 'aa', 'aa' * 32).exists()
+    assert tmp_path.joinpath('pool', 'bb', 'bb' * 32).exists()
+
+    pool.close()
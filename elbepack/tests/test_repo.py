@@ -0,0 +1,155 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import os
+import threading
+import wsgiref.simple_server
+import wsgiref.util
+from types import SimpleNamespace
+
+import pytest
+
+import elbepack.daemons.repo
+from elbepack.soapclient import ElbeSoapClient
+
+
+class _QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(elbepack.daemons.repo, '_upload_base', str(tmp_path))
+
+    def app(environ, respond):
+        wsgiref.util.shift_path_info(environ)
+        return elbepack.daemons.repo.get_app()(environ, respond)
+
+    with wsgiref.simple_server.make_server('127.0.0.1', 0, app,
+                                           handler_class=_QuietHandler) as httpd:
+        t = threading.Thread(target=httpd.serve_forever)
+        t.start()
+        try:
+            yield ElbeSoapClient('127.0.0.1', httpd.server_port, 10, retries=2)
+        finally:
+            httpd.shutdown()
+            t.join()
+
+
+@pytest.fixture
+def builddir(tmp_path, monkeypatch):
+    monkeypatch.setattr(elbepack.daemons.repo, '_uploads', set())
+    d = tmp_path / 'project'
+    d.mkdir()
+    return d
+
+
+def test_upload_resume(client, builddir, tmp_path):
+    src = tmp_path / 'src'
+    src.write_bytes(bytes(range(256)) * 4096)
+
+    # An interrupted upload left the first part of the file
+    builddir.joinpath('upload').write_bytes(src.read_bytes()[:1000])
+    elbepack.daemons.repo.allow_upload(str(builddir), 'upload')
+
+    client._upload_file(str(builddir), 'upload', str(src))
+
+    assert builddir.joinpath('upload').read_bytes() == src.read_bytes()
+
+
+def test_upload_corrupted(client, builddir, tmp_path):
+    src = tmp_path / 'src'
+    src.write_bytes(b'content')
+
+    builddir.joinpath('upload').write_bytes(b'CONT')
+    elbepack.daemons.repo.allow_upload(str(builddir), 'upload')
+
+    client._upload_file(str(builddir), 'upload', str(src))
+
+    assert builddir.joinpath('upload').read_bytes() == b'content'
+
+
+def test_upload_forbidden(client, builddir, tmp_path):
+    src = tmp_path / 'src'
+    src.write_bytes(b'content')
+
+    # An existing file, that has not been prepared for an upload
+    builddir.joinpath('source.xml').write_bytes(b'<project/>')
+
+    with pytest.raises(SystemExit, match='170'):
+        client._upload_file(str(builddir), 'source.xml', str(src))
+
+    assert builddir.joinpath('source.xml').read_bytes() == b'<project/>'
+
+    # The upload ends with disallow_upload()
+    builddir.joinpath('upload').write_bytes(b'')
+    elbepack.daemons.repo.allow_upload(str(builddir), 'upload')
+    elbepack.daemons.repo.disallow_upload(str(builddir))
+
+    with pytest.raises(SystemExit):
+        client._upload_file(str(builddir), 'upload', str(src))
+
+
+def test_allow_upload(builddir, tmp_path, monkeypatch):
+    monkeypatch.setattr(elbepack.daemons.repo, '_upload_base', str(tmp_path))
+
+    # Not inside of a project directory
+    with pytest.raises(ValueError):
+        elbepack.daemons.repo.allow_upload(str(tmp_path), 'upload')
+
+    with pytest.raises(ValueError):
+        elbepack.daemons.repo.allow_upload(str(builddir), '../upload')
+
+
+def test_download_resume(client, builddir, tmp_path):
+    content = bytes(range(256)) * 4096
+    builddir.joinpath('file').write_bytes(content)
+
+    dst = tmp_path / 'dst'
+    tmp_path.joinpath('dst.part').write_bytes(content[:1000])
+
+    client.download_file(str(builddir), 'file', str(dst))
+
+    assert dst.read_bytes() == content
+    assert not tmp_path.joinpath('dst.part').exists()
+
+
+def test_get_files(client, builddir, tmp_path):
+    for name in ('a', 'b', 'c'):
+        builddir.joinpath(name).write_text(name * 100)
+
+    files = [SimpleNamespace(name=name, size=100, description=None)
+             for name in ('a', 'b', 'c')]
+    client.service = SimpleNamespace(get_files=lambda builddir: [files])
+
+    outdir = tmp_path / 'out'
+    outdir.mkdir()
+    outdir.joinpath('a').write_text('a' * 100)
+    os.utime(outdir / 'a', (0, 0))
+
+    got = client.get_files(str(builddir), str(outdir), wildcard='[ab]')
+
+    assert sorted(f.name for f in got) == ['a', 'b']
+    assert sorted(os.listdir(outdir)) == ['a', 'b']
+    # a was already downloaded
+    assert os.path.getmtime(outdir / 'a') == 0
+    assert outdir.joinpath('b').read_text() == 'b' * 100
+
+
+@pytest.mark.parametrize('retries', [0, 2])
+def test_transfer_retries(retries, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda s: None)
+    client = ElbeSoapClient('127.0.0.1', 0, 10, retries=retries)
+    attempts = 0
+
+    def _fail():
+        nonlocal attempts
+        attempts += 1
+        raise OSError('connection reset')
+
+    with pytest.raises(SystemExit, match='170'):
+        client._transfer('upload', 'file', _fail)
+
+    assert attempts == retries + 1
@@ -0,0 +1,71 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import doctest
+
+import pytest
+
+repomanager = pytest.importorskip('elbepack.repomanager')
+
+
+def test_doctest():
+    fail, _ = doctest.testmod(repomanager)
+    assert fail == 0
+
+
+def test_plan_volumes():
+    sizes = [300, 10, 700, 250, 400, 90, 600]
+    plan = repomanager.plan_volumes(sizes, 1000, used=100)
+
+    assert len(set(plan)) == 3
+    for vol in set(plan):
+        used = 100 if vol == 0 else 0
+        assert used + sum(s for s, v in zip(sizes, plan) if v == vol) <= 1000
+
+
+def test_plan_volumes_oversized():
+    assert repomanager.plan_volumes([2000, 10], 1000) == [1, 0]
+
+
+def _planned_repo(maxsize, overhead):
+    """
+    Returns a repository, which records the packages of each volume
+    instead of running reprepro.  Every include adds 'overhead' bytes for
+    the database of reprepro.
+    """
+    repo = object.__new__(repomanager.RepoBase)
+    repo.maxsize = maxsize
+    repo.volume_count = 0
+    repo.volume = None
+    repo.volumes = [[]]
+    repo.repo_attr = repomanager.RepoAttributes('test', 'amd64', 'main')
+    repo._volume_size = 0
+
+    def new_repo_volume():
+        repo.volume_count += 1
+        repo.volumes.append([])
+        repo._volume_size = 0
+
+    def _reprepro_add(cmd, size):
+        repo.volumes[-1].append(cmd[-1])
+        repo._volume_size += size + overhead
+
+    repo.new_repo_volume = new_repo_volume
+    repo._reprepro_add = _reprepro_add
+    return repo
+
+
+def test_includedscs_overhead(monkeypatch):
+    sizes = {'a.dsc': 500, 'b.dsc': 500, 'c.dsc': 300, 'd.dsc': 300, 'e.dsc': 200, 'f.dsc': 200}
+    monkeypatch.setattr(repomanager, 'get_dsc_size', sizes.get)
+
+    repo = _planned_repo(1000, overhead=10)
+    repo.includedscs(list(sizes))
+
+    # The overhead does not leave a volume half empty
+    assert len(repo.volumes) == 3
+    assert sorted(p for vol in repo.volumes for p in vol) == sorted(sizes)
+    for vol in repo.volumes:
+        assert vol
+        assert sum(sizes[p] + 10 for p in vol) <= 1000
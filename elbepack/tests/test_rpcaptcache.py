@@ -0,0 +1,75 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import hashlib
+import types
+
+import pytest
+
+from elbepack.pkgpool import PackagePool
+
+rpcaptcache = pytest.importorskip('elbepack.rpcaptcache')
+
+
+class _FakeCache:
+    def __init__(self):
+        self.calls = []
+        self.installed = ['a']
+
+    def get_install_state(self, pkgnames):
+        self.calls.append('get_install_state')
+        return {name: name in self.installed for name in pkgnames}
+
+    def commit(self):
+        self.calls.append('commit')
+        self.installed.append('b')
+
+
+def test_caching_proxy():
+    fake = _FakeCache()
+    cache = rpcaptcache.CachingProxy(fake)
+
+    assert cache.get_install_state(['a', 'b']) == {'a': True, 'b': False}
+    state = cache.get_install_state(['a', 'b'])
+    assert state == {'a': True, 'b': False}
+    assert fake.calls == ['get_install_state']
+
+    # Results handed out can not modify the cached ones
+    state['b'] = True
+    assert cache.get_install_state(['a', 'b']) == {'a': True, 'b': False}
+
+    cache.commit()
+    assert cache.get_install_state(['a', 'b']) == {'a': True, 'b': True}
+    assert fake.calls == ['get_install_state', 'commit', 'get_install_state']
+
+
+class _FakeHashes:
+    def __init__(self, data):
+        self.sha256 = hashlib.sha256(data).hexdigest()
+
+    def find(self, hashtype):
+        return types.SimpleNamespace(hashtype='SHA256', hashvalue=self.sha256)
+
+    def verify_file(self, fname):
+        with open(fname, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest() == self.sha256
+
+
+def test_pool_archives(tmp_path):
+    cache = object.__new__(rpcaptcache.RPCAPTCache)
+    cache.pool = PackagePool(str(tmp_path / 'pool'))
+
+    good = tmp_path / 'good.deb'
+    good.write_bytes(b'good')
+    bad = tmp_path / 'bad.deb'
+    bad.write_bytes(b'corrupt')
+
+    good_hashes = _FakeHashes(b'good')
+    bad_hashes = _FakeHashes(b'bad')
+    cache._pool_archives([(str(good), 4, good_hashes),
+                          (str(bad), 7, bad_hashes),
+                          (str(tmp_path / 'missing.deb'), 4, good_hashes)])
+
+    assert cache.pool.get(good_hashes.sha256, str(tmp_path / 'out.deb'))
+    assert not cache.pool.get(bad_hashes.sha256, str(tmp_path / 'out.deb'))
@@ -0,0 +1,48 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import io
+import tarfile
+
+import pytest
+
+
+@pytest.fixture
+def tarball(tmp_path):
+    path = tmp_path / 'rootfs.tar'
+
+    def _add(tar, name, type=tarfile.REGTYPE, data=b'', linkname=''):
+        info = tarfile.TarInfo(name)
+        info.type = type
+        info.size = len(data)
+        info.linkname = linkname
+        tar.addfile(info, io.BytesIO(data))
+
+    with tarfile.open(path, 'w') as tar:
+        _add(tar, './', tarfile.DIRTYPE)
+        _add(tar, './etc', tarfile.DIRTYPE)
+        _add(tar, './etc/hostname', data=b'old\n')
+        _add(tar, './etc/motd', tarfile.SYMTYPE, linkname='issue')
+        _add(tar, './usr', tarfile.DIRTYPE)
+        _add(tar, './usr/bin', tarfile.DIRTYPE)
+        # A later member replaces an earlier one of the same name
+        _add(tar, './etc/hostname', data=b'new\n')
+
+    return path
+
+
+def test_tarpath(elbevalidate, tarball):
+    with elbevalidate.Tar.from_file(tarball) as tar, tar.files() as root:
+        assert sorted(p.name for p in root.iterdir()) == ['etc', 'usr']
+        assert sorted(str(p) for p in root.joinpath('etc').iterdir()) == [
+            'etc/hostname', 'etc/motd',
+        ]
+        assert list(root.joinpath('usr', 'bin').iterdir()) == []
+
+        assert root.joinpath('etc').is_dir()
+        assert root.joinpath('etc', 'hostname').read_text() == 'new\n'
+        assert root.joinpath('./etc/hostname').is_file()
+        assert root.joinpath('etc', 'motd').is_symlink()
+        assert root.joinpath('etc', 'motd').readlink() == 'issue'
+        assert not root.joinpath('etc', 'shadow').exists()
@@ -0,0 +1,69 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2026 Linutronix GmbH
+
+import os
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+updatepkg = pytest.importorskip('elbepack.updatepkg')
+
+
+def test_pool_name():
+    assert updatepkg._pool_name('/var/cache/apt/archives/foo_1%3a2.0-1_amd64.deb') == \
+        'foo_2.0-1_amd64.deb'
+    assert updatepkg._pool_name('foo_2.0-1_amd64.deb') == 'foo_2.0-1_amd64.deb'
+
+
+class _FakeCache:
+    def __init__(self, rfs):
+        self.rfs = rfs
+
+    def download_binary(self, name, path, version):
+        if name == 'nodownload':
+            raise KeyError(name)
+        old_deb = self.rfs.fname(os.path.join(path, f'{name}_{version}_all.deb'))
+        with open(old_deb, 'wb') as f:
+            f.write(b'old')
+        return old_deb
+
+
+# Size of the generated delta by package, None if debdelta fails
+_delta_sizes = {'smaller': 10, 'larger': 200, 'equal': 100, 'fails': None}
+
+
+def _fake_do(cmd):
+    _, _, new_deb, delta = cmd
+    size = _delta_sizes[os.path.basename(new_deb).split('_')[0]]
+    if size is None:
+        raise subprocess.CalledProcessError(1, cmd)
+    with open(delta, 'wb') as f:
+        f.write(b'd' * size)
+
+
+def test_replace_by_deltas(tmp_path, monkeypatch):
+    monkeypatch.setattr(updatepkg, 'do', _fake_do)
+
+    rfs = SimpleNamespace(fname=lambda path: str(tmp_path / 'rfs' / path.lstrip('/')))
+    project = SimpleNamespace(buildenv=SimpleNamespace(rfs=rfs))
+
+    pooldir = tmp_path / 'repo' / 'pool' / 'main'
+    pooldir.mkdir(parents=True)
+    upgrades = []
+    for name in (*_delta_sizes, 'nodownload'):
+        (pooldir / f'{name}_2_all.deb').write_bytes(b'n' * 100)
+        upgrades.append((name, '1', f'{name}_1%3a2_all.deb'))
+    upgrades.append(('notpooled', '1', 'notpooled_2_all.deb'))
+
+    updatepkg._replace_by_deltas(project, _FakeCache(rfs), str(tmp_path / 'repo'), upgrades)
+
+    assert sorted(os.listdir(pooldir)) == [
+        'equal_2_all.deb',
+        'fails_2_all.deb',
+        'larger_2_all.deb',
+        'nodownload_2_all.deb',
+        'smaller_2_all.deb.debdelta',
+    ]
+    assert not os.path.exists(rfs.fname('/var/cache/elbe/update-base'))
@@ -8,13 +8,13 @@ import os
 import subprocess
 import sys
 import threading
+import time
+from contextlib import contextmanager
 from multiprocessing import Process
 from shutil import copy, copyfile, rmtree
 from syslog import syslog
 from zipfile import BadZipfile, ZipFile
 
-import apt
-
 import apt_pkg
 
 from packaging import version
@@ -65,6 +65,16 @@ class UpdateStatus:
         self.step = 0
         self.write_status(f'finished\t{result}')
 
+    @contextmanager
+    def timed(self, msg):
+        """
+        Logs 'msg' before, and the elapsed time after running the block.
+        """
+        self.log(msg)
+        start = time.monotonic()
+        yield
+        self.log(f'{msg} done in {time.monotonic() - start:.1f} s')
+
     def log(self, msg):
         if not msg.endswith('\n'):
             msg += '\n'
@@ -262,62 +272,61 @@ def _apply_update(fname, status):
     except BaseException:
         raise Exception(f'reading {fname} failed ')
 
-    fpl = xml.node('fullpkgs')
+    # The last entry of a package wins, like before
+    fullpkgs = {fpi.et.text: fpi for fpi in xml.node('fullpkgs')}
 
     sources = apt_pkg.SourceList()
     sources.read_main_list()
 
     status.log('initialize apt')
     apt_pkg.init()
-    cache = apt_pkg.Cache(progress=ElbeOpProgress(cb=status.log))
 
     status.set_progress(1)
-    status.log('updating package cache')
-    cache.update(ElbeAcquireProgress(cb=status.log), sources)
-    # quote from python-apt api doc: "A call to this method does not affect the
-    # current Cache object, instead a new one should be created in order to use
-    # the changed index files."
-    cache = apt_pkg.Cache(progress=ElbeOpProgress(cb=status.log))
-    depcache = apt_pkg.DepCache(cache)
-    hl_cache = apt.cache.Cache(progress=ElbeOpProgress(cb=status.log))
-    hl_cache.update(fetch_progress=ElbeAcquireProgress(cb=status.log))
+    with status.timed('updating package cache'):
+        cache = apt_pkg.Cache(progress=ElbeOpProgress(cb=status.log))
+        cache.update(ElbeAcquireProgress(cb=status.log), sources)
+        # quote from python-apt api doc: "A call to this method does not affect the
+        # current Cache object, instead a new one should be created in order to use
+        # the changed index files."
+        cache = apt_pkg.Cache(progress=ElbeOpProgress(cb=status.log))
+        depcache = apt_pkg.DepCache(cache)
 
     # go through package cache, if a package is in the fullpkg list of the XML
     #  mark the package for installation (with the specified version)
     #  if it is not mentioned in the fullpkg list purge the package out of the
-    #  system.
+    #  system.  Packages, that are not installed at all, have nothing to purge.
     status.set_progress(2)
-    status.log('calculating packages to install/remove')
-    count = len(hl_cache)
-    step = count / 10
-    i = 0
-    percent = 0
-    for p in hl_cache:
-        i = i + 1
-        if not i % step:
-            percent = percent + 10
-            status.log(str(percent) + '% - ' + str(i) + '/' + str(count))
-            status.set_progress(2, str(percent) + '%')
-
-        pkg = cache[p.name]
-        marked = False
-        for fpi in fpl:
-            if pkg.name == fpi.et.text:
-                mark_install(depcache, pkg,
-                             fpi.et.get('version'),
-                             fpi.et.get('auto'),
-                             status)
-                marked = True
-
-        if not marked:
-            depcache.mark_delete(pkg, True)
+    with status.timed('calculating packages to install/remove'):
+        pkgs = [pkg for pkg in cache.packages
+                if pkg.has_versions and
+                (pkg.current_state != apt_pkg.CURSTATE_NOT_INSTALLED or
+                 pkg.get_fullname(True) in fullpkgs)]
+
+        count = len(pkgs)
+        step = max(count // 10, 1)
+
+        # Defer the state updates of the depcache, until all packages are marked
+        with apt_pkg.ActionGroup(depcache):
+            for i, pkg in enumerate(pkgs, start=1):
+                if not i % step:
+                    percent = i * 100 // count
+                    status.log(str(percent) + '% - ' + str(i) + '/' + str(count))
+                    status.set_progress(2, str(percent) + '%')
+
+                fpi = fullpkgs.get(pkg.get_fullname(True))
+                if fpi is None:
+                    depcache.mark_delete(pkg, True)
+                else:
+                    mark_install(depcache, pkg,
+                                 fpi.et.get('version'),
+                                 fpi.et.get('auto') == 'true',
+                                 status)
 
     status.set_progress(3)
-    status.log('applying snapshot')
-    depcache.commit(ElbeAcquireProgress(cb=status.log),
-                    ElbeInstallProgress(cb=status.log))
+    with status.timed('applying snapshot'):
+        depcache.commit(ElbeAcquireProgress(cb=status.log),
+                        ElbeInstallProgress(cb=status.log))
     del depcache
-    del hl_cache
     del cache
     del sources
 
@@ -337,12 +346,33 @@ def mkdir_p(path):
 
 
 def execute(cmd, status):
-    output = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+    output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, text=True)
     for o in output.rstrip().split('\n'):
         if o:
             status.log(o)
 
 
+def apply_deltas(repo_dir, status):
+    # gen_update --delta ships binary diffs instead of some packages.
+    # debpatch rebuilds these packages from the installed old versions.
+    with rw_access(repo_dir, status):
+        for path, _, filenames in os.walk(repo_dir):
+            for f in filenames:
+                if not f.endswith('.debdelta'):
+                    continue
+                delta = os.path.join(path, f)
+                status.log('debpatch: ' + delta)
+                try:
+                    execute(['debpatch', delta, '/', delta[:-len('.debdelta')]], status)
+                except subprocess.CalledProcessError as e:
+                    for o in e.output.rstrip().split('\n'):
+                        if o:
+                            status.log(o)
+                    status.log('debpatch failed for package ' + f[:-len('.debdelta')])
+                    raise
+                os.remove(delta)
+
+
 def pre_sh(current_version, target_version, status):
     if os.path.isfile('/var/cache/elbe/' + 'pre.sh'):
         execute(
@@ -522,6 +552,14 @@ def action_select(upd_file, status):
             rmtree(prefix + 'cmd')
 
     if os.path.isdir(prefix + 'repo'):
+        try:
+            apply_deltas(prefix + 'repo', status)
+        except (OSError, subprocess.CalledProcessError) as err:
+            status.log(str(err))
+            status.set_finished('error')
+            status.log('reconstructing packages failed: ' + prefix)
+            return
+
         try:
             update_sourceslist(xml, prefix + 'repo', status)
         except Exception as err:
@@ -4,8 +4,12 @@
 
 import logging
 import os
+import re
+import subprocess
 from shutil import copyfile, copytree, rmtree
 
+from apt.package import FetchError
+
 import apt_pkg
 
 from elbepack.dump import dump_fullpkgs
@@ -29,9 +33,69 @@ def inlucdedir(destination, directory, source, mode=None):
                 os.chmod(p, mode)
 
 
+def _pool_name(deb):
+    # reprepro leaves the epoch out of the file names in the pool
+    return re.sub(r'_[0-9]+%3a', '_', os.path.basename(deb))
+
+
+def _replace_by_deltas(project, cache, repodir, upgrades):
+    """
+    Replaces the upgraded packages in the pool of the update repository
+    by binary diffs against their versions in the base XML.  The index of
+    the repository still describes the complete packages, which
+    elbe-updated reconstructs from the installed files of the old versions.
+    A package is kept, if no diff can be generated, or it is not smaller.
+    """
+    pool = {}
+    for dirpath, _, filenames in os.walk(os.path.join(repodir, 'pool')):
+        for f in filenames:
+            pool[f] = os.path.join(dirpath, f)
+
+    basedir = '/var/cache/elbe/update-base'
+    os.makedirs(project.buildenv.rfs.fname(basedir), exist_ok=True)
+
+    saved = 0
+    try:
+        for name, version, deb in upgrades:
+            pooled = pool.get(_pool_name(deb))
+            if pooled is None:
+                logging.warning('Package %s not found in the update repository', deb)
+                continue
+
+            try:
+                old_deb = cache.download_binary(name, basedir, version)
+            except (KeyError, ValueError, FetchError):
+                logging.warning('Package %s-%s could not be downloaded, no delta',
+                                name, version)
+                continue
+
+            delta = pooled + '.debdelta'
+            try:
+                do(['debdelta', old_deb, pooled, delta])
+            except subprocess.CalledProcessError:
+                pass
+
+            if not os.path.exists(delta) or \
+                    os.path.getsize(delta) >= os.path.getsize(pooled):
+                logging.info('Package full: %s', os.path.basename(pooled))
+                if os.path.exists(delta):
+                    os.remove(delta)
+                continue
+
+            logging.info('Package delta: %s (%d instead of %d bytes)',
+                         os.path.basename(pooled),
+                         os.path.getsize(delta), os.path.getsize(pooled))
+            saved += os.path.getsize(pooled) - os.path.getsize(delta)
+            os.remove(pooled)
+    finally:
+        rmtree(project.buildenv.rfs.fname(basedir), ignore_errors=True)
+
+    logging.info('Deltas reduce the update by %.1f MiB', saved / 2**20)
+
+
 def gen_update_pkg(project, xml_filename, upd_filename,
                    override_buildtype=None, skip_validate=False, debug=False,
-                   cmd_dir=None, cfg_dir=None):
+                   cmd_dir=None, cfg_dir=None, delta=False):
 
     if xml_filename:
         xml = ElbeXML(xml_filename, buildtype=override_buildtype,
@@ -43,6 +107,11 @@ def gen_update_pkg(project, xml_filename, upd_filename,
         if not project.xml.has('fullpkgs'):
             raise MissingData('Source Xml does not have fullpkgs list')
 
+        # The target needs debpatch to reconstruct the packages
+        if delta and 'debdelta' not in [p.et.text for p in xml.node('/fullpkgs')]:
+            raise MissingData('Xml does not have debdelta in its fullpkgs list, '
+                              'which is required for --delta')
+
         if not project.buildenv.rfs:
             raise MissingData('Target does not have a build environment')
 
@@ -58,6 +127,7 @@ def gen_update_pkg(project, xml_filename, upd_filename,
         xmlindex = {}
 
         fnamelist = []
+        upgrades = []
 
         for p in xmlpkgs:
             name = p.et.text
@@ -83,6 +153,7 @@ def gen_update_pkg(project, xml_filename, upd_filename,
             if comp > 0:
                 logging.info('Package upgrade: %s', pfname)
                 fnamelist.append(pfname)
+                upgrades.append((name, ver, pfname))
             else:
                 logging.info('Package downgrade: %s-%s',
                              name, ipkg.installed_version)
@@ -107,15 +178,19 @@ def gen_update_pkg(project, xml_filename, upd_filename,
 
         repo = UpdateRepo(xml, repodir)
 
-        for fname in fnamelist:
-            path = os.path.join(
-                project.chrootpath,
-                'var/cache/apt/archives',
-                fname)
-            repo.includedeb(path)
+        with repo.bulk():
+            for fname in fnamelist:
+                path = os.path.join(
+                    project.chrootpath,
+                    'var/cache/apt/archives',
+                    fname)
+                repo.includedeb(path)
 
         repo.finalize()
 
+        if delta:
+            _replace_by_deltas(project, cache, repodir, upgrades)
+
         dump_fullpkgs(project.xml, project.buildenv.rfs, cache)
 
         project.xml.xml.write(os.path.join(update, 'new.xml'))
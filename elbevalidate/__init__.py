@@ -30,7 +30,7 @@ import typing
 import guestfs
 
 from elbevalidate.constants import GPTPartitionType, PartitionLabel
-from elbevalidate.path import ImagePath, TarPath
+from elbevalidate.path import ImagePath, TarIndex, TarPath
 
 
 class BlockDevice(abc.ABC):
@@ -232,6 +232,7 @@ class Image(BlockDevice):
 class Tar:
     def __init__(self, tar):
         self._tar = tar
+        self._index = TarIndex(tar)
 
     @classmethod
     @contextlib.contextmanager
@@ -242,7 +243,7 @@ class Tar:
 
     @contextlib.contextmanager
     def files(self):
-        yield TarPath(tar=self._tar)
+        yield TarPath(tar=self._tar, index=self._index)
 
 
 # This is a module-level API in the stdlib, so we do the same here.
@@ -7,9 +7,13 @@ Classes mimicking :py:class:`pathlib.Path` that operate on files within a libgue
 """
 
 import contextlib
+import fnmatch
+import functools
 import io
 import os
 import pathlib
+import stat
+import tempfile
 
 
 class _PurePath:
@@ -114,6 +118,23 @@ def _guestfs_ctx():
         raise
 
 
+def _is_magic(segment):
+    return any(c in segment for c in '*?[')
+
+
+def _glob_match(parts, pattern):
+    """
+    Matches the path segments 'parts' against the glob segments 'pattern'.
+    '**' matches any number of segments.
+    """
+    if not pattern:
+        return not parts
+    if pattern[0] == '**':
+        return any(_glob_match(parts[i:], pattern[1:]) for i in range(len(parts) + 1))
+    return (bool(parts) and fnmatch.fnmatchcase(parts[0], pattern[0]) and
+            _glob_match(parts[1:], pattern[1:]))
+
+
 class ImagePath(Path):
     """
     Reference to a path inside a :py:class:`elbevalidate.BlockDevice`.
@@ -135,11 +156,76 @@ class ImagePath(Path):
                 root=self.root,
         )
 
+    # Number of paths passed to libguestfs in a single lstatnslist call
+    _lstat_batch = 4096
+
     def iterdir(self):
         with _guestfs_ctx():
             for entry in self._guestfs.ls(self._path):
                 yield self / entry
 
+    def _find(self):
+        with tempfile.NamedTemporaryFile(prefix='elbe-find-') as f:
+            with _guestfs_ctx():
+                self._guestfs.find0(self._path, f.name)
+            names = f.read().split(b'\0')
+        return [os.fsdecode(n) for n in names if n]
+
+    def walk_lstat(self):
+        """
+        Iterates over all paths below this directory, recursively, together
+        with their :py:func:`os.lstat` results.
+
+        The whole subtree is listed by a single libguestfs call, and the
+        paths are stat'ed in batches, instead of one call per path.
+        """
+        names = self._find()
+        for i in range(0, len(names), self._lstat_batch):
+            batch = names[i:i + self._lstat_batch]
+            with _guestfs_ctx():
+                stats = self._guestfs.lstatnslist(self._path, batch)
+            for name, gstat in zip(batch, stats):
+                yield self / name, self._convert_stat(gstat)
+
+    def glob(self, pattern):
+        """
+        Iterates over the paths below this directory, which match 'pattern',
+        like :py:meth:`pathlib.Path.glob`.
+
+        A pattern containing ``**`` is matched against a single recursive
+        listing of this directory.  Otherwise the matching directories are
+        listed level by level.
+        """
+        segments = pathlib.PurePosixPath(pattern).parts
+
+        if '**' in segments:
+            if _glob_match((), segments):
+                yield self
+            for path, st in self.walk_lstat():
+                if segments[-1] == '**' and not stat.S_ISDIR(st.st_mode):
+                    continue
+                if _glob_match(path._p.relative_to(self._p).parts, segments):
+                    yield path
+            return
+
+        paths = [self]
+        for segment in segments:
+            matches = []
+            for path in paths:
+                if not _is_magic(segment):
+                    matches.append(path / segment)
+                    continue
+                try:
+                    matches.extend(p for p in path.iterdir()
+                                   if fnmatch.fnmatchcase(p.name, segment))
+                except (NotADirectoryError, FileNotFoundError):
+                    pass
+            paths = matches
+
+        for path in paths:
+            if path.exists():
+                yield path
+
     def read_bytes(self):
         with _guestfs_ctx():
             return self._guestfs.read_file(self._path)
@@ -201,15 +287,30 @@ class ImagePath(Path):
         with _guestfs_ctx():
             return self._guestfs.is_chardev(self._path)
 
-    def owner(self):
-        uid = self.stat().st_uid
-        passwd = self.root.joinpath('etc', 'passwd').read_text()
-        for line in passwd.splitlines():
+    def _read_names(self, fname):
+        names = {}
+        for line in self.joinpath('etc', fname).read_text().splitlines():
             fields = line.split(':')
-            if fields[2] == str(uid):
-                return fields[0]
+            if len(fields) > 2:
+                # The first entry of an id wins, like in getpwuid()
+                names.setdefault(fields[2], fields[0])
+        return names
+
+    @functools.cached_property
+    def _users(self):
+        return self._read_names('passwd')
+
+    @functools.cached_property
+    def _groups(self):
+        return self._read_names('group')
+
+    def owner(self):
+        uid = str(self.stat().st_uid)
+        return self.root._users[uid]
 
-        raise KeyError(str(uid))
+    def group(self):
+        gid = str(self.stat().st_gid)
+        return self.root._groups[gid]
 
     def _statvfs(self):
         with _guestfs_ctx():
@@ -222,28 +323,54 @@ class ImagePath(Path):
         ])
 
 
+class TarIndex:
+    """
+    Directory tree of the members of a :py:class:`tarfile.TarFile`.
+
+    The members are looked up by their normalized name, so ``etc/hostname``
+    and ``./etc/hostname`` are the same entry.  Like
+    :py:meth:`tarfile.TarFile.getmember`, the last occurrence of a name wins.
+    """
+
+    def __init__(self, tar):
+        self.members = {}
+        self.children = {}
+
+        for member in tar.getmembers():
+            name = os.path.normpath(member.name)
+            if name not in self.members:
+                parent = os.path.dirname(name) or '.'
+                if parent != name:
+                    self.children.setdefault(parent, []).append(os.path.basename(name))
+            self.members[name] = member
+
+    def getmember(self, path):
+        return self.members[os.path.normpath(path)]
+
+    def listdir(self, path):
+        return self.children.get(os.path.normpath(path), [])
+
+
 class TarPath(Path):
     """
     Reference to a path inside a :py:class:`tarfile.TarFile`.
 
     For documentation see :py:mod:`pathlib`.
     """
-    def __init__(self, *pathsegments, tar):
+    def __init__(self, *pathsegments, tar, index=None):
         self.tar = tar
         self._p = pathlib.PurePosixPath(*pathsegments)
+        self._index = index or TarIndex(tar)
 
     def _create_from_posixpath(self, p):
         return type(self)(
                 p,
                 tar=self.tar,
+                index=self._index,
         )
 
     def _info(self):
-        try:
-            member = self.tar.getmember(self._path)
-        except KeyError:
-            member = self.tar.getmember('./' + self._path)
-        return member
+        return self._index.getmember(self._path)
 
     def read_bytes(self):
         with self.tar.extractfile(self._info()) as f:
@@ -269,10 +396,8 @@ class TarPath(Path):
         return self._info().isdir()
 
     def iterdir(self):
-        dir = os.path.normpath(self._path)
-        for entry in self.tar.getnames():
-            if os.path.normpath(os.path.dirname(entry)) == dir:
-                yield self._create_from_posixpath(entry)
+        for name in self._index.listdir(self._path):
+            yield self._create_from_posixpath(self._p / name)
 
     def is_symlink(self):
         return self._info().issym()